@@ -444,39 +444,42 @@ if __name__ == '__main__':
     config = dict()
     config['n_users'] = data_generator.n_users
     config['n_items'] = data_generator.n_items
+    if args.n_negs > 1 or args.hard_neg > 0:
+        raise ValueError('n_negs > 1 and hard negatives are only supported by LightGCN.')
+    if args.sample_workers > 0:
+        data_generator.start_prefetch(args.sample_workers, args.prefetch_depth)
 
     """
     *********************************************************
     Generate the Laplacian matrix, where each entry defines the decay factor (e.g., p_ui) between two connected nodes.
     """
-    plain_adj, norm_adj, mean_adj,pre_adj = data_generator.get_adj_mat()
+    use_cache = args.adj_cache == 1
+    plain_adj = data_generator.get_adj_mat('plain', use_cache)
     config['plain_adj'] = plain_adj
     degree = np.array(plain_adj.sum(1))
     print(degree)
     print(degree.shape)
     config['degree'] = degree
+    pre_adj = data_generator.get_adj_mat('pre', use_cache)
     config['degree_k2']=np.array(pre_adj.sum(1))
     if args.adj_type == 'plain':
         config['norm_adj'] = plain_adj
         print('use the plain adjacency matrix')
 
     elif args.adj_type == 'norm':
-        config['norm_adj'] = norm_adj
+        config['norm_adj'] = data_generator.get_adj_mat('norm', use_cache)
         print('use the normalized adjacency matrix')
     
     elif args.adj_type == 'gcmc':
-        config['norm_adj'] = mean_adj
+        config['norm_adj'] = data_generator.get_adj_mat('gcmc', use_cache)
         print('use the gcmc adjacency matrix')
-    elif args.adj_type=='ngcf_pre':
-        config['norm_adj']=ngcf_pre_adj
-        print('use the ngcf_pre adjcency matrix')
     elif args.adj_type=='pre':
         config['norm_adj']=pre_adj
         print('use the pre adjcency matrix')
 
 
     else:
-        config['norm_adj'] = mean_adj + sp.eye(mean_adj.shape[0])
+        config['norm_adj'] = data_generator.get_adj_mat('mean', use_cache)
         print('use the mean adjacency matrix')
     t0 = time()
 
@@ -559,16 +562,16 @@ if __name__ == '__main__':
         ensureDir(report_path)
         f = open(report_path, 'w')
         f.write(
-            'embed_size=%d, lr=%.4f, layer_size=%s, keep_prob=%s, regs=%s, loss_type=%s, adj_type=%s\n'
-            % (args.embed_size, args.lr, args.layer_size, args.keep_prob, args.regs, args.loss_type, args.adj_type))
-
-        for i, users_to_test in enumerate(users_to_test_list):
-            ret = test(sess, model, users_to_test, drop_flag=True)
-
-            final_perf = "recall=[%s], precision=[%s], hit=[%s], ndcg=[%s]" % \
+            'embed_size=%d, lr=%.4f, layer_size=%s, node_dropout=%s, mess_dropout=%s, regs=%s, loss=%s, adj_type=%s\n'
+            % (args.embed_size, args.lr, args.layer_size, args.node_dropout, args.mess_dropout, args.regs, args.loss,
+               args.adj_type))
+
+        # every test user is scored once; the groups only select rows of the metrics
+        rets = test_groups(sess, model, users_to_test_list, drop_flag=True)
+        for i, ret in enumerate(rets):
+            final_perf = "recall=[%s], hit=[%s], ndcg=[%s]" % \
                          ('\t'.join(['%.5f' % r for r in ret['recall']]),
-                          '\t'.join(['%.5f' % r for r in ret['precision']]),
-                          '\t'.join(['%.5f' % r for r in ret['hit_ratio']]),
+                          '\t'.join(['%.5f' % r for r in ret['hr']]),
                           '\t'.join(['%.5f' % r for r in ret['ndcg']]))
             print(final_perf)
 
@@ -605,17 +608,18 @@ if __name__ == '__main__':
 #     train_writer.add_summary(summary_test_acc, 0)
 #     print(111)
 
+    # parsed once rather than on every step
+    node_dropout, mess_dropout = eval(args.node_dropout), eval(args.mess_dropout)
     for epoch in range(args.epoch):
         t1 = time()
         loss, mf_loss, emb_loss, reg_loss = 0., 0., 0., 0.
-        n_batch = data_generator.n_train // args.batch_size + 1
+        n_batch = data_generator.n_batches()
         loss_test,mf_loss_test,emb_loss_test,reg_loss_test=0.,0.,0.,0.
-        for idx in range(n_batch):
-            users, pos_items, neg_items = data_generator.sample()
+        for users, pos_items, neg_items in data_generator.train_batches():
             _, batch_loss, batch_mf_loss, batch_emb_loss, batch_reg_loss = sess.run([model.opt, model.loss, model.mf_loss, model.emb_loss, model.reg_loss],
                                feed_dict={model.users: users, model.pos_items: pos_items,
-                                          model.node_dropout: eval(args.node_dropout),
-                                          model.mess_dropout: eval(args.mess_dropout),
+                                          model.node_dropout: node_dropout,
+                                          model.mess_dropout: mess_dropout,
                                           model.neg_items: neg_items})
             loss += batch_loss/n_batch
             mf_loss += batch_mf_loss/n_batch
@@ -655,8 +659,8 @@ if __name__ == '__main__':
                 [model.loss, model.mf_loss, model.emb_loss],
                 feed_dict={model.users: users, model.pos_items: pos_items,
                            model.neg_items: neg_items,
-                          model.node_dropout: eval(args.node_dropout),
-                                          model.mess_dropout: eval(args.mess_dropout)})
+                          model.node_dropout: node_dropout,
+                                          model.mess_dropout: mess_dropout})
             loss_test += batch_loss_test / n_batch
             mf_loss_test += batch_mf_loss_test / n_batch
             emb_loss_test += batch_emb_loss_test / n_batch
@@ -707,6 +711,7 @@ if __name__ == '__main__':
             save_saver.save(sess, weights_save_path + '/weights', global_step=epoch)
             print('save the weights in path: ', weights_save_path)
 
+    data_generator.stop_prefetch()
     recs = np.array(rec_loger)
     pres = np.array(pre_loger)
     ndcgs = np.array(ndcg_loger)
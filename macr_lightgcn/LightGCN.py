@@ -12,11 +12,11 @@ C++ evaluation for top-k recommendation
 
 import os
 import sys
-import threading
 import tensorflow as tf
 from tensorflow.python.client import device_lib
 from utility.helper import *
 from utility.batch_test import *
+from utility.pipeline import batch_iterator, input_placeholder
 os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
 config = tf.ConfigProto()
 config.gpu_options.allow_growth = True
@@ -26,8 +26,47 @@ os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
 gpus = [x.name for x in device_lib.list_local_devices() if x.device_type == 'GPU']
 cpus = [x.name for x in device_lib.list_local_devices() if x.device_type == 'CPU']
 
+
+def pair_scores(users, items):
+    # user . item per row: [B] for [B, d] items, [B, n] for [B, n, d] items (one batched matmul)
+    if items.shape.ndims == 3:
+        return tf.squeeze(tf.matmul(items, tf.expand_dims(users, -1)), -1)
+    return tf.reduce_sum(tf.multiply(users, items), axis=1)
+
+
+def branch_scores(items, w):
+    # item-branch scores: [B, 1] for [B, d] items, [B, n] for [B, n, d] items
+    if items.shape.ndims == 3:
+        return tf.squeeze(tf.tensordot(items, w, axes=1), -1)
+    return tf.matmul(items, w)
+
+
+# two-branch losses: under the published 'outer' fusion their [B] scores times [B, 1] sigmoids
+# broadcast to [B, B]; 'row' keeps one fused term per row
+FUSED_LOSSES = ('bce1', 'bce2', 'bceboth')
+
+# loss variant whose rating head each --test method reads
+TEST_LOSS = {'rubi1': 'bce1', 'rubi2': 'bce2', 'rubiboth': 'bceboth'}
+
+
+def model_losses():
+    # (loss, with optimizer) pairs to build: args.loss's, plus the one whose rating head args.test reads
+    if args.all_losses:
+        return [(name, True) for name in LightGCN.losses]
+    built = [(args.loss, True)]
+    if TEST_LOSS.get(args.test, args.loss) != args.loss:
+        built.append((TEST_LOSS[args.test], False))
+    if args.pretrain == 1 and 'bceboth' not in [name for name, _ in built]:
+        # the pretrain == 1 evaluation reads the rubiboth head whatever --loss / --test are
+        built.append(('bceboth', False))
+    if args.n_negs > 1 and args.fusion != 'row' and any(name in FUSED_LOSSES for name, _ in built):
+        raise ValueError('--n_negs > 1 scores the two-branch losses row by row; pass --fusion row '
+                         '(and use it for the n_negs 1 baseline too).')
+    return built
+
+
 class LightGCN(object):
-    def __init__(self, data_config, pretrain_data):
+    def __init__(self, data_config, pretrain_data, inputs=None):
         # argument settings
         self.model_type = 'LightGCN'
         self.adj_type = args.adj_type
@@ -48,16 +87,17 @@ class LightGCN(object):
         self.log_dir=self.create_model_str()
         self.verbose = args.verbose
         self.Ks = eval(args.Ks)
+        self.n_negs = args.n_negs
 
 
         '''
         *********************************************************
         Create Placeholder for Input Data & Dropout.
         '''
-        # placeholder definition
-        self.users = tf.placeholder(tf.int32, shape=(None,))
-        self.pos_items = tf.placeholder(tf.int32, shape=(None,))
-        self.neg_items = tf.placeholder(tf.int32, shape=(None,))
+        # placeholder definition; with an input pipeline (inputs) they default to its next batch
+        self.users = input_placeholder(inputs, 0, (None,))
+        self.pos_items = input_placeholder(inputs, 1, (None,))
+        self.neg_items = input_placeholder(inputs, 2, (None,) if self.n_negs == 1 else (None, self.n_negs))
         
         self.node_dropout_flag = args.node_dropout_flag
         self.node_dropout = tf.placeholder(tf.float32, shape=[None])
@@ -145,6 +185,11 @@ class LightGCN(object):
         self.u_g_embeddings_pre = tf.nn.embedding_lookup(self.weights['user_embedding'], self.users)
         self.pos_i_g_embeddings_pre = tf.nn.embedding_lookup(self.weights['item_embedding'], self.pos_items)
         self.neg_i_g_embeddings_pre = tf.nn.embedding_lookup(self.weights['item_embedding'], self.neg_items)
+        # 'row' fusion ([B, 1, d] positives, [B, K, d] negatives): every negative of a row is scored against the
+        # row's one propagated user / positive; 'outer' keeps the published [B, d] inputs (n_negs == 1 only)
+        rows = args.fusion == 'row' or self.n_negs > 1
+        pos_i_g_column = tf.expand_dims(self.pos_i_g_embeddings, 1) if rows else self.pos_i_g_embeddings
+        neg_i_g_column = tf.expand_dims(self.neg_i_g_embeddings, 1) if rows and self.n_negs == 1 else self.neg_i_g_embeddings
 
         """
         *********************************************************
@@ -167,45 +212,43 @@ class LightGCN(object):
         *********************************************************
         Generate Predictions & Optimize via BPR loss.
         """
-        self.mf_loss, self.emb_loss, self.reg_loss = self.create_bpr_loss(self.u_g_embeddings,
-                                                                          self.pos_i_g_embeddings,
-                                                                          self.neg_i_g_embeddings)
-        self.loss = self.mf_loss + self.emb_loss
-
-        self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss)
-
-
-
-        self.mf_loss_bce, self.emb_loss_bce, self.reg_loss_bce = self.create_bce_loss(self.u_g_embeddings,
-                                                                          self.pos_i_g_embeddings,
-                                                                          self.neg_i_g_embeddings)
-        self.loss_bce = self.mf_loss_bce + self.emb_loss_bce
-        self.opt_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_bce)
-
-
-
-        self.mf_loss_two_bce1, self.emb_loss_two_bce1, self.reg_loss_two_bce1 = self.create_bce_loss_two_brach1(self.u_g_embeddings,
-                                                                          self.pos_i_g_embeddings,
-                                                                          self.neg_i_g_embeddings)
-        self.loss_two_bce1 = self.mf_loss_two_bce1 + self.emb_loss_two_bce1
-        self.opt_two_bce1 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce1)
-
-
-        self.mf_loss_two_bce_both, self.emb_loss_two_bce_both, self.reg_loss_two_bce_both = self.create_bce_loss_two_brach_both(self.u_g_embeddings,
-                                                                          self.pos_i_g_embeddings,
-                                                                          self.neg_i_g_embeddings)
-        self.loss_two_bce_both = self.mf_loss_two_bce_both + self.emb_loss_two_bce_both
-        self.opt_two_bce_both = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce_both)
-
-
+        self.loss_inputs = (self.u_g_embeddings, pos_i_g_column, neg_i_g_column)
+        # an Adam per loss would keep two slot copies of every embedding table; build the selected ones
+        for name, train in model_losses():
+            self.build_loss(name, train)
+
+    losses = ('bpr', 'bce', 'bce1', 'bceboth', 'bce2')
+
+    def build_loss(self, name, train=True):
+        # loss tensors (and rating heads) of one --loss variant; its optimizer only when train
+        if name == 'bpr':
+            self.mf_loss, self.emb_loss, self.reg_loss = self.create_bpr_loss(*self.loss_inputs)
+            self.loss = self.mf_loss + self.emb_loss
+            if train:
+                self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss)
+        elif name == 'bce':
+            self.mf_loss_bce, self.emb_loss_bce, self.reg_loss_bce = self.create_bce_loss(*self.loss_inputs)
+            self.loss_bce = self.mf_loss_bce + self.emb_loss_bce
+            if train:
+                self.opt_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_bce)
+        elif name == 'bce1':
+            self.mf_loss_two_bce1, self.emb_loss_two_bce1, self.reg_loss_two_bce1 = self.create_bce_loss_two_brach1(*self.loss_inputs)
+            self.loss_two_bce1 = self.mf_loss_two_bce1 + self.emb_loss_two_bce1
+            if train:
+                self.opt_two_bce1 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce1)
+        elif name == 'bceboth':
+            self.mf_loss_two_bce_both, self.emb_loss_two_bce_both, self.reg_loss_two_bce_both = self.create_bce_loss_two_brach_both(*self.loss_inputs)
+            self.loss_two_bce_both = self.mf_loss_two_bce_both + self.emb_loss_two_bce_both
+            if train:
+                self.opt_two_bce_both = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce_both)
+        elif name == 'bce2':
+            self.mf_loss_two_bce2, self.emb_loss_two_bce2, self.reg_loss_two_bce2 = self.create_bce_loss_two_brach2(*self.loss_inputs)
+            self.loss_two_bce2 = self.mf_loss_two_bce2 + self.emb_loss_two_bce2
+            if train:
+                self.opt_two_bce2 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce2)
+        else:
+            raise ValueError('unknown --loss %s' % name)
 
-        self.mf_loss_two_bce2, self.emb_loss_two_bce2, self.reg_loss_two_bce2 = self.create_bce_loss_two_brach2(self.u_g_embeddings,
-                                                                          self.pos_i_g_embeddings,
-                                                                          self.neg_i_g_embeddings)
-        self.loss_two_bce2 = self.mf_loss_two_bce2 + self.emb_loss_two_bce2
-        self.opt_two_bce2 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce2)
-    
-    
     def create_model_str(self):
         log_dir = '/' + self.alg_type+'/layers_'+str(self.n_layers)+'/dim_'+str(self.emb_dim)
         log_dir+='/'+args.dataset+'/lr_' + str(self.lr) + '/reg_' + str(self.decay)
@@ -393,11 +436,11 @@ class LightGCN(object):
         return u_g_embeddings, i_g_embeddings
 
     def create_bpr_loss(self, users, pos_items, neg_items):
-        pos_scores = tf.nn.sigmoid(tf.reduce_sum(tf.multiply(users, pos_items), axis=1))   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.nn.sigmoid(tf.reduce_sum(tf.multiply(users, neg_items), axis=1))
+        pos_scores = tf.nn.sigmoid(pair_scores(users, pos_items))   #users, pos_items, neg_items have the same shape
+        neg_scores = tf.nn.sigmoid(pair_scores(users, neg_items))
         
         regularizer = tf.nn.l2_loss(self.u_g_embeddings_pre) + tf.nn.l2_loss(
-                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)
+                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)/self.n_negs
         regularizer = regularizer / self.batch_size
         
         mf_loss = tf.negative(tf.reduce_mean(tf.log(1e-9+tf.nn.sigmoid(pos_scores - neg_scores))))
@@ -410,11 +453,11 @@ class LightGCN(object):
         return mf_loss, emb_loss, reg_loss
 
     def create_bce_loss(self, users, pos_items, neg_items):
-        pos_scores = tf.nn.sigmoid(tf.reduce_sum(tf.multiply(users, pos_items), axis=1))   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.nn.sigmoid(tf.reduce_sum(tf.multiply(users, neg_items), axis=1))
+        pos_scores = tf.nn.sigmoid(pair_scores(users, pos_items))   #users, pos_items, neg_items have the same shape
+        neg_scores = tf.nn.sigmoid(pair_scores(users, neg_items))
 
         regularizer = tf.nn.l2_loss(self.u_g_embeddings_pre) + tf.nn.l2_loss(
-                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)
+                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)/self.n_negs
         regularizer = regularizer/self.batch_size
 
         mf_loss = tf.reduce_mean(tf.negative(tf.log(pos_scores+1e-9))+tf.negative(tf.log(1-neg_scores+1e-9)))
@@ -427,15 +470,15 @@ class LightGCN(object):
 
 
     def create_bce_loss_two_brach1(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item score
         # pos_items_stop = tf.stop_gradient(pos_items)
         # neg_items_stop = tf.stop_gradient(neg_items)
         pos_items_stop = pos_items
         neg_items_stop = neg_items
-        self.pos_item_scores = tf.matmul(pos_items_stop, self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop, self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         self.rubi_ratings1 = (self.batch_ratings-self.rubi_c)*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         self.direct_minus_ratings1 = self.batch_ratings-self.rubi_c*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # first branch
@@ -449,7 +492,7 @@ class LightGCN(object):
         mf_loss = self.mf_loss_ori + self.alpha*self.mf_loss_item
         # regular
         regularizer = tf.nn.l2_loss(self.u_g_embeddings_pre) + tf.nn.l2_loss(
-                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)
+                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)/self.n_negs
         regularizer = regularizer/self.batch_size
         emb_loss = self.decay * regularizer
 
@@ -458,15 +501,15 @@ class LightGCN(object):
         return mf_loss, emb_loss, reg_loss
 
     def create_bce_loss_two_brach2(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item score
         # pos_items_stop = tf.stop_gradient(self.pos_i_g_embeddings_pre)
         # neg_items_stop = tf.stop_gradient(self.neg_i_g_embeddings_pre)
         pos_items_stop = self.pos_i_g_embeddings_pre
         neg_items_stop = self.neg_i_g_embeddings_pre
-        self.pos_item_scores = tf.matmul(pos_items_stop, self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop, self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         self.rubi_ratings2 = (self.batch_ratings-self.rubi_c)*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         self.direct_minus_ratings2 = self.batch_ratings-self.rubi_c*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # first branch
@@ -480,7 +523,7 @@ class LightGCN(object):
         mf_loss = self.mf_loss_ori + self.alpha*self.mf_loss_item
         # regular
         regularizer = tf.nn.l2_loss(self.u_g_embeddings_pre) + tf.nn.l2_loss(
-                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)
+                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)/self.n_negs
         regularizer = regularizer/self.batch_size
         emb_loss = self.decay * regularizer
 
@@ -490,16 +533,16 @@ class LightGCN(object):
 
 
     def create_bce_loss_two_brach_both(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item score
         # pos_items_stop = tf.stop_gradient(pos_items)
         # neg_items_stop = tf.stop_gradient(neg_items)
         pos_items_stop = pos_items
         neg_items_stop = neg_items
         users_stop = users
-        self.pos_item_scores = tf.matmul(pos_items_stop, self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop, self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         self.user_scores = tf.matmul(users_stop, self.w_user)
         # self.rubi_ratings_both = (self.batch_ratings-self.rubi_c)*(tf.transpose(tf.nn.sigmoid(self.pos_item_scores))+tf.nn.sigmoid(self.user_scores))
         # self.direct_minus_ratings_both = self.batch_ratings-self.rubi_c*(tf.transpose(tf.nn.sigmoid(self.pos_item_scores))+tf.nn.sigmoid(self.user_scores))
@@ -520,7 +563,7 @@ class LightGCN(object):
         mf_loss = self.mf_loss_ori + self.alpha*self.mf_loss_item + self.beta*self.mf_loss_user
         # regular
         regularizer = tf.nn.l2_loss(self.u_g_embeddings_pre) + tf.nn.l2_loss(
-                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)
+                self.pos_i_g_embeddings_pre) + tf.nn.l2_loss(self.neg_i_g_embeddings_pre)/self.n_negs
         regularizer = regularizer/self.batch_size
         emb_loss = self.decay * regularizer
 
@@ -560,88 +603,42 @@ def load_pretrained_data():
         pretrain_data = None
     return pretrain_data
 
-# parallelized sampling on CPU 
-class sample_thread(threading.Thread):
-    def __init__(self):
-        threading.Thread.__init__(self)
-    def run(self):
-        with tf.device(cpus[0]):
-            self.data = data_generator.sample()
-
-class sample_thread_test(threading.Thread):
-    def __init__(self):
-        threading.Thread.__init__(self)
-    def run(self):
-        with tf.device(cpus[0]):
-            self.data = data_generator.sample_test()
-            
-# training on GPU
-class train_thread(threading.Thread):
-    def __init__(self,model, sess, sample, args):
-        threading.Thread.__init__(self)
-        self.model = model
-        self.sess = sess
-        self.sample = sample
-    def run(self):
-        sess_list = []
-        if args.loss == 'bpr':
-            sess_list = [self.model.opt, self.model.loss, self.model.mf_loss, self.model.emb_loss, self.model.reg_loss]
-        elif args.loss == 'bce':
-            sess_list = [self.model.opt_bce, self.model.loss_bce, self.model.mf_loss_bce, self.model.emb_loss_bce, self.model.reg_loss_bce]
-        elif args.loss == 'bce1':
-            sess_list = [self.model.opt_two_bce1, self.model.loss_two_bce1, self.model.mf_loss_two_bce1, self.model.emb_loss_two_bce1, self.model.reg_loss_two_bce1]
-        elif args.loss == 'bce2':
-            sess_list = [self.model.opt_two_bce2, self.model.loss_two_bce2, self.model.mf_loss_two_bce2, self.model.emb_loss_two_bce2, self.model.reg_loss_two_bce2]
-        elif args.loss == 'bceboth':
-            sess_list = [self.model.opt_two_bce_both, self.model.loss_two_bce_both, self.model.mf_loss_two_bce_both, self.model.emb_loss_two_bce_both, self.model.reg_loss_two_bce_both]
-        if len(gpus):
-            with tf.device(gpus[-1]):
-                users, pos_items, neg_items = self.sample.data
-                self.data = sess.run(sess_list,
-                                       feed_dict={model.users: users, model.pos_items: pos_items,
-                                                  model.node_dropout: eval(args.node_dropout),
-                                                  model.mess_dropout: eval(args.mess_dropout),
-                                                  model.neg_items: neg_items})
-        else:
-            users, pos_items, neg_items = self.sample.data
-            self.data = sess.run(sess_list,
-                                       feed_dict={model.users: users, model.pos_items: pos_items,
-                                                  model.node_dropout: eval(args.node_dropout),
-                                                  model.mess_dropout: eval(args.mess_dropout),
-                                                  model.neg_items: neg_items})
-class train_thread_test(threading.Thread):
-    def __init__(self, model, sess, sample, args):
-        threading.Thread.__init__(self)
-        self.model = model
-        self.sess = sess
-        self.sample = sample
-    def run(self):
-        sess_list = []
-        if args.loss == 'bpr':
-            sess_list = [self.model.loss, self.model.mf_loss, self.model.emb_loss]
-        elif args.loss == 'bce':
-            sess_list = [self.model.loss_bce, self.model.mf_loss_bce, self.model.emb_loss_bce]
-        elif args.loss == 'bce1':
-            sess_list = [self.model.loss_two_bce1, self.model.mf_loss_two_bce1, self.model.emb_loss_two_bce1]
-        elif args.loss == 'bce2':
-            sess_list = [self.model.loss_two_bce2, self.model.mf_loss_two_bce2, self.model.emb_loss_two_bce2]
-        elif args.loss == 'bceboth':
-            sess_list = [self.model.loss_two_bce_both, self.model.mf_loss_two_bce_both, self.model.emb_loss_two_bce_both]
-        if len(gpus):
-            with tf.device(gpus[-1]):
-                users, pos_items, neg_items = self.sample.data
-                self.data = sess.run(sess_list,
-                                     feed_dict={model.users: users, model.pos_items: pos_items,
-                                                model.neg_items: neg_items,
-                                                model.node_dropout: eval(args.node_dropout),
-                                                model.mess_dropout: eval(args.mess_dropout)})
-        else:
-            users, pos_items, neg_items = self.sample.data
-            self.data = sess.run(sess_list,
-                                     feed_dict={model.users: users, model.pos_items: pos_items,
-                                                model.neg_items: neg_items,
-                                                model.node_dropout: eval(args.node_dropout),
-                                                model.mess_dropout: eval(args.mess_dropout)})            
+def train_fetches(model):
+    if args.loss == 'bpr':
+        return [model.opt, model.loss, model.mf_loss, model.emb_loss, model.reg_loss]
+    elif args.loss == 'bce':
+        return [model.opt_bce, model.loss_bce, model.mf_loss_bce, model.emb_loss_bce, model.reg_loss_bce]
+    elif args.loss == 'bce1':
+        return [model.opt_two_bce1, model.loss_two_bce1, model.mf_loss_two_bce1, model.emb_loss_two_bce1, model.reg_loss_two_bce1]
+    elif args.loss == 'bce2':
+        return [model.opt_two_bce2, model.loss_two_bce2, model.mf_loss_two_bce2, model.emb_loss_two_bce2, model.reg_loss_two_bce2]
+    elif args.loss == 'bceboth':
+        return [model.opt_two_bce_both, model.loss_two_bce_both, model.mf_loss_two_bce_both, model.emb_loss_two_bce_both, model.reg_loss_two_bce_both]
+    return []
+
+def test_fetches(model):
+    if args.loss == 'bpr':
+        return [model.loss, model.mf_loss, model.emb_loss]
+    elif args.loss == 'bce':
+        return [model.loss_bce, model.mf_loss_bce, model.emb_loss_bce]
+    elif args.loss == 'bce1':
+        return [model.loss_two_bce1, model.mf_loss_two_bce1, model.emb_loss_two_bce1]
+    elif args.loss == 'bce2':
+        return [model.loss_two_bce2, model.mf_loss_two_bce2, model.emb_loss_two_bce2]
+    elif args.loss == 'bceboth':
+        return [model.loss_two_bce_both, model.mf_loss_two_bce_both, model.emb_loss_two_bce_both]
+    return []
+
+# parsed once rather than on every step
+NODE_DROPOUT, MESS_DROPOUT = eval(args.node_dropout), eval(args.mess_dropout)
+
+def run_batch(sess, model, fetches, batch=None):
+    # batch None: the model reads the batch from its input pipeline
+    feed_dict = {model.node_dropout: NODE_DROPOUT, model.mess_dropout: MESS_DROPOUT}
+    if batch is not None:
+        users, pos_items, neg_items = batch
+        feed_dict.update({model.users: users, model.pos_items: pos_items, model.neg_items: neg_items})
+    return sess.run(fetches, feed_dict=feed_dict)
 
 if __name__ == '__main__':
     # os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
@@ -650,33 +647,36 @@ if __name__ == '__main__':
     config = dict()
     config['n_users'] = data_generator.n_users
     config['n_items'] = data_generator.n_items
+    if args.sample_workers > 0:
+        # fork the sampling processes before TensorFlow starts its threads
+        data_generator.start_prefetch(args.sample_workers, args.prefetch_depth)
 
     """
     *********************************************************
     Generate the Laplacian matrix, where each entry defines the decay factor (e.g., p_ui) between two connected nodes.
     """
-    plain_adj, norm_adj, mean_adj,pre_adj = data_generator.get_adj_mat()
+    config['norm_adj'] = data_generator.get_adj_mat(args.adj_type, use_cache=args.adj_cache == 1)
     if args.adj_type == 'plain':
-        config['norm_adj'] = plain_adj
         print('use the plain adjacency matrix')
     elif args.adj_type == 'norm':
-        config['norm_adj'] = norm_adj
         print('use the normalized adjacency matrix')
     elif args.adj_type == 'gcmc':
-        config['norm_adj'] = mean_adj
         print('use the gcmc adjacency matrix')
     elif args.adj_type=='pre':
-        config['norm_adj']=pre_adj
         print('use the pre adjcency matrix')
     else:
-        config['norm_adj'] = mean_adj + sp.eye(mean_adj.shape[0])
         print('use the mean adjacency matrix')
     t0 = time()
     if args.pretrain == -1:
         pretrain_data = load_pretrained_data()
     else:
         pretrain_data = None
-    model = LightGCN(data_config=config, pretrain_data=pretrain_data)
+    inputs = None
+    if args.input_pipeline == 'dataset' and args.hard_neg == 0:
+        # training steps read their batches from a tf.data iterator; hard negatives are scored by the training
+        # session itself, so they keep feeding them
+        inputs = batch_iterator(data_generator.stream(), args.n_negs, args.prefetch_depth)
+    model = LightGCN(data_config=config, pretrain_data=pretrain_data, inputs=inputs)
     
     """
     *********************************************************
@@ -766,12 +766,13 @@ if __name__ == '__main__':
         ensureDir(report_path)
         f = open(report_path, 'w')
         f.write(
-            'embed_size=%d, lr=%.4f, layer_size=%s, keep_prob=%s, regs=%s, loss_type=%s, adj_type=%s\n'
-            % (args.embed_size, args.lr, args.layer_size, args.keep_prob, args.regs, args.loss_type, args.adj_type))
-
-        for i, users_to_test in enumerate(users_to_test_list):
-            ret = test(sess, model, users_to_test, drop_flag=True)
+            'embed_size=%d, lr=%.4f, layer_size=%s, node_dropout=%s, mess_dropout=%s, regs=%s, loss=%s, adj_type=%s\n'
+            % (args.embed_size, args.lr, args.layer_size, args.node_dropout, args.mess_dropout, args.regs, args.loss,
+               args.adj_type))
 
+        # every test user is scored once; the groups only select rows of the metrics
+        rets = test_groups(sess, model, users_to_test_list, drop_flag=True)
+        for i, ret in enumerate(rets):
             final_perf = "recall=[%s], hr=[%s], ndcg=[%s]" % \
                          (', '.join(['%.5f' % r for r in ret['recall']]),
                           ', '.join(['%.5f' % r for r in ret['hr']]),
@@ -781,6 +782,12 @@ if __name__ == '__main__':
         f.close()
         exit()
 
+    if args.hard_neg > 0:
+        # the candidate pools are scored with the propagated embeddings of the current weights
+        data_generator.use_hard_negatives(args.hard_neg, args.hard_every, lambda: sess.run(
+            [model.ua_embeddings, model.ia_embeddings],
+            feed_dict={model.node_dropout: [0.] * model.n_layers, model.mess_dropout: [0.] * model.n_layers}))
+
     """
     *********************************************************
     Train.
@@ -812,28 +819,12 @@ if __name__ == '__main__':
         for epoch in range(1, args.epoch + 1):
             t1 = time()
             loss, mf_loss, emb_loss, reg_loss = 0., 0., 0., 0.
-            n_batch = data_generator.n_train // args.batch_size + 1
+            n_batch = data_generator.n_batches()
             loss_test,mf_loss_test,emb_loss_test,reg_loss_test=0.,0.,0.,0.
-            '''
-            *********************************************************
-            parallelized sampling
-            '''
-            sample_last = sample_thread()
-            sample_last.start()
-            sample_last.join()
-            for idx in range(n_batch):
-                train_cur = train_thread(model, sess, sample_last, args)
-                sample_next = sample_thread()
-                
-                train_cur.start()
-                sample_next.start()
-                
-                sample_next.join()
-                train_cur.join()
-                
-                users, pos_items, neg_items = sample_last.data
-                _, batch_loss, batch_mf_loss, batch_emb_loss, batch_reg_loss = train_cur.data
-                sample_last = sample_next
+            # batches come from the prefetching processes (--sample_workers) or are drawn in-process, and reach
+            # the model through its input pipeline unless --input_pipeline feed
+            for batch in (data_generator.train_batches() if inputs is None else [None] * n_batch):
+                _, batch_loss, batch_mf_loss, batch_emb_loss, batch_reg_loss = run_batch(sess, model, train_fetches(model), batch)
             
                 loss += batch_loss/n_batch
                 mf_loss += batch_mf_loss/n_batch
@@ -870,25 +861,12 @@ if __name__ == '__main__':
             
             '''
             *********************************************************
-            parallelized sampling
+            held-out loss on sampled test triples
             '''
 
-            sample_last= sample_thread_test()
-            sample_last.start()
-            sample_last.join()
             for idx in range(n_batch):
-                train_cur = train_thread_test(model, sess, sample_last, args)
-                sample_next = sample_thread_test()
-                
-                train_cur.start()
-                sample_next.start()
-                
-                sample_next.join()
-                train_cur.join()
-                
-                users, pos_items, neg_items = sample_last.data
-                batch_loss_test, batch_mf_loss_test, batch_emb_loss_test = train_cur.data
-                sample_last = sample_next
+                batch_loss_test, batch_mf_loss_test, batch_emb_loss_test = run_batch(sess, model, test_fetches(model),
+                                                                                      data_generator.sample_test())
                 
                 loss_test += batch_loss_test / n_batch
                 mf_loss_test += batch_mf_loss_test / n_batch
@@ -996,6 +974,7 @@ if __name__ == '__main__':
                 best_epoch = epoch
             if args.save_flag == 1:
                 save_saver.save(sess, weights_save_path + '/weights_{}'.format(args.saveID), global_step=epoch)
+                data_generator.save_id_maps(weights_save_path)
                 print('save the weights in path: ', weights_save_path)
             
             # *********************************************************
@@ -1016,6 +995,7 @@ if __name__ == '__main__':
         else:
             print(best_epoch, best_hr_norm)
         print(best_str, end='')
+    data_generator.stop_prefetch()
 
 
 
@@ -0,0 +1,101 @@
+'''
+User-item adjacency matrices for the graph models.
+
+A = [[0, R], [R^T, 0]] is assembled straight into CSR from the arrays of R
+and only the requested variant is built:
+    plain  A
+    norm   D^-1 (A + I)
+    gcmc   D^-1 A
+    mean   D^-1 A + I
+    pre    D^-1/2 A D^-1/2
+Normalization scales the CSR data in place (utility/normalize.py).
+Results are cached under <data>/.cache keyed by a hash of R and the variant,
+so a warm start only memory-maps three arrays.
+'''
+import hashlib
+
+import numpy as np
+import scipy.sparse as sp
+
+from utility import normalize
+from utility.csr_cache import load_arrays, save_arrays
+
+ADJ_TYPES = ('plain', 'norm', 'gcmc', 'mean', 'pre')
+
+
+def train_hash(R):
+    R = R.tocsr()
+    h = hashlib.sha1()
+    h.update(np.array(R.shape, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(R.indptr, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(R.indices, dtype=np.int32).tobytes())
+    return h.hexdigest()
+
+
+def bipartite(R, self_loop=False):
+    '''[[0, R], [R^T, 0]] (+ I) as a float32 CSR matrix, without COO sorting or LIL copies.'''
+    R = R.tocsr()
+    n_users, n_items = R.shape
+    n = n_users + n_items
+    Rt = R.T.tocsr()
+    indptr = np.concatenate((R.indptr, R.nnz + Rt.indptr[1:])).astype(np.int64)
+    if not self_loop:
+        indices = np.concatenate((R.indices + n_users, Rt.indices)).astype(np.int32)
+        return sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(n, n))
+
+    # every row gets one more entry: a user's own column precedes its items,
+    # an item's own column follows its users
+    indptr += np.arange(n + 1)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    loops = np.concatenate((indptr[:n_users], indptr[n_users + 1:] - 1))
+    indices[loops] = np.arange(n)
+    rest = np.ones(len(indices), dtype=bool)
+    rest[loops] = False
+    indices[rest] = np.concatenate((R.indices + n_users, Rt.indices))
+    return sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(n, n))
+
+
+def loop_positions(adj, n_users):
+    '''Positions of the diagonal entries in a bipartite(R, self_loop=True) matrix.'''
+    indptr = adj.indptr
+    return np.concatenate((indptr[:n_users], indptr[n_users + 1:] - 1))
+
+
+def build_adj(R, adj_type):
+    n_users = R.shape[0]
+    if adj_type == 'plain':
+        return bipartite(R)
+    if adj_type == 'norm':
+        return normalize.left(bipartite(R, self_loop=True))
+    if adj_type == 'gcmc':
+        return normalize.left(bipartite(R))
+    if adj_type == 'mean':
+        # D^-1 A + I: normalize by the degree without the loop, then put the loops back to 1
+        adj = bipartite(R, self_loop=True)
+        normalize.left(adj, normalize.row_degree(adj) - 1)
+        adj.data[loop_positions(adj, n_users)] = 1.
+        return adj
+    if adj_type == 'pre':
+        return normalize.symmetric(bipartite(R))
+    raise ValueError('unknown adj_type: {}'.format(adj_type))
+
+
+def load_adj(R, adj_type, cache_dir, use_cache=True):
+    '''The adj_type variant of R's adjacency, memory-mapped from the cache when possible.'''
+    source = {'train': train_hash(R), 'adj_type': adj_type}
+    name = 'adj_{}_{}'.format(adj_type, source['train'][:16])
+    n = R.shape[0] + R.shape[1]
+    if use_cache:
+        cached = load_arrays(cache_dir, name, source)
+        if cached is not None:
+            arrays = cached[0]
+            return sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=(n, n), copy=False)
+
+    adj = build_adj(R, adj_type)
+    if use_cache:
+        try:
+            save_arrays(cache_dir, name, {'indptr': adj.indptr, 'indices': adj.indices, 'data': adj.data},
+                        {'source': source})
+        except OSError as e:
+            print('could not write adjacency cache', e)
+    return adj
@@ -15,7 +15,9 @@ import numpy as np
 cores = multiprocessing.cpu_count() // 2
 
 args = parse_args()
-data_generator = Data(path=args.data_path + args.dataset, batch_size=args.batch_size)
+data_generator = Data(path=args.data_path + args.dataset, batch_size=args.batch_size, remap=args.remap == 1,
+                      sampler=args.sampler, neg_alpha=args.neg_alpha, user_alpha=args.user_alpha,
+                      n_negs=args.n_negs, pool_size=args.neg_pool)
 # data_generator.check()
 USR_NUM, ITEM_NUM = data_generator.n_users, data_generator.n_items
 N_TRAIN, N_TEST = data_generator.n_train, data_generator.n_test
@@ -23,20 +25,79 @@ N_TRAIN, N_TEST = data_generator.n_train, data_generator.n_test
 BATCH_SIZE = args.batch_size
 
 
+def rate_batch_of(sess, model, user_batch, item_batch, drop_flag=False, method="normal"):
+    # scores (B, N) of the rating head selected by method
+    if method=="normal":
+        ratings = model.batch_ratings
+    elif method == 'causal':
+        ratings = model.batch_ratings_causal_c
+    elif method == 'rubi1':
+        ratings = model.rubi_ratings1
+    elif method == 'rubi2':
+        ratings = model.rubi_ratings2
+    elif method == 'rubiboth':
+        ratings = model.rubi_ratings_both
+    feed_dict = {model.users: user_batch, model.pos_items: item_batch}
+    if drop_flag:
+        feed_dict[model.node_dropout] = [0.] * len(eval(args.layer_size))
+        feed_dict[model.mess_dropout] = [0.] * len(eval(args.layer_size))
+    return np.array(sess.run(ratings, feed_dict))
+
+
+def eval_batch(rate_batch, user_batch, max_top, train_set_flag=0):
+    # per-user metric rows (B, 5 * max_top) of one scored batch
+    test_items = []
+    if train_set_flag == 0:
+        for user in user_batch:
+            set_list = data_generator.test_set[user]
+            test_items.append(set_list)# (B, #test_items)
+
+        # set the ranking scores of training items to -inf,
+        # then the training items will be sorted at the end of the ranking list.
+        for idx, user in enumerate(user_batch):
+            if user in data_generator.train_items.keys():
+                train_items_off = data_generator.train_items[user]
+            else:
+                train_items_off = []
+            rate_batch[idx][train_items_off] = -np.inf
+    else:
+        for user in user_batch:
+            # test_items.append(data_generator.train_items[user])
+            test_items.append(data_generator.test_set[user])
+    return eval_score_matrix_foldout(rate_batch, test_items, max_top)#(B,k*metric_num), max_top= 20
+
+
+def summarize(all_result, Ks):
+    # average the per-user rows into the hr / recall / ndcg of every K
+    top_show = np.sort(Ks)
+    max_top = max(top_show)
+    result = {'hr': np.zeros(len(Ks)), 'recall': np.zeros(len(Ks)), 'ndcg': np.zeros(len(Ks))}
+    all_result = np.array(all_result)
+    # a user is a hit at k when its recall at k is non-zero
+    all_result[:, 2*max_top:3*max_top] = all_result[:, max_top:2*max_top] != 0
+    final_result = np.mean(all_result, axis=0)  # mean
+    final_result = np.reshape(final_result, newshape=[5, max_top])
+    final_result = final_result[:, top_show-1]
+    final_result = np.reshape(final_result, newshape=[5, len(top_show)])
+    result['hr'] += final_result[2]
+    result['recall'] += final_result[1]
+    result['ndcg'] += final_result[3]
+    return result
+
+
 def test(sess, model, users_to_test, drop_flag=False, train_set_flag=0, method="normal"):
     # data_generator.check()
     # B: batch size
     # N: the number of items
     top_show = np.sort(model.Ks)
     max_top = max(top_show)
-    result = {'hr': np.zeros(len(model.Ks)), 'recall': np.zeros(len(model.Ks)), 'ndcg': np.zeros(len(model.Ks))}
 
     u_batch_size = BATCH_SIZE
 
     test_users = users_to_test
     n_test_users = len(test_users)
     n_user_batchs = n_test_users // u_batch_size + 1
-    
+
     count = 0
     all_result = []
     item_batch = range(ITEM_NUM)
@@ -45,52 +106,7 @@ def test(sess, model, users_to_test, drop_flag=False, train_set_flag=0, method="
         end = (u_batch_id + 1) * u_batch_size
 
         user_batch = test_users[start: end]
-        if method=="normal":
-            if drop_flag == False:
-                rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-                                                            model.pos_items: item_batch})
-            else:
-                rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-                                                            model.pos_items: item_batch,
-                                                            model.node_dropout: [0.] * len(eval(args.layer_size)),
-                                                            model.mess_dropout: [0.] * len(eval(args.layer_size))})
-        elif method == 'causal':
-            if drop_flag == False:
-                rate_batch = sess.run(model.batch_ratings_causal_c, {model.users: user_batch,
-                                                                model.pos_items: item_batch})
-            else:
-                rate_batch = sess.run(model.batch_ratings_causal_c, {model.users: user_batch,
-                                                                model.pos_items: item_batch,
-                                                                model.node_dropout: [0.] * len(eval(args.layer_size)),
-                                                                model.mess_dropout: [0.] * len(eval(args.layer_size))})
-        elif method == 'rubi1':
-            if drop_flag == False:
-                rate_batch = sess.run(model.rubi_ratings1, {model.users: user_batch,
-                                                                model.pos_items: item_batch})
-            else:
-                rate_batch = sess.run(model.rubi_ratings1, {model.users: user_batch,
-                                                                model.pos_items: item_batch,
-                                                                model.node_dropout: [0.] * len(eval(args.layer_size)),
-                                                                model.mess_dropout: [0.] * len(eval(args.layer_size))})
-        elif method == 'rubi2':
-            if drop_flag == False:
-                rate_batch = sess.run(model.rubi_ratings2, {model.users: user_batch,
-                                                                model.pos_items: item_batch})
-            else:
-                rate_batch = sess.run(model.rubi_ratings2, {model.users: user_batch,
-                                                                model.pos_items: item_batch,
-                                                                model.node_dropout: [0.] * len(eval(args.layer_size)),
-                                                                model.mess_dropout: [0.] * len(eval(args.layer_size))})
-
-        elif method == 'rubiboth':
-            if drop_flag == False:
-                rate_batch = sess.run(model.rubi_ratings_both, {model.users: user_batch,
-                                                                model.pos_items: item_batch})
-            else:
-                rate_batch = sess.run(model.rubi_ratings_both, {model.users: user_batch,
-                                                                model.pos_items: item_batch,
-                                                                model.node_dropout: [0.] * len(eval(args.layer_size)),
-                                                                model.mess_dropout: [0.] * len(eval(args.layer_size))})
+        rate_batch = rate_batch_of(sess, model, user_batch, item_batch, drop_flag, method)
         item_acc_list = {}
         rate_batch = np.array(rate_batch)# (B, N)
         for i in range(data_generator.n_items):
@@ -112,62 +128,27 @@ def test(sess, model, users_to_test, drop_flag=False, train_set_flag=0, method="
                 if i in user_pos_test:
                     item_acc_list[i] += 1/len(data_generator.test_item_set[i])
         with open("Lightgcn_macr.txt","w") as f:
-            f.write(str(item_acc_list))
+            f.write(str(dict(zip(data_generator.raw_items(list(item_acc_list.keys())), item_acc_list.values()))))
         exit()
-        test_items = []
-        if train_set_flag == 0:
-            for user in user_batch:
-                set_list = data_generator.test_set[user]
-                test_items.append(set_list)# (B, #test_items)
-                
-            # set the ranking scores of training items to -inf,
-            # then the training items will be sorted at the end of the ranking list.    
-            for idx, user in enumerate(user_batch):
-                if user in data_generator.train_items.keys():
-                    train_items_off = data_generator.train_items[user]
-                else:
-                    train_items_off = []
-                rate_batch[idx][train_items_off] = -np.inf
-        else:
-            for user in user_batch:
-                # test_items.append(data_generator.train_items[user])
-                test_items.append(data_generator.test_set[user])
-        batch_result = eval_score_matrix_foldout(rate_batch, test_items, max_top)#(B,k*metric_num), max_top= 20
+        batch_result = eval_batch(rate_batch, user_batch, max_top, train_set_flag)
         count += len(batch_result)
         all_result.append(batch_result)
-        
-    
-    assert count == n_test_users
-    all_result = np.concatenate(all_result, axis=0)
-    # print(all_result.shape)
-    # x, y = all_result.shape
-    for i in range(all_result.shape[0]):
-        for j in range(2*max_top, 3*max_top):
-            # print(all_result[i][j-1])
-            if all_result[i][j-max_top] != 0:
-                all_result[i][j] = 1.0
-            else:
-                all_result[i][j] = 0.0
-    # print(all_result)
-    final_result = np.mean(all_result, axis=0)  # mean
-    # print(final_result)
-    final_result = np.reshape(final_result, newshape=[5, max_top])
-    # print(final_result)
-    final_result = final_result[:, top_show-1]
-    # print(final_result)
-    final_result = np.reshape(final_result, newshape=[5, len(top_show)])
-    # print(final_result)
-    result['hr'] += final_result[2]
-    result['recall'] += final_result[1]
-    result['ndcg'] += final_result[3]
-    return result
-               
-            
-
-
-
-
 
 
+    assert count == n_test_users
+    all_result = np.concatenate(all_result, axis=0)
+    return summarize(all_result, model.Ks)
 
 
+def test_groups(sess, model, groups, drop_flag=False, method="normal"):
+    # test() of every user group, scoring each user once and averaging its group's rows
+    users = np.unique(np.concatenate([np.asarray(group, dtype=np.int64) for group in groups]))
+    max_top = max(model.Ks)
+    item_batch = range(ITEM_NUM)
+    all_result = []
+    for start in range(0, len(users), BATCH_SIZE):
+        user_batch = users[start: start + BATCH_SIZE].tolist()
+        rate_batch = rate_batch_of(sess, model, user_batch, item_batch, drop_flag, method)
+        all_result.append(eval_batch(rate_batch, user_batch, max_top))
+    all_result = np.concatenate(all_result, axis=0)
+    return [summarize(all_result[np.searchsorted(users, group)], model.Ks) for group in groups]
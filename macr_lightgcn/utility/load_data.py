@@ -10,336 +10,284 @@ import random as rd
 import scipy.sparse as sp
 from time import time
 import collections
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from utility.reader import read_splits
+from utility.adjacency import ADJ_TYPES, load_adj, train_hash
+from utility.csr_cache import load_arrays, save_arrays
+from utility.remap import IdMap
+from utility.prefetch import Prefetcher
+from utility.sampling import PairIndex, draw_users, draw_positives, draw_negatives, epoch_batches, n_epoch_batches, \
+    popularity_table, negative_pool, pool_negatives, HardNegatives
 
 class Data(object):
-    def __init__(self, path, batch_size):
+    def __init__(self, path, batch_size, remap=False, sampler='uniform', neg_alpha=0., user_alpha=0., n_negs=1,
+                 pool_size=0):
         self.path = path
         self.batch_size = batch_size
+        self.remap = remap
+        self.sampler = sampler
+        self.n_negs = n_negs
+        self.prefetcher = None
 
         train_file = path + '/train.txt'
         test_file = path + '/test.txt'
 
-        self.n_users, self.n_items = 0, 0
-        self.n_train, self.n_test = 0, 0
-        self.neg_pools = {}
-
-        self.exist_users = []
-        
-        with open(train_file) as f:
-            for l in f.readlines():
-                if len(l) > 0:
-                    l = l.strip('\n').split(' ')
-                    items = [int(i) for i in l[1:]]
-                    uid = int(l[0])
-                    self.exist_users.append(uid)
-                    if len(items)!=0:
-                        self.n_items = max(self.n_items, max(items))
-                    self.n_users = max(self.n_users, uid)
-                    self.n_train += len(items)
-
-        with open(test_file) as f:
-            for l in f.readlines():
-                if len(l) > 0:
-                    l = l.strip('\n')
-                    try:
-                        items = [int(i) for i in l.split(' ')[1:]]
-                    except Exception:
-                        continue
-                    if len(items) != 0:
-                        self.n_items = max(self.n_items, max(items))
-                    self.n_test += len(items)
-        self.n_items += 1
-        self.n_users += 1
+        # [n_users, pool_size] negatives the training batches index into (pool_size 0: drawn per batch);
+        # the next pool is drawn by a background thread while the current one is in use
+        self.pool_size = pool_size
+        self.neg_pools = None
+        self._pool_worker, self._next_pool = None, None
+        self.pool_rng = np.random.RandomState()
+        self.hard_negatives = None
+
+        # each file is read once; counts and lists come from the parsed arrays
+        (row_users, train_users, train_items), (_, test_users, test_items) = read_splits([train_file, test_file])
+        self.user_map, self.item_map = None, None
+        if remap:
+            # compact ids: embeddings, the adjacency matrix and score rows only cover ids that occur
+            self.user_map = IdMap.from_ids(row_users, test_users)
+            self.item_map = IdMap.from_ids(train_items, test_items)
+            row_users, train_users, test_users = [self.user_map.to_dense(u) for u in (row_users, train_users, test_users)]
+            train_items, test_items = self.item_map.to_dense(train_items), self.item_map.to_dense(test_items)
+        self.exist_users = row_users.tolist()
+        self.n_train, self.n_test = len(train_items), len(test_items)
+        # an empty train.txt / test.txt contributes no ids
+        self.n_users = int(row_users.max()) + 1 if len(row_users) else 0
+        if remap:
+            self.n_users = len(self.user_map)
+        self.n_items = max([int(a.max()) for a in (train_items, test_items) if len(a)], default=-1) + 1
         self.print_statistics()
-        self.R = sp.dok_matrix((self.n_users, self.n_items), dtype=np.float32)
-        self.train_items, self.test_set = {}, {}
+
+        self.R = sp.csr_matrix((np.ones(self.n_train, dtype=np.float32), (train_users, train_items)),
+                               shape=(self.n_users, self.n_items))
+        self.R.sum_duplicates()
+        self.R.data[:] = 1.
+        # interactions per user over both files, for the sparsity split
+        n = max(self.n_users, int(test_users.max()) + 1 if len(test_users) else 0)
+        self.n_interactions = np.bincount(train_users, minlength=n) + np.bincount(test_users, minlength=n)
+        self.T = sp.csr_matrix((np.ones(self.n_test, dtype=np.float32), (test_users, test_items)),
+                               shape=(n, self.n_items))
+        self.T.sum_duplicates()
+        # negatives avoid the train items (and the test items when sampling the test loss)
+        self.train_index = PairIndex(self.R.indptr, self.R.indices, self.n_items)
+        self.test_index = PairIndex.union([(self.R.indptr, self.R.indices), (self.T.indptr, self.T.indices)],
+                                          self.n_items)
+        self.rng = np.random.RandomState()
+        self.sample_users = np.asarray(row_users, dtype=np.int32)
+        self.sample_test_users = np.unique(test_users).astype(np.int32)
+        self.all_items = np.arange(self.n_items, dtype=np.int32)
+        # popularity-weighted negatives / uniform-sampler users (None: uniform)
+        self.neg_table = popularity_table(np.bincount(self.R.indices, minlength=self.n_items), neg_alpha)
+        self.user_table = popularity_table(np.diff(self.R.indptr)[self.sample_users], user_alpha)
+        self.train_items = self._group(train_users, train_items)
+        self.test_set = self._group(test_users, test_items)
         self.test_item_set = collections.defaultdict(list)
-        with open(train_file) as f_train:
-            with open(test_file) as f_test:
-                for l in f_train.readlines():
-                    if len(l) == 0: break
-                    l = l.strip('\n')
-                    items = [int(i) for i in l.split(' ')]
-                    uid, train_items = items[0], items[1:]
-
-                    if len(train_items) == 0:
-                        continue
-                    for i in train_items:
-                        self.R[uid, i] = 1.
-                        
-                    self.train_items[uid] = train_items
-                    
-                for l in f_test.readlines():
-                    if len(l) == 0: break
-                    l = l.strip('\n')
-                    try:
-                        items = [int(i) for i in l.split(' ')]
-                    except Exception:
-                        continue
-                    
-                    uid, test_items = items[0], items[1:]
-
-                    if len(test_items) == 0:
-                        continue
-                    self.test_set[uid] = test_items
-                    for item in test_items:
-                        self.test_item_set[item].append(uid)
+        for item, users in self._group(test_items, test_users).items():
+            self.test_item_set[item] = users
         # for uid in range(self.n_users):
         #     if self.train_items.__contains__(uid) and self.test_set.__contains__(uid):
         #         if len(set(self.train_items[uid]) & set(self.test_set[uid]))!=0:
         #             print(uid)
 
-    def get_adj_mat(self):
-        # try:
-        #     t1 = time()
-        #     adj_mat = sp.load_npz(self.path + '/s_adj_mat.npz')
-        #     norm_adj_mat = sp.load_npz(self.path + '/s_norm_adj_mat.npz')
-        #     mean_adj_mat = sp.load_npz(self.path + '/s_mean_adj_mat.npz')
-        #     print('already load adj matrix', adj_mat.shape, time() - t1)
-        
-        # except Exception:
-        adj_mat, norm_adj_mat, mean_adj_mat = self.create_adj_mat()
-        sp.save_npz(self.path + '/s_adj_mat.npz', adj_mat)
-        sp.save_npz(self.path + '/s_norm_adj_mat.npz', norm_adj_mat)
-        sp.save_npz(self.path + '/s_mean_adj_mat.npz', mean_adj_mat)
-            
-        # try:
-        #     pre_adj_mat = sp.load_npz(self.path + '/s_pre_adj_mat.npz')
-        # except Exception:
-        adj_mat=adj_mat
-        rowsum = np.array(adj_mat.sum(1))
-        d_inv = np.power(rowsum, -0.5).flatten()
-        
-        d_inv[np.isinf(d_inv)] = 0.
-        d_mat_inv = sp.diags(d_inv)
-        norm_adj = d_mat_inv.dot(adj_mat)
-        norm_adj = norm_adj.dot(d_mat_inv)
-        print('generate pre adjacency matrix.')
-        pre_adj_mat = norm_adj.tocsr()
-        sp.save_npz(self.path + '/s_pre_adj_mat.npz', norm_adj)
-            
-        return adj_mat, norm_adj_mat, mean_adj_mat,pre_adj_mat
-
-    def create_adj_mat(self):
+    def _group(self, keys, values):
+        # {key: [values in file order]} for every key that has at least one value
+        if len(keys) == 0:
+            return {}
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.concatenate(([0], bounds)).tolist()
+        return dict(zip(keys[starts].tolist(), (v.tolist() for v in np.split(values, bounds))))
+
+    def raw_users(self, users):
+        return users if self.user_map is None else self.user_map.to_raw(users)
+
+    def raw_items(self, items):
+        return items if self.item_map is None else self.item_map.to_raw(items)
+
+    def save_id_maps(self, path):
+        if self.remap:
+            self.user_map.save(path, 'user')
+            self.item_map.save(path, 'item')
+
+    def get_adj_mat(self, adj_type='pre', use_cache=True):
+        # only the requested variant is built; unknown types fall back to mean + I as before
         t1 = time()
-        adj_mat = sp.dok_matrix((self.n_users + self.n_items, self.n_users + self.n_items), dtype=np.float32)
-        adj_mat = adj_mat.tolil()
-        R = self.R.tolil()
-        # prevent memory from overflowing
-        for i in range(5):
-            adj_mat[int(self.n_users*i/5.0):int(self.n_users*(i+1.0)/5), self.n_users:] =\
-            R[int(self.n_users*i/5.0):int(self.n_users*(i+1.0)/5)]
-            adj_mat[self.n_users:,int(self.n_users*i/5.0):int(self.n_users*(i+1.0)/5)] =\
-            R[int(self.n_users*i/5.0):int(self.n_users*(i+1.0)/5)].T
-        adj_mat = adj_mat.todok()
-        print('already create adjacency matrix', adj_mat.shape, time() - t1)
-        
-        t2 = time()
-        def normalized_adj_single(adj):
-            rowsum = np.array(adj.sum(1))
-
-            d_inv = np.power(rowsum, -1).flatten()
-            d_inv[np.isinf(d_inv)] = 0.
-            d_mat_inv = sp.diags(d_inv)
-
-            norm_adj = d_mat_inv.dot(adj)
-            print('generate single-normalized adjacency matrix.')
-            return norm_adj.tocoo()
-
-        def check_adj_if_equal(adj):
-            dense_A = np.array(adj.todense())
-            degree = np.sum(dense_A, axis=1, keepdims=False)
-
-            temp = np.dot(np.diag(np.power(degree, -1)), dense_A)
-            print('check normalized adjacency matrix whether equal to this laplacian matrix.')
-            return temp
-        
-        norm_adj_mat = normalized_adj_single(adj_mat + sp.eye(adj_mat.shape[0]))
-        mean_adj_mat = normalized_adj_single(adj_mat)
-        
-        print('already normalize adjacency matrix', time() - t2)
-        return adj_mat.tocsr(), norm_adj_mat.tocsr(), mean_adj_mat.tocsr()
-        
+        if adj_type not in ADJ_TYPES:
+            adj_type = 'mean'
+        adj_mat = load_adj(self.R, adj_type, self.path + '/.cache', use_cache)
+        print('already load %s adjacency matrix' % adj_type, adj_mat.shape, time() - t1)
+        return adj_mat
+
+    def _draw_pool(self, rng):
+        return negative_pool(rng, self.train_index, self.n_users, self.all_items, self.pool_size or 100,
+                             self.neg_table)
+
     def negative_pool(self):
         t1 = time()
-        for u in self.train_items.keys():
-            neg_items = list(set(range(self.n_items)) - set(self.train_items[u]))
-            pools = [rd.choice(neg_items) for _ in range(100)]
-            self.neg_pools[u] = pools
+        self.neg_pools = self._draw_pool(self.rng)
         print('refresh negative pools', time() - t1)
 
-    def sample(self):
-        if self.batch_size <= self.n_users:
-            users = rd.sample(self.exist_users, self.batch_size)
+    def refresh_negative_pool(self):
+        # swap in the pool drawn in the background and start drawing the next one
+        if self._next_pool is None:
+            self._pool_worker = ThreadPoolExecutor(1)
+            self.negative_pool()
         else:
-            users = [rd.choice(self.exist_users) for _ in range(self.batch_size)]
-
-
-        def sample_pos_items_for_u(u, num):
-            pos_items = list(self.train_items[u])
-            n_pos_items = len(pos_items)
-            pos_batch = []
-            while True:
-                if len(pos_batch) == num: break
-                pos_id = np.random.randint(low=0, high=n_pos_items, size=1)[0]
-                pos_i_id = pos_items[pos_id]
-
-                if pos_i_id not in pos_batch:
-                    pos_batch.append(pos_i_id)
-            return pos_batch
-
-        def sample_neg_items_for_u(u, num):
-            neg_items = []
-            while True:
-                if len(neg_items) == num: break
-                neg_id = np.random.randint(low=0, high=self.n_items,size=1)[0]
-                if neg_id not in self.train_items[u] and neg_id not in neg_items:
-                    neg_items.append(neg_id)
-            return neg_items
-
-        def sample_neg_items_for_u_from_pools(u, num):
-            neg_items = list(set(self.neg_pools[u]) - set(self.train_items[u]))
-            return rd.sample(neg_items, num)
-
-        pos_items, neg_items = [], []
-        for u in users:
-            pos_items += sample_pos_items_for_u(u, 1)
-            neg_items += sample_neg_items_for_u(u, 1)
-
+            self.neg_pools = self._next_pool.result()
+        self._next_pool = self._pool_worker.submit(self._draw_pool, self.pool_rng)
+
+    def use_hard_negatives(self, n_hard, every, embeddings):
+        # training negatives become the n_hard best-scored entries of every user's pool, re-scored with
+        # embeddings() -> (user_emb, item_emb) every `every` batches
+        if self.prefetcher is not None:
+            raise ValueError('hard negatives are scored in the training process; use --sample_workers 0.')
+        if not self.pool_size:
+            self.pool_size = 100
+        self.hard_negatives = HardNegatives(min(n_hard, self.pool_size), every, embeddings)
+
+    def _negatives(self, rng, users):
+        if self.hard_negatives is not None:
+            if self.hard_negatives.pool is not self.neg_pools:
+                self.hard_negatives.set_pool(self.neg_pools)
+            return self.hard_negatives.draw(rng, users, self.n_negs)
+        if self.pool_size:
+            return pool_negatives(rng, self.neg_pools, users, self.n_negs)
+        return draw_negatives(rng, self.train_index, users, self.all_items, self.neg_table, self.n_negs)
+
+    def sample(self, rng=None):
+        if rng is None:
+            rng = self.rng
+        users = draw_users(rng, self.sample_users, self.batch_size, self.user_table)
+        pos_items = draw_positives(rng, self.R.indptr, self.R.indices, users)
+        if self.pool_size and self.neg_pools is None:
+            self.negative_pool()
+        neg_items = self._negatives(rng, users)
         return users, pos_items, neg_items
-    
-    def sample_test(self):
-        if self.batch_size <= self.n_users:
-            users = rd.sample(self.test_set.keys(), self.batch_size)
-        else:
-            users = [rd.choice(self.test_set.keys()) for _ in range(self.batch_size)]
-
-        def sample_pos_items_for_u(u, num):
-            pos_items = self.test_set[u]
-            n_pos_items = len(pos_items)
-            pos_batch = []
-            while True:
-                if len(pos_batch) == num: break
-                pos_id = np.random.randint(low=0, high=n_pos_items, size=1)[0]
-                pos_i_id = pos_items[pos_id]
-
-                if pos_i_id not in pos_batch:
-                    pos_batch.append(pos_i_id)
-            return pos_batch
-
-        def sample_neg_items_for_u(u, num):
-            neg_items = []
-            while True:
-                if len(neg_items) == num: break
-                neg_id = np.random.randint(low=0, high=self.n_items, size=1)[0]
-                union_set = list(self.test_set[u])
-                if u in self.train_items.keys():
-                    union_set += self.train_items[u]
-                if neg_id not in union_set and neg_id not in neg_items:
-                    neg_items.append(neg_id)
-            return neg_items
-    
-        def sample_neg_items_for_u_from_pools(u, num):
-            neg_items = list(set(self.neg_pools[u]) - set(self.train_items[u]))
-            return rd.sample(neg_items, num)
-
-        pos_items, neg_items = [], []
-        for u in users:
-            pos_items += sample_pos_items_for_u(u, 1)
-            neg_items += sample_neg_items_for_u(u, 1)
 
+    def n_batches(self):
+        if self.sampler == 'epoch':
+            return n_epoch_batches(self.R.nnz, self.batch_size)
+        return self.n_train // self.batch_size + 1
+
+    def train_batches(self):
+        # one epoch of (users, pos_items, neg_items); 'uniform' re-samples users for every batch as sample() does
+        if self.prefetcher is not None:
+            return islice(self.prefetcher, self.n_batches())
+        if self.pool_size:
+            self.refresh_negative_pool()
+        if self.sampler != 'epoch':
+            return (self.sample() for _ in range(self.n_batches()))
+        return epoch_batches(self.rng, self.R.indptr, self.R.indices, self.train_index, self.all_items, self.batch_size,
+                             self.neg_table, self.n_negs, self._negatives if self.pool_size else None)
+
+    def batch_stream(self, rng, refresh=False):
+        # endless training batches drawn with rng. With refresh (the tf.data generator of the training
+        # process) the pool of every epoch comes from the background refresh_negative_pool; the prefetching
+        # workers are already in the background, so they redraw theirs in-line once per epoch
+        while True:
+            if self.pool_size:
+                if refresh:
+                    self.refresh_negative_pool()
+                else:
+                    self.neg_pools = self._draw_pool(rng)
+            if self.sampler == 'epoch':
+                for batch in epoch_batches(rng, self.R.indptr, self.R.indices, self.train_index, self.all_items,
+                                           self.batch_size, self.neg_table, self.n_negs,
+                                           self._negatives if self.pool_size else None):
+                    yield batch
+            else:
+                for _ in range(self.n_batches()):
+                    yield self.sample(rng)
+
+    def stream(self):
+        # endless training batches for the tf.data pipeline: the prefetching workers' when they run
+        if self.prefetcher is not None:
+            return iter(self.prefetcher)
+        # the generator runs on a TF thread next to sample_test on the main one, so it gets its own RandomState
+        return self.batch_stream(np.random.RandomState(self.rng.randint(2 ** 31 - 1)), refresh=True)
+
+    def start_prefetch(self, n_workers, depth=4, seed=None):
+        shapes = [(self.batch_size,)] * 2 + [(self.batch_size, self.n_negs) if self.n_negs > 1 else (self.batch_size,)]
+        self.prefetcher = Prefetcher(self.batch_stream, shapes, n_workers, depth, seed)
+
+    def stop_prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        if self._pool_worker is not None:
+            self._pool_worker.shutdown()
+            self._pool_worker, self._next_pool = None, None
+
+    def sample_test(self):
+        users = draw_users(self.rng, self.sample_test_users, self.batch_size)
+        pos_items = draw_positives(self.rng, self.T.indptr, self.T.indices, users)
+        neg_items = draw_negatives(self.rng, self.test_index, users, self.all_items, self.neg_table, self.n_negs)
         return users, pos_items, neg_items
-    
-    
-    
-    
-    
-    
+
     def get_num_users_items(self):
         return self.n_users, self.n_items
 
     def print_statistics(self):
         print('n_users=%d, n_items=%d' % (self.n_users, self.n_items))
         print('n_interactions=%d' % (self.n_train + self.n_test))
-        print('n_train=%d, n_test=%d, sparsity=%.5f' % (self.n_train, self.n_test, (self.n_train + self.n_test)/(self.n_users * self.n_items)))
+        size = self.n_users * self.n_items
+        print('n_train=%d, n_test=%d, sparsity=%.5f' % (self.n_train, self.n_test, (self.n_train + self.n_test)/size if size else 0.))
 
 
     def get_sparsity_split(self):
-        try:
-            split_uids, split_state = [], []
-            lines = open(self.path + '/sparsity.split', 'r').readlines()
-
-            for idx, line in enumerate(lines):
-                if idx % 2 == 0:
-                    split_state.append(line.strip())
-                    print(line.strip())
-                else:
-                    split_uids.append([int(uid) for uid in line.strip().split(' ')])
+        # the split is stored as arrays under <data>/.cache, keyed by the train and test matrices
+        # (which users are tested and their interaction counts both decide the groups)
+        source = {'train': train_hash(self.R), 'test': train_hash(self.T)}
+        name = 'sparsity_{}'.format(source['train'][:16])
+        cached = load_arrays(self.path + '/.cache', name, source)
+        if cached is not None:
+            arrays = cached[0]
             print('get sparsity split.')
-
-        except Exception:
-            split_uids, split_state = self.create_sparsity_split()
-            f = open(self.path + '/sparsity.split', 'w')
-            for idx in range(len(split_state)):
-                f.write(split_state[idx] + '\n')
-                f.write(' '.join([str(uid) for uid in split_uids[idx]]) + '\n')
+        else:
+            arrays = self.create_sparsity_split()
+            try:
+                save_arrays(self.path + '/.cache', name, arrays, {'source': source})
+            except OSError as e:
+                print('could not write sparsity split', e)
             print('create sparsity split.')
 
+        bounds = np.asarray(arrays['bounds'])
+        split_uids = [arrays['uids'][lo:hi].tolist() for lo, hi in zip(bounds[:-1], bounds[1:])]
+        split_state = ['#inter per user<=[%d], #users=[%d], #all rates=[%d]' % (level, hi - lo, n_rates)
+                       for level, n_rates, lo, hi in zip(arrays['levels'], arrays['n_rates'], bounds[:-1], bounds[1:])]
+        for state in split_state:
+            print(state)
         return split_uids, split_state
 
-
-
     def create_sparsity_split(self):
-        all_users_to_test = list(self.test_set.keys())
-        user_n_iid = dict()
-
-        # generate a dictionary to store (key=n_iids, value=a list of uid).
-        for uid in all_users_to_test:
-            train_iids = self.train_items[uid]
-            test_iids = self.test_set[uid]
-
-            n_iids = len(train_iids) + len(test_iids)
-
-            if n_iids not in user_n_iid.keys():
-                user_n_iid[n_iids] = [uid]
-            else:
-                user_n_iid[n_iids].append(uid)
-        split_uids = list()
-
-        # split the whole user set into four subset.
-        temp = []
-        count = 1
-        fold = 4
-        n_count = (self.n_train + self.n_test)
-        n_rates = 0
-
-        split_state = []
-        for idx, n_iids in enumerate(sorted(user_n_iid)):
-            temp += user_n_iid[n_iids]
-            n_rates += n_iids * len(user_n_iid[n_iids])
-            n_count -= n_iids * len(user_n_iid[n_iids])
-
-            if n_rates >= count * 0.25 * (self.n_train + self.n_test):
-                split_uids.append(temp)
-
-                state = '#inter per user<=[%d], #users=[%d], #all rates=[%d]' %(n_iids, len(temp), n_rates)
-                split_state.append(state)
-                print(state)
-
-                temp = []
-                n_rates = 0
-                fold -= 1
-
-            if idx == len(user_n_iid.keys()) - 1 or n_count == 0:
-                split_uids.append(temp)
-
-                state = '#inter per user<=[%d], #users=[%d], #all rates=[%d]' % (n_iids, len(temp), n_rates)
-                split_state.append(state)
-                print(state)
-
-
-
-        return split_uids, split_state
+        # test users ordered by #interactions (train + test), then id; a group is closed as soon
+        # as it holds a quarter of all interactions, the last one takes whatever is left
+        users = np.asarray(sorted(self.test_set.keys()), dtype=np.int64)
+        n_iids = self.n_interactions[users]
+        order = np.argsort(n_iids, kind='stable')
+        users, n_iids = users[order], n_iids[order]
+
+        levels, level_end = np.unique(n_iids, return_index=True)
+        level_end = np.append(level_end[1:], len(users))
+        cum_rates = np.cumsum(levels * np.diff(np.concatenate(([0], level_end))))
+        threshold = 0.25 * (self.n_train + self.n_test)
+
+        cuts, base = [], 0
+        while len(levels):
+            # first level at which the open group reaches the threshold
+            idx = np.searchsorted(cum_rates, base + threshold, side='left')
+            if idx >= len(levels):
+                break
+            cuts.append(idx)
+            base = cum_rates[idx]
+        ends = cuts + [len(levels) - 1] if len(levels) else []
+        group_levels = levels[ends]
+        group_rates = np.diff(np.concatenate(([0], cum_rates[ends])))
+        bounds = np.concatenate(([0], level_end[ends]))
+        return {'uids': users.astype(np.int32), 'bounds': bounds.astype(np.int64),
+                'levels': np.asarray(group_levels, dtype=np.int64), 'n_rates': group_rates.astype(np.int64)}
 
     def check(self):
         for uid in range(20):
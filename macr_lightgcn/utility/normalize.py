@@ -0,0 +1,63 @@
+'''
+In-place degree normalization of CSR adjacency matrices.
+
+The kernels rescale `data` directly from row / column degree vectors, in
+chunks, instead of multiplying by sparse diagonal matrices, so normalizing
+never holds more than the matrix itself plus one chunk of scratch space.
+'''
+import numpy as np
+
+CHUNK = 1 << 22
+
+
+def row_degree(adj):
+    '''Sum of every row of a CSR matrix as float64.'''
+    counts = np.diff(adj.indptr)
+    degree = np.zeros(len(counts), dtype=np.float64)
+    nonempty = counts > 0
+    if nonempty.any():
+        degree[nonempty] = np.add.reduceat(adj.data, adj.indptr[:-1][nonempty], dtype=np.float64)
+    return degree
+
+
+def inv_power(degree, power):
+    '''degree ** power with 0 for isolated nodes.'''
+    d_inv = np.zeros(len(degree), dtype=np.float64)
+    nonzero = degree > 0
+    d_inv[nonzero] = np.power(degree[nonzero], power)
+    return d_inv
+
+
+def scale_rows(adj, d, chunk=CHUNK):
+    indptr, data = adj.indptr, adj.data
+    n_rows = len(indptr) - 1
+    # rows per chunk, so that one chunk of repeated scales stays around `chunk` entries
+    step = max(1, int(chunk * n_rows // max(len(data), 1)))
+    for start in range(0, n_rows, step):
+        end = min(start + step, n_rows)
+        lo, hi = indptr[start], indptr[end]
+        data[lo:hi] *= np.repeat(d[start:end], np.diff(indptr[start:end + 1]))
+
+
+def scale_cols(adj, d, chunk=CHUNK):
+    indices, data = adj.indices, adj.data
+    for lo in range(0, len(data), chunk):
+        data[lo:lo + chunk] *= d[indices[lo:lo + chunk]]
+
+
+def left(adj, degree=None):
+    '''D^-1 A (the mean / gcmc variants; norm when A already has self-loops).'''
+    if degree is None:
+        degree = row_degree(adj)
+    scale_rows(adj, inv_power(degree, -1))
+    return adj
+
+
+def symmetric(adj, degree=None):
+    '''D^-1/2 A D^-1/2 (the pre variant); A must be symmetric.'''
+    if degree is None:
+        degree = row_degree(adj)
+    d_inv = inv_power(degree, -0.5)
+    scale_rows(adj, d_inv)
+    scale_cols(adj, d_inv)
+    return adj
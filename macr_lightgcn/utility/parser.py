@@ -43,6 +43,34 @@ def parse_args():
                         help='Specify the name of model (lightgcn).')
     parser.add_argument('--adj_type', nargs='?', default='pre',
                         help='Specify the type of the adjacency (laplacian) matrix from {plain, norm, mean}.')
+    parser.add_argument('--adj_cache', type=int, default=1,
+                        help='1: memory-map the adjacency matrix from <data>/.cache, 0: rebuild it every run.')
+    parser.add_argument('--remap', type=int, default=0,
+                        help='1: compact user / item ids to the ones that occur in the splits.')
+    parser.add_argument('--sampler', nargs='?', default='uniform',
+                        help='Training batches: epoch (every interaction once per epoch), uniform (users re-sampled per batch).')
+    parser.add_argument('--n_negs', type=int, default=1,
+                        help='Negatives per positive; > 1 feeds [batch, n_negs] negatives to the LightGCN losses.')
+    parser.add_argument('--fusion', nargs='?', default='outer',
+                        help='Two-branch (bce1 / bce2 / bceboth) losses: outer (published [B, B] broadcast, n_negs 1 only), row (one fused term per row; needed for n_negs > 1).')
+    parser.add_argument('--neg_pool', type=int, default=0,
+                        help='Negatives pre-drawn per user and refreshed in the background every epoch (0: drawn per batch).')
+    parser.add_argument('--hard_neg', type=int, default=0,
+                        help='Train on the hard_neg best-scored candidates of every user\'s negative pool (0: off).')
+    parser.add_argument('--hard_every', type=int, default=100,
+                        help='Batches between re-scorings of the hard negative candidates.')
+    parser.add_argument('--neg_alpha', type=float, default=0.,
+                        help='Negatives drawn in proportion to train item degree ** neg_alpha (0: uniform).')
+    parser.add_argument('--user_alpha', type=float, default=0.,
+                        help='uniform sampler: users drawn in proportion to train degree ** user_alpha (0: distinct uniform users).')
+    parser.add_argument('--all_losses', type=int, default=0,
+                        help='1 builds every loss variant with its optimizer, 0 only --loss\'s (and the rating head --test reads).')
+    parser.add_argument('--input_pipeline', nargs='?', default='feed',
+                        help='Training batches: dataset (tf.data iterator, no feed_dict), feed (feed_dict per step).')
+    parser.add_argument('--sample_workers', type=int, default=0,
+                        help='Processes prefetching training batches (0: sample in the training process).')
+    parser.add_argument('--prefetch_depth', type=int, default=4,
+                        help='Batches in flight between the sampling processes and the training loop.')
     parser.add_argument('--alg_type', nargs='?', default='lightgcn',
                         help='Specify the type of the graph convolutional layer from {ngcf, gcn, gcmc}.')
 
@@ -0,0 +1,207 @@
+'''
+Single-pass reader for the "user item item ..." adjacency-list files.
+
+The file is read in large byte blocks that end on a line boundary and every
+block is tokenized with numpy: token and line boundaries come from boolean
+masks over the raw bytes and the values from numpy's C text parser (or, if a
+block holds anything it cannot read, from a digit-column accumulation), so no
+per-token python objects are created. Any non-digit byte (space, tab, '\\r')
+separates tokens; the first token of a line is the user, the rest are its items.
+read_splits parses several files (and large files in line-aligned pieces)
+in a process pool.
+'''
+import multiprocessing
+import os
+import warnings
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # python < 3.8: worker results come back pickled
+    shared_memory = None
+
+BLOCK_SIZE = 1 << 24
+# below this many bytes in total a process pool costs more than it saves
+PARALLEL_MIN_BYTES = 1 << 26
+
+
+def _digit_values(b, is_digit, starts):
+    # slow path: accumulate each token one digit column at a time
+    ends = np.flatnonzero(is_digit[:-1] & ~is_digit[1:]) + 1
+    if is_digit[-1]:
+        ends = np.append(ends, len(b))
+    lengths = ends - starts
+    values = np.zeros(len(starts), dtype=np.int64)
+    for k in range(int(lengths.max())):
+        live = lengths > k
+        values[live] = values[live] * 10 + (b[starts[live] + k] - 48)
+    return values
+
+
+def _fast_values(buf, n_tokens):
+    # fast path: let numpy's C text parser read every token of the block at once
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            values = np.fromstring(buf, dtype=np.int64, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+    return values if len(values) == n_tokens else None
+
+
+def parse_bytes(buf):
+    '''Parse an in-memory block; returns (row_users, users, items) int32 arrays.'''
+    empty = np.zeros(0, dtype=np.int32)
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if len(b) == 0:
+        return empty, empty, empty
+    is_digit = (b - 48) < 10
+    starts = np.flatnonzero(~is_digit[:-1] & is_digit[1:]) + 1
+    if is_digit[0]:
+        starts = np.insert(starts, 0, 0)
+    if len(starts) == 0:
+        return empty, empty, empty
+    values = _fast_values(buf, len(starts))
+    if values is None:
+        values = _digit_values(b, is_digit, starts)
+
+    # number of tokens before every line end gives the per-line token counts
+    bounds = np.searchsorted(starts, np.flatnonzero(b == 10))
+    bounds = np.concatenate(([0], bounds, [len(starts)]))
+    counts = np.diff(bounds)
+    first = bounds[:-1][counts > 0]
+    counts = counts[counts > 0]
+    is_user = np.zeros(len(starts), dtype=bool)
+    is_user[first] = True
+    row_users = values[first].astype(np.int32)
+    return row_users, np.repeat(row_users, counts - 1), values[~is_user].astype(np.int32)
+
+
+def iter_blocks(f, block_size=BLOCK_SIZE, limit=None):
+    '''Yield byte blocks of a binary file object, each cut after a newline.
+
+    With `limit` only that many bytes from the current position are read.
+    '''
+    tail = b''
+    while limit is None or limit > 0:
+        chunk = f.read(block_size if limit is None else min(block_size, limit))
+        if not chunk:
+            break
+        if limit is not None:
+            limit -= len(chunk)
+        chunk = tail + chunk
+        cut = chunk.rfind(b'\n') + 1
+        if cut == 0:
+            tail = chunk
+            continue
+        tail = chunk[cut:]
+        yield chunk[:cut]
+    if tail:
+        yield tail
+
+
+def read_adjacency(filename, block_size=BLOCK_SIZE):
+    '''Read an adjacency-list file in one pass.
+
+    Returns (row_users, users, items): the user of every non-empty line in
+    file order, and the flattened (user, item) interaction pairs.
+    '''
+    parts = []
+    with open(filename, 'rb') as f:
+        for block in iter_blocks(f, block_size):
+            parts.append(parse_bytes(block))
+    if not parts:
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty, empty
+    return tuple(np.concatenate(p) for p in zip(*parts))
+
+
+def line_ranges(filename, n_parts):
+    '''Cut a file into at most n_parts byte ranges that start at line beginnings.'''
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for k in range(1, n_parts):
+            pos = size * k // n_parts
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+            f.readline()
+            bounds.append(max(min(f.tell(), size), bounds[-1]))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _parse_range(task):
+    filename, start, end, block_size = task
+    parts = []
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        for block in iter_blocks(f, block_size, end - start):
+            parts.append(parse_bytes(block))
+    if parts:
+        arrays = [np.concatenate(p) for p in zip(*parts)]
+    else:
+        arrays = [np.zeros(0, dtype=np.int32)] * 3
+    if shared_memory is None:
+        return arrays
+    # hand the result back through one shared block instead of pickling it
+    lengths = [len(a) for a in arrays]
+    shm = shared_memory.SharedMemory(create=True, size=max(4 * sum(lengths), 1))
+    # the parent unlinks the block once it has copied it out
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    np.ndarray(sum(lengths), dtype=np.int32, buffer=shm.buf)[:] = np.concatenate(arrays)
+    shm.close()
+    return shm.name, lengths
+
+
+def _collect(result):
+    if shared_memory is None:
+        return result
+    name, lengths = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        flat = np.array(np.ndarray(sum(lengths), dtype=np.int32, buffer=shm.buf))
+    finally:
+        shm.close()
+        shm.unlink()
+    return np.split(flat, np.cumsum(lengths)[:-1])
+
+
+def read_splits(filenames, n_workers=None, block_size=BLOCK_SIZE):
+    '''read_adjacency for several files at once, in worker processes.
+
+    Every file is cut into line-aligned ranges (large files into several) and
+    the ranges are parsed by a process pool. Results are merged back in file
+    and offset order, so the output equals calling read_adjacency per file.
+    '''
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    total = sum(os.path.getsize(f) for f in filenames)
+    if n_workers <= 1 or total < PARALLEL_MIN_BYTES:
+        return [read_adjacency(f, block_size) for f in filenames]
+
+    tasks, owner = [], []
+    for i, filename in enumerate(filenames):
+        n_parts = max(1, int(round(n_workers * os.path.getsize(filename) / float(total))))
+        for start, end in line_ranges(filename, n_parts):
+            tasks.append((filename, start, end, block_size))
+            owner.append(i)
+    pool = multiprocessing.Pool(min(n_workers, len(tasks)))
+    try:
+        results = [_collect(r) for r in pool.map(_parse_range, tasks)]
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = []
+    for i in range(len(filenames)):
+        parts = [r for r, o in zip(results, owner) if o == i]
+        if parts:
+            merged.append(tuple(np.concatenate(p) for p in zip(*parts)))
+        else:
+            empty = np.zeros(0, dtype=np.int32)
+            merged.append((empty, empty, empty))
+    return merged
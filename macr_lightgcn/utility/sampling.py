@@ -0,0 +1,221 @@
+'''
+Vectorized samplers over CSR interaction arrays.
+
+Whole batches of users, positives and negatives are drawn with one numpy
+call each. Membership of (user, item) pairs is tested against the sorted
+user * n_items + item keys of a split with searchsorted, and only the
+negatives that hit a positive are redrawn. epoch_batches covers every
+training interaction once per epoch instead of re-sampling users per batch.
+Popularity-weighted users / negatives come from alias tables (O(1) a draw).
+A negative pool holds pre-drawn negatives per user, so a batch only indexes it;
+HardNegatives re-scores such a pool with the current embeddings and serves
+the highest-scored candidates.
+'''
+import numpy as np
+
+
+class PairIndex(object):
+    '''Sorted (user, item) keys of one or more CSR splits for vectorized membership tests.'''
+
+    def __init__(self, indptr, indices, n_items):
+        self.n_items = int(n_items)
+        self.keys = self.pair_keys(indptr, indices, self.n_items)
+
+    @staticmethod
+    def pair_keys(indptr, indices, n_items):
+        degree = np.diff(np.asarray(indptr))
+        users = np.repeat(np.arange(len(degree), dtype=np.int64), degree)
+        # rows are sorted, so the row-major keys already are
+        return users * n_items + np.asarray(indices, dtype=np.int64)
+
+    @classmethod
+    def union(cls, csrs, n_items):
+        '''The index of the union of several (indptr, indices) splits, e.g. train + valid.'''
+        index = cls.__new__(cls)
+        index.n_items = int(n_items)
+        index.keys = np.unique(np.concatenate([cls.pair_keys(indptr, indices, index.n_items)
+                                               for indptr, indices in csrs]))
+        return index
+
+    def contains(self, users, items):
+        users = np.asarray(users, dtype=np.int64)
+        items = np.asarray(items, dtype=np.int64)
+        keys = users * self.n_items + items
+        pos = np.searchsorted(self.keys, keys)
+        hit = pos < len(self.keys)
+        hit[hit] = self.keys[pos[hit]] == keys[hit]
+        return hit & (items < self.n_items)
+
+
+class AliasTable(object):
+    '''Walker's alias table: O(1) draws of indices from a fixed discrete distribution.'''
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        prob = (weights * (n / weights.sum())).tolist()
+        alias = list(range(n))
+        small = [i for i, p in enumerate(prob) if p < 1.]
+        large = [i for i, p in enumerate(prob) if p >= 1.]
+        while small and large:
+            s, l = small.pop(), large[-1]
+            alias[s] = l
+            prob[l] -= 1. - prob[s]
+            if prob[l] < 1.:
+                small.append(large.pop())
+        # whatever is left is 1 up to rounding
+        for i in small + large:
+            prob[i] = 1.
+        self.prob = np.asarray(prob)
+        self.alias = np.asarray(alias, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, rng, size):
+        idx = rng.randint(0, len(self.prob), size)
+        keep = rng.random_sample(size) < self.prob[idx]
+        return np.where(keep, idx, self.alias[idx])
+
+
+def popularity_table(degree, alpha):
+    '''Alias table proportional to degree ** alpha, or None (uniform) when alpha is 0.'''
+    if alpha == 0:
+        return None
+    return AliasTable(np.power(np.asarray(degree, dtype=np.float64), alpha))
+
+
+def _draw_index(rng, n, size, table=None):
+    if table is None:
+        return rng.randint(0, n, size)
+    return table.draw(rng, size)
+
+
+def draw_users(rng, users, batch_size, table=None):
+    '''batch_size distinct entries of users (with replacement when there are too few).
+
+    With an alias table the users are drawn with replacement in proportion to its weights.
+    '''
+    n = len(users)
+    if table is not None:
+        return users[table.draw(rng, batch_size)]
+    if batch_size > n:
+        return users[rng.randint(0, n, batch_size)]
+    if 2 * batch_size > n:
+        return users[rng.choice(n, batch_size, replace=False)]
+    # distinct draws without an O(n) permutation: redraw the duplicates until none are left
+    idx = rng.randint(0, n, batch_size)
+    while True:
+        _, first = np.unique(idx, return_index=True)
+        if len(first) == batch_size:
+            return users[idx]
+        dup = np.ones(batch_size, dtype=bool)
+        dup[first] = False
+        idx[dup] = rng.randint(0, n, np.count_nonzero(dup))
+
+
+def draw_positives(rng, indptr, indices, users):
+    '''One uniform item of every user's row; 0 for users without interactions.'''
+    start = indptr[users]
+    degree = indptr[users + 1] - start
+    offset = (rng.random_sample(len(users)) * degree).astype(np.int64)
+    items = np.zeros(len(users), dtype=np.int32)
+    has = degree > 0
+    items[has] = indices[start[has] + offset[has]]
+    return items
+
+
+def draw_negatives(rng, exclude, users, candidates, table=None, n_negs=1):
+    '''One entry of candidates per user that is not a positive of exclude.
+
+    Entries are uniform, or weighted by an alias table over candidates.
+    With n_negs > 1 every user gets a row of n_negs of them ([len(users), n_negs]).
+    '''
+    if n_negs > 1:
+        return draw_negatives(rng, exclude, np.repeat(users, n_negs), candidates, table).reshape(-1, n_negs)
+    items = candidates[_draw_index(rng, len(candidates), len(users), table)]
+    bad = np.flatnonzero(exclude.contains(users, items))
+    while len(bad):
+        items[bad] = candidates[_draw_index(rng, len(candidates), len(bad), table)]
+        bad = bad[exclude.contains(users[bad], items[bad])]
+    return items
+
+
+def negative_pool(rng, exclude, n_users, candidates, pool_size, table=None):
+    '''[n_users, pool_size] int32 negatives of every user, drawn in one draw_negatives call.'''
+    users = np.repeat(np.arange(n_users, dtype=np.int32), pool_size)
+    return draw_negatives(rng, exclude, users, candidates, table).astype(np.int32).reshape(n_users, pool_size)
+
+
+def pool_negatives(rng, pool, users, n_negs=1):
+    '''Random entries of the users' pool rows: [len(users)], or [len(users), n_negs] with n_negs > 1.'''
+    if n_negs > 1:
+        return pool[users[:, None], rng.randint(0, pool.shape[1], (len(users), n_negs))]
+    return pool[users, rng.randint(0, pool.shape[1], len(users))]
+
+
+def score_pool(user_emb, item_emb, pool, chunk=1024):
+    '''[n_users, pool_size] scores of every user's pool entries, one batched matmul per chunk of users.'''
+    scores = np.empty(pool.shape, dtype=np.float32)
+    for start in range(0, len(pool), chunk):
+        end = start + chunk
+        scores[start:end] = np.matmul(item_emb[pool[start:end]], user_emb[start:end, :, None])[..., 0]
+    return scores
+
+
+def hardest(pool, scores, n_hard):
+    '''The n_hard highest-scored entries of every pool row: [n_users, n_hard].'''
+    top = np.argpartition(-scores, n_hard - 1, axis=1)[:, :n_hard]
+    return np.take_along_axis(pool, top, axis=1)
+
+
+class HardNegatives(object):
+    '''Negatives drawn from the n_hard highest-scored entries of every user's candidate pool.
+
+    embeddings() returns the current (user_emb, item_emb) arrays; the pool is re-scored with
+    them every `every` draws, so the cost of scoring is spread over that many batches.
+    '''
+
+    def __init__(self, n_hard, every, embeddings):
+        self.n_hard, self.every, self.embeddings = n_hard, every, embeddings
+        self.pool, self.hard = None, None
+        self.steps = 0
+
+    def set_pool(self, pool):
+        # new candidates are scored on the next draw
+        self.pool = pool
+        self.steps = 0
+
+    def rescore(self):
+        user_emb, item_emb = self.embeddings()
+        self.hard = hardest(self.pool, score_pool(user_emb, item_emb, self.pool), self.n_hard)
+
+    def draw(self, rng, users, n_negs=1):
+        if self.steps % self.every == 0:
+            self.rescore()
+        self.steps += 1
+        return pool_negatives(rng, self.hard, users, n_negs)
+
+
+def n_epoch_batches(n_interactions, batch_size):
+    return -(-int(n_interactions) // batch_size)
+
+
+def epoch_batches(rng, indptr, indices, exclude, candidates, batch_size, table=None, n_negs=1, negatives=None):
+    '''Every interaction once, shuffled, as contiguous (users, pos_items, neg_items) batches.
+
+    The negatives of the whole epoch are drawn in one vectorized call, or by negatives(rng, users)
+    batch by batch (e.g. from a negative pool that changes during the epoch).
+    '''
+    degree = np.diff(np.asarray(indptr))
+    order = rng.permutation(int(degree.sum()))
+    users = np.repeat(np.arange(len(degree), dtype=np.int32), degree)[order]
+    pos_items = np.asarray(indices, dtype=np.int32)[order]
+    if negatives is None:
+        neg_items = draw_negatives(rng, exclude, users, candidates, table, n_negs)
+    for start in range(0, len(users), batch_size):
+        end = start + batch_size
+        if negatives is None:
+            yield users[start:end], pos_items[start:end], neg_items[start:end]
+        else:
+            yield users[start:end], pos_items[start:end], negatives(rng, users[start:end])
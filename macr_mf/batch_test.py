@@ -5,7 +5,6 @@ import heapq
 
 args = parse_args()
 data = Data(args)
-sorted_id, belong, rate, usersorted_id, userbelong, userrate = data.plot_pics()
 Ks = eval(args.Ks)
 BATCH_SIZE = args.batch_size
 ITEM_NUM = data.n_items
@@ -0,0 +1,52 @@
+'''
+Graph-build time and peak RSS of BPRMF / BIASMF with every loss variant and its
+optimizer (--all_losses 1, the graph before lazy building) vs. only the
+--train loss (and the rating head --test reads).
+
+Every build runs in a fresh process, so its peak RSS is its own. The times are
+the graph construction and the variable initialization (which allocates the
+Adam slots). Flags go to parse.py:
+
+    python bench_graph_build.py --dataset addressa --model mf --train rubibceboth --test rubi
+'''
+import os
+import resource
+import subprocess
+import sys
+from time import time
+
+
+def build(args):
+    import tensorflow as tf
+    from model import BPRMF, BIASMF
+    from load_data import Data
+    data = Data(args)
+    config = {'n_users': data.n_users, 'n_items': data.n_items}
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time()
+    model = (BIASMF if args.model == 'biasmf' else BPRMF)(args, config)
+    t1 = time()
+    with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+        sess.run(tf.global_variables_initializer())
+        t2 = time()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on linux
+    print('%.3f %.3f %d %d %d' % (t1 - t0, t2 - t1, base // 1024, rss // 1024, len(tf.global_variables())))
+
+
+if __name__ == '__main__':
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    if sys.argv[1:2] == ['--child']:
+        sys.argv = sys.argv[:1] + sys.argv[2:]
+        from parse import parse_args
+        build(parse_args())
+        sys.exit()
+
+    results = []
+    for all_losses in (1, 0):
+        out = subprocess.check_output([sys.executable, __file__, '--child'] + sys.argv[1:]
+                                      + ['--all_losses', str(all_losses)], universal_newlines=True)
+        results.append(out.split('\n')[-2].split())
+    for name, (graph, init, base, rss, n_vars) in zip(('all losses', 'selected'), results):
+        print('%-10s: graph %ss + init %ss, %s variables, peak RSS %s MB (%s MB before the model)'
+              % (name, graph, init, n_vars, rss, base))
@@ -0,0 +1,79 @@
+'''
+Epochs to a target test HR@K with uniform vs. hard (score-aware) negatives.
+
+A plain numpy BPR-MF is trained with the batches of Data.train_batches, so
+both runs see the same sampler, batch size and learning rate; only the
+negatives differ. Extra flags (the rest go to parse.py):
+
+    python bench_hard_negatives.py --dataset lastfm --batch_size 1024 --lr 0.05 \
+        --target 0.1 --max_epoch 100 --hard_neg 10 --neg_pool 100 --hard_every 20
+'''
+import argparse
+import sys
+from time import time
+
+import numpy as np
+
+
+def hit_ratio(data, user_emb, item_emb, k):
+    users = np.asarray(sorted(data.test_users), dtype=np.int64)
+    hits = 0
+    for start in range(0, len(users), 1024):
+        batch = users[start:start + 1024]
+        scores = user_emb[batch] @ item_emb.T
+        train = data.train
+        rows = np.repeat(np.arange(len(batch)), np.diff(train.indptr)[batch])
+        cols = np.concatenate([train.indices[train.indptr[u]:train.indptr[u + 1]] for u in batch])
+        scores[rows, cols] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, user in enumerate(batch):
+            hits += np.intersect1d(top[row], data.test.indices[data.test.indptr[user]:data.test.indptr[user + 1]]).size > 0
+    return hits / len(users)
+
+
+def run(data, args, bench, hard):
+    rng = np.random.RandomState(bench.seed)
+    user_emb = rng.normal(0, 0.1, (data.n_users, args.embed_size))
+    item_emb = rng.normal(0, 0.1, (data.n_items, args.embed_size))
+    data.hard_negatives = None
+    data.pool_size = args.neg_pool if hard else 0
+    data.neg_pools = None
+    data.rng = np.random.RandomState(bench.seed)
+    if hard:
+        data.use_hard_negatives(args.hard_neg, args.hard_every, lambda: (user_emb, item_emb))
+    t0 = time()
+    for epoch in range(1, bench.max_epoch + 1):
+        for users, pos_items, neg_items in data.train_batches():
+            u, i, j = user_emb[users], item_emb[pos_items], item_emb[neg_items]
+            g = 1. / (1. + np.exp(np.sum(u * (i - j), axis=1)))[:, None]
+            np.add.at(user_emb, users, args.lr * (g * (i - j) - args.regs * u))
+            np.add.at(item_emb, pos_items, args.lr * (g * u - args.regs * i))
+            np.add.at(item_emb, neg_items, args.lr * (-g * u - args.regs * j))
+        hr = hit_ratio(data, user_emb, item_emb, bench.k)
+        print('%s epoch %d: HR@%d=%.4f [%.1fs]' % ('hard' if hard else 'uniform', epoch, bench.k, hr, time() - t0))
+        if hr >= bench.target:
+            return epoch, time() - t0
+    return None, time() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', type=float, default=0.1)
+    parser.add_argument('--max_epoch', type=int, default=100)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=2020)
+    bench, rest = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + rest
+    from parse import parse_args
+    from load_data import Data
+    args = parse_args()
+    if args.hard_neg <= 0:
+        args.hard_neg = 10
+    if args.neg_pool <= 0:
+        args.neg_pool = 100
+    data = Data(args)
+
+    results = [run(data, args, bench, hard) for hard in (False, True)]
+    for name, (epochs, seconds) in zip(('uniform', 'hard'), results):
+        print('%s: %s epochs to HR@%d >= %.3f (%.1fs)'
+              % (name, epochs if epochs is not None else '> %d' % bench.max_epoch, bench.k, bench.target, seconds))
@@ -0,0 +1,58 @@
+'''
+Training steps/sec of BPRMF with feed_dict batches vs. the tf.data input pipeline.
+
+Both runs build the model in a fresh graph, warm up, then time --steps
+training steps (args.train 'normal') on the CPU. Extra flags (the rest go
+to parse.py):
+
+    python bench_input_pipeline.py --dataset ml10m --batch_size 1024 --steps 2000
+'''
+import argparse
+import os
+import sys
+from time import time
+
+
+def run(data, args, bench, pipeline):
+    import tensorflow as tf
+    from model import BPRMF
+    from pipeline import batch_iterator
+    config = {'n_users': data.n_users, 'n_items': data.n_items}
+    with tf.Graph().as_default():
+        inputs = batch_iterator(data.stream(), args.n_negs, args.prefetch_depth) if pipeline else None
+        model = BPRMF(args, config, inputs)
+        fetches = [model.opt, model.loss]
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            sess.run(tf.global_variables_initializer())
+            batches = data.stream()
+            for step in range(bench.warmup + bench.steps):
+                if step == bench.warmup:
+                    t0 = time()
+                if pipeline:
+                    sess.run(fetches)
+                else:
+                    users, pos_items, neg_items = next(batches)
+                    sess.run(fetches, feed_dict={model.users: users, model.pos_items: pos_items,
+                                                 model.neg_items: neg_items})
+            return bench.steps / (time() - t0)
+
+
+if __name__ == '__main__':
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=50)
+    bench, rest = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + rest
+    from parse import parse_args
+    from load_data import Data
+    args = parse_args()
+    data = Data(args)
+    if args.sample_workers > 0:
+        data.start_prefetch(args.sample_workers, args.prefetch_depth)
+
+    feed = run(data, args, bench, False)
+    dataset = run(data, args, bench, True)
+    print('feed_dict: %.1f steps/s' % feed)
+    print('tf.data:   %.1f steps/s (x%.2f)' % (dataset, dataset / feed))
+    data.stop_prefetch()
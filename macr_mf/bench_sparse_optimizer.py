@@ -0,0 +1,58 @@
+'''
+Training steps/sec of BPRMF with dense adam vs. the row-sparse lazyadam / adagrad
+on synthetic embedding tables (1M users by default).
+
+The batches are uniform random (users, pos_items, neg_items), drawn up front so
+that only the training step is timed (args.train 'normal'). Extra flags (the
+rest go to parse.py):
+
+    python bench_sparse_optimizer.py --n_users 1000000 --n_items 100000 --batch_size 1024 --embed_size 64
+'''
+import argparse
+import os
+import sys
+from time import time
+
+import numpy as np
+
+
+def run(args, bench, optimizer, batches):
+    import tensorflow as tf
+    from model import BPRMF
+    args.optimizer = optimizer
+    config = {'n_users': bench.n_users, 'n_items': bench.n_items}
+    with tf.Graph().as_default():
+        model = BPRMF(args, config)
+        fetches = [model.opt, model.loss]
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            sess.run(tf.global_variables_initializer())
+            for step in range(bench.warmup + bench.steps):
+                if step == bench.warmup:
+                    t0 = time()
+                users, pos_items, neg_items = batches[step % len(batches)]
+                sess.run(fetches, feed_dict={model.users: users, model.pos_items: pos_items,
+                                             model.neg_items: neg_items})
+            return bench.steps / (time() - t0)
+
+
+if __name__ == '__main__':
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_users', type=int, default=1000000)
+    parser.add_argument('--n_items', type=int, default=100000)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--optimizers', nargs='?', default='adam,lazyadam,adagrad')
+    bench, rest = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + rest
+    from parse import parse_args
+    args = parse_args()
+    args.train, args.test, args.all_losses, args.n_negs = 'normal', 'normal', 0, 1
+
+    rng = np.random.RandomState(2020)
+    batches = [(rng.randint(0, bench.n_users, args.batch_size), rng.randint(0, bench.n_items, args.batch_size),
+                rng.randint(0, bench.n_items, args.batch_size)) for _ in range(64)]
+    results = [(optimizer, run(args, bench, optimizer, batches)) for optimizer in bench.optimizers.split(',')]
+    print('%d users x %d items, batch %d, dim %d' % (bench.n_users, bench.n_items, args.batch_size, args.embed_size))
+    for optimizer, steps in results:
+        print('%-8s: %.1f steps/s (x%.2f)' % (optimizer, steps, steps / results[0][1]))
@@ -0,0 +1,90 @@
+'''
+Correctness of the lazyadam / adagrad optimizers of BPRMF against dense Adam.
+
+All runs start from the same embeddings and see the same batches (args.train
+'normal'). Extra flags (the rest go to parse.py):
+
+    python check_sparse_optimizer.py --dataset lastfm --batch_size 1024 --lr 0.001
+
+1. One batch repeated --steps times: every step touches the same rows, so
+   lazyadam has to match dense Adam on every parameter (up to --atol).
+2. One epoch of Data.train_batches: the last step of lazyadam / adagrad may
+   change only the rows of the last batch, and the final training loss of
+   lazyadam has to be within --rtol of dense Adam's.
+'''
+import argparse
+import os
+import sys
+
+import numpy as np
+
+
+def train(args, data, optimizer, batches, init):
+    import tensorflow as tf
+    from model import BPRMF
+    args.optimizer = optimizer
+    config = {'n_users': data.n_users, 'n_items': data.n_items}
+    with tf.Graph().as_default():
+        model = BPRMF(args, config)
+        tables = [model.weights['user_embedding'], model.weights['item_embedding']]
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            sess.run(tf.global_variables_initializer())
+            for table, value in zip(tables, init):
+                table.load(value, sess)
+            for step, (users, pos_items, neg_items) in enumerate(batches):
+                if step == len(batches) - 1:
+                    before = sess.run(tables)
+                _, loss = sess.run([model.opt, model.loss], feed_dict={model.users: users, model.pos_items: pos_items,
+                                                                       model.neg_items: neg_items})
+            return before, sess.run(tables), loss
+
+
+def moved_rows(before, after, rows):
+    # rows outside `rows` that the last step changed
+    outside = np.ones(len(before), dtype=bool)
+    outside[rows] = False
+    return int(np.count_nonzero(np.any(before[outside] != after[outside], axis=1)))
+
+
+if __name__ == '__main__':
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--atol', type=float, default=1e-5)
+    parser.add_argument('--rtol', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=2020)
+    check, rest = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + rest
+    from parse import parse_args
+    from load_data import Data
+    args = parse_args()
+    args.train, args.test, args.all_losses, args.n_negs = 'normal', 'normal', 0, 1
+    data = Data(args)
+    rng = np.random.RandomState(check.seed)
+    init = [rng.normal(0, 0.01, (data.n_users, args.embed_size)).astype(np.float32),
+            rng.normal(0, 0.01, (data.n_items, args.embed_size)).astype(np.float32)]
+    epoch = list(data.train_batches())
+    failed = False
+
+    _, adam, _ = train(args, data, 'adam', [epoch[0]] * check.steps, init)
+    _, lazy, _ = train(args, data, 'lazyadam', [epoch[0]] * check.steps, init)
+    diff = max(np.abs(a - l).max() for a, l in zip(adam, lazy))
+    print('same batch x%d: max |adam - lazyadam| = %.2e' % (check.steps, diff))
+    failed |= diff > check.atol
+
+    users, pos_items, neg_items = epoch[-1]
+    rows = [users, np.concatenate([pos_items, np.ravel(neg_items)])]
+    losses = {}
+    for optimizer in ('adam', 'lazyadam', 'adagrad'):
+        before, after, losses[optimizer] = train(args, data, optimizer, epoch, init)
+        moved = [moved_rows(b, a, r) for b, a, r in zip(before, after, rows)]
+        print('%-8s epoch: loss %.5f, last step moved %d user / %d item rows outside its batch'
+              % (optimizer, losses[optimizer], moved[0], moved[1]))
+        if optimizer != 'adam':
+            failed |= sum(moved) > 0
+    gap = abs(losses['lazyadam'] - losses['adam']) / abs(losses['adam'])
+    print('epoch loss gap lazyadam vs adam: %.2f%%' % (100 * gap))
+    failed |= gap > check.rtol
+
+    print('FAILED' if failed else 'OK')
+    sys.exit(1 if failed else 0)
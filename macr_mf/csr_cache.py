@@ -0,0 +1,122 @@
+'''
+Binary cache for the "user item item ..." split files.
+
+Each split is parsed once and stored next to the data as int32 CSR arrays
+(indptr / indices) plus a small json header with n_users, n_items and a
+fingerprint of the source file. Later runs memory-map the arrays instead of
+re-parsing the text; the cache is rebuilt when the fingerprint changes.
+save_arrays / load_arrays are the same store for any other derived split.
+'''
+import json
+import os
+
+import numpy as np
+
+from reader import read_splits
+
+CACHE_VERSION = 2
+CACHE_DIR = '.cache'
+
+
+def fingerprint(filename):
+    st = os.stat(filename)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'version': CACHE_VERSION}
+
+
+def to_csr(users, items, n_users=None):
+    '''Sort (user, item) pairs into CSR arrays; items of a row are sorted.'''
+    if n_users is None:
+        n_users = int(users.max()) + 1 if len(users) else 0
+    order = np.lexsort((items, users))
+    indices = np.ascontiguousarray(items[order], dtype=np.int32)
+    counts = np.bincount(users, minlength=n_users)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, indices
+
+
+def cache_dir_for(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR)
+
+
+def array_path(cache_dir, name, key):
+    return os.path.join(cache_dir, '{}.{}.npy'.format(name, key))
+
+
+def write_meta(cache_dir, name, meta, lengths):
+    '''Publish a header for arrays already in place; written last so readers never see half a split.'''
+    path = os.path.join(cache_dir, name + '.meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(meta, lengths=lengths), f)
+    os.replace(path + '.tmp', path)
+
+
+def save_arrays(cache_dir, name, arrays, meta):
+    '''Store named arrays as <name>.<key>.npy plus a <name>.meta.json header.'''
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # write the arrays first and the header last, each through a temporary
+    # file, so an interrupted run never leaves a header pointing at half a file
+    lengths = {}
+    for key, arr in arrays.items():
+        path = array_path(cache_dir, name, key)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, arr)
+        os.replace(path + '.tmp', path)
+        lengths[key] = len(arr)
+    write_meta(cache_dir, name, meta, lengths)
+
+
+def load_arrays(cache_dir, name, source):
+    '''Return (arrays, meta) memory-mapped from the cache, or None if it is missing or stale.'''
+    try:
+        with open(os.path.join(cache_dir, name + '.meta.json')) as f:
+            meta = json.load(f)
+        if meta['source'] != source:
+            return None
+        arrays = {}
+        for key, length in meta['lengths'].items():
+            arrays[key] = np.load(array_path(cache_dir, name, key), mmap_mode='r')
+            if len(arrays[key]) != length:
+                return None
+        return arrays, meta
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_csrs(filenames, cache_dir=None, use_cache=True, n_workers=None):
+    '''Return (indptr, indices, n_users, n_items) for every split file.
+
+    n_users / n_items are max id + 1 within each file only; the caller merges
+    them across splits. Arrays are read-only memory maps on a cache hit; the
+    files that miss are parsed together by reader.read_splits.
+    '''
+    out, todo = [None] * len(filenames), []
+    for k, filename in enumerate(filenames):
+        if use_cache:
+            cached = load_arrays(cache_dir or cache_dir_for(filename), os.path.basename(filename), fingerprint(filename))
+            if cached is not None:
+                arrays, meta = cached
+                out[k] = arrays['indptr'], arrays['indices'], meta['n_users'], meta['n_items']
+                continue
+        todo.append(k)
+
+    parsed = read_splits([filenames[k] for k in todo], n_workers) if todo else []
+    for k, (_, users, items) in zip(todo, parsed):
+        filename = filenames[k]
+        indptr, indices = to_csr(users, items)
+        n_users = len(indptr) - 1
+        n_items = int(items.max()) + 1 if len(items) else 0
+        if use_cache:
+            try:
+                save_arrays(cache_dir or cache_dir_for(filename), os.path.basename(filename),
+                            {'indptr': indptr, 'indices': indices},
+                            {'n_users': n_users, 'n_items': n_items, 'source': fingerprint(filename)})
+            except OSError as e:
+                print('could not write split cache for', filename, e)
+        out[k] = indptr, indices, n_users, n_items
+    return out
+
+
+def load_csr(filename, cache_dir=None, use_cache=True):
+    return load_csrs([filename], cache_dir, use_cache, n_workers=1)[0]
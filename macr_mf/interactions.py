@@ -0,0 +1,154 @@
+'''
+Read-only interaction store backed by int32 CSR (user -> items) and CSC
+(item -> users) arrays.
+
+The per-user / per-item views behave like the old defaultdict(list) maps:
+indexing returns the row (a zero-copy int32 slice, empty for ids without
+interactions) and keys() / items() only visit non-empty rows. Nothing holds
+python ints, so forked evaluation workers share the pages instead of
+copying them. The item orientation is built on first use.
+'''
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+
+from csr_cache import to_csr
+
+
+class RowView(Mapping):
+    '''Mapping id -> row slice over one orientation of the matrix.'''
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.degree = np.diff(indptr).astype(np.int32)
+        self._keys = None
+
+    def __getitem__(self, key):
+        if not 0 <= key < len(self.degree):
+            raise KeyError(key)
+        return self.indices[self.indptr[key]:self.indptr[key + 1]]
+
+    def __contains__(self, key):
+        try:
+            return 0 <= key < len(self.degree) and self.degree[key] > 0
+        except TypeError:
+            return False
+
+    def nonempty(self):
+        '''ids with at least one interaction, as an int32 array.'''
+        if self._keys is None:
+            self._keys = np.flatnonzero(self.degree).astype(np.int32)
+        return self._keys
+
+    def __iter__(self):
+        return iter(self.nonempty().tolist())
+
+    def __len__(self):
+        return len(self.nonempty())
+
+
+class InteractionMatrix(object):
+    '''Binary n_users x n_items interaction matrix; rows of both orientations are sorted.'''
+
+    def __init__(self, indptr, indices, n_users, n_items, item_degree=None):
+        indptr = np.asarray(indptr)
+        if len(indptr) < n_users + 1:
+            # the split may not mention the last users of the dataset
+            indptr = np.concatenate((indptr, np.full(n_users + 1 - len(indptr), indptr[-1], dtype=indptr.dtype)))
+        self.n_users, self.n_items = int(n_users), int(n_items)
+        self.indptr = indptr
+        self.indices = np.asarray(indices)
+        self.nnz = len(self.indices)
+
+        self.user_degree = np.diff(indptr).astype(np.int32)
+        self.by_user = RowView(self.indptr, self.indices)
+        self._item_degree = item_degree
+        self._csc = None
+
+    @property
+    def item_degree(self):
+        if self._item_degree is None:
+            self._item_degree = np.bincount(self.indices, minlength=self.n_items).astype(np.int32)
+        return self._item_degree
+
+    def _item_side(self):
+        # the item orientation is only built when something asks for it, so a
+        # memory-mapped split stays on disk until then
+        if self._csc is None:
+            # the stable sort keeps the users of every item column sorted
+            order = np.argsort(self.indices, kind='stable')
+            item_indices = np.repeat(np.arange(self.n_users, dtype=np.int32), self.user_degree)[order]
+            item_indptr = np.zeros(self.n_items + 1, dtype=np.int64)
+            np.cumsum(self.item_degree, out=item_indptr[1:])
+            self._csc = item_indptr, item_indices, RowView(item_indptr, item_indices)
+        return self._csc
+
+    @property
+    def item_indptr(self):
+        return self._item_side()[0]
+
+    @property
+    def item_indices(self):
+        return self._item_side()[1]
+
+    @property
+    def by_item(self):
+        return self._item_side()[2]
+
+    @classmethod
+    def from_pairs(cls, users, items, n_users, n_items):
+        users = np.asarray(users, dtype=np.int32)
+        items = np.asarray(items, dtype=np.int32)
+        indptr, indices = to_csr(users, items, n_users)
+        return cls(indptr, indices, n_users, n_items)
+
+    @classmethod
+    def from_scipy(cls, matrix):
+        '''Build from any scipy sparse matrix; explicit entries are interactions.'''
+        matrix = matrix.tocsr()
+        matrix.sum_duplicates()
+        n_users, n_items = matrix.shape
+        return cls(matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32), n_users, n_items)
+
+    @classmethod
+    def from_lists(cls, user_lists, n_users, n_items):
+        '''Build from a {user: [items]} map.'''
+        users, items = [], []
+        for user, row in user_lists.items():
+            users.extend([user] * len(row))
+            items.extend(row)
+        return cls.from_pairs(users, items, n_users, n_items)
+
+    def remapped(self, user_map, item_map):
+        '''The matrix over the dense ids of two remap.IdMap; rows outside user_map must be empty.'''
+        # dropped rows are empty and the item map is monotone, so the indices
+        # keep their order and only need translating
+        raw_users = user_map.reverse[user_map.reverse < self.n_users]
+        degree = np.zeros(len(user_map), dtype=np.int64)
+        degree[:len(raw_users)] = self.user_degree[raw_users]
+        indptr = np.zeros(len(user_map) + 1, dtype=np.int64)
+        np.cumsum(degree, out=indptr[1:])
+        return InteractionMatrix(indptr, item_map.forward[self.indices], len(user_map), len(item_map))
+
+    def user_items(self, user):
+        return self.indices[self.indptr[user]:self.indptr[user + 1]]
+
+    def item_users(self, item):
+        return self.item_indices[self.item_indptr[item]:self.item_indptr[item + 1]]
+
+    def has(self, user, item):
+        row = self.user_items(user)
+        pos = np.searchsorted(row, item)
+        return pos < len(row) and row[pos] == item
+
+    def to_scipy(self):
+        import scipy.sparse as sp
+        return sp.csr_matrix((np.ones(self.nnz, dtype=np.float32), self.indices, self.indptr),
+                             shape=(self.n_users, self.n_items))
+
+    def __len__(self):
+        return self.nnz
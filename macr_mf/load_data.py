@@ -6,9 +6,20 @@ import json
 import os
 import collections
 import heapq
+from itertools import islice
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 import scipy.sparse as sp
+from csr_cache import load_csrs, load_arrays, save_arrays, cache_dir_for, fingerprint
+from interactions import InteractionMatrix
+import registry
+from popularity import PopularityStats, buckets, ITEM_POINTS, USER_POINTS
+from streaming import ingest, MEM_CAP_MB
+from resample import quota_curve, long_tail, split_rows, to_arrays, from_arrays
+from remap import IdMap
+from prefetch import Prefetcher
+from sampling import PairIndex, draw_users, draw_positives, draw_negatives, epoch_batches, n_epoch_batches, \
+    popularity_table, negative_pool, pool_negatives, HardNegatives
 
 
 plt.switch_backend('agg')
@@ -23,23 +34,93 @@ def load(load_path, filename, **kwargs):
 
 class Data():
 
+    def _load_splits(self, args, *files):
+        # parse (or memory-map) every split once and grow n_users / n_items to cover all of them
+        files = [f + '.gz' if not os.path.exists(f) and os.path.exists(f + '.gz') else f for f in files]
+        suffix = ''
+        if args.stream_mem > 0 or any(f.endswith('.gz') for f in files):
+            # out-of-core: spill sorted runs and merge them into the split cache under the memory cap;
+            # streamed splits are de-duplicated, so they are registered apart from the parsed ones
+            suffix = '.stream'
+            splits = [ingest(f, mem_cap_mb=args.stream_mem or MEM_CAP_MB, use_cache=args.split_cache == 1) for f in files]
+        else:
+            splits = load_csrs(files, use_cache=args.split_cache == 1, n_workers=args.load_workers or None)
+        n_users, n_items = registry.id_space(splits)
+        self.n_users = max(self.n_users, n_users)
+        self.n_items = max(self.n_items, n_items)
+        if args.split_cache != 1:
+            # nothing is written next to the data; the matrices count their own degrees
+            return [(indptr, indices, None) for indptr, indices, _, _ in splits]
+        # the registry holds the degree arrays of every split it has seen
+        meta = registry.lookup(self.path, files, suffix)
+        if meta is None:
+            meta = registry.register(self.path, args.dataset, files, splits, suffix)
+        self.meta = meta
+        return [(indptr, indices, registry.degrees(f, suffix)) for f, (indptr, indices, _, _) in zip(files, splits)]
+
+    def _matrices(self, splits, n_items=None):
+        if n_items is None:
+            n_items = self.n_items
+        matrices = []
+        for indptr, indices, degrees in splits:
+            item_degree = degrees[1] if degrees is not None and len(degrees[1]) == n_items else None
+            matrices.append(InteractionMatrix(indptr, indices, self.n_users, n_items, item_degree))
+        return matrices
+
+    def _set_splits(self, train, test, valid=None):
+        if valid is None:
+            valid = InteractionMatrix.from_pairs([], [], train.n_users, train.n_items)
+        if self.remap:
+            # keep only the ids that occur in some split so embeddings and score rows are sized by real entities
+            splits = (train, test, valid)
+            self.user_map = IdMap.from_ids(*[m.by_user.nonempty() for m in splits])
+            self.item_map = IdMap.from_ids(*[m.indices for m in splits])
+            train, test, valid = [m.remapped(self.user_map, self.item_map) for m in splits]
+            self.n_users, self.n_items = len(self.user_map), len(self.item_map)
+        self.train, self.valid, self.test = train, valid, test
+        # the old per-user map names stay as views on the arrays; the per-item ones are properties below
+        self.train_user_list = train.by_user
+        self.valid_user_list = valid.by_user
+        self.test_user_list = test.by_user
+        self.n_train, self.n_valid, self.n_test = train.nnz, valid.nnz, test.nnz
+
+    def raw_users(self, users):
+        return users if self.user_map is None else self.user_map.to_raw(users)
+
+    def raw_items(self, items):
+        return items if self.item_map is None else self.item_map.to_raw(items)
+
+    def save_id_maps(self, path):
+        if self.remap:
+            self.user_map.save(path, 'user')
+            self.item_map.save(path, 'item')
+
+    @property
+    def train_item_list(self):
+        return self.train.by_item
+
+    @property
+    def valid_item_list(self):
+        return self.valid.by_item
+
+    @property
+    def test_item_list(self):
+        return self.test.by_item
+
     def load_ori_data(self, args):
         self.path = './data/{}/'.format(args.dataset)
         if args.model == 'mf' or args.model == 'biasmf':
             if args.source=="dice":
                 self.path = "data/ml10m_dice/"
-                train_record = sp.load_npz(self.path+"train_coo_record.npz").tolil(copy=True)
-                train_skew_record = sp.load_npz(self.path+"train_skew_coo_record.npz").tolil(copy=True)
-                valid_record = sp.load_npz(self.path+"val_coo_record.npz").tolil(copy=True)
-                test_record = sp.load_npz(self.path+"test_coo_record.npz").tolil(copy=True)
+                # COO -> CSR happens inside scipy; train and train_skew are merged with one sparse add
+                train_record = load(self.path, "train_coo_record.npz").tocsr()
+                train_record = train_record + load(self.path, "train_skew_coo_record.npz").tocsr()
+                valid_record = load(self.path, "val_coo_record.npz").tocsr()
+                test_record = load(self.path, "test_coo_record.npz").tocsr()
                 self.n_users, self.n_items = train_record.shape[0], train_record.shape[1]
-                self.n_train = int(np.sum(train_record)+np.sum(train_skew_record))
-                self.n_test = int(np.sum(test_record))
-                self.n_valid = int(np.sum(valid_record))
-                for i in range(self.n_users):
-                    self.train_user_list[i] = train_record.rows[i] + train_skew_record.rows[i]
-                    self.test_user_list[i] = test_record.rows[i]
-                    self.valid_user_list[i] = valid_record.rows[i]
+                self._set_splits(InteractionMatrix.from_scipy(train_record),
+                                 InteractionMatrix.from_scipy(test_record),
+                                 InteractionMatrix.from_scipy(valid_record))
                 self.users = list(range(self.n_users))
                 self.items = list(range(self.n_items))
                 self.test_users = set(self.test_user_list.keys())
@@ -48,434 +129,128 @@ class Data():
                 train_file = self.path + 'train.txt'
                 valid_file = self.path + 'valid.txt'
                 test_file = self.path + 'test.txt'
-                with open(train_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        if (len(items)==0):
-                            continue
-                        self.train_user_list[user] = items
-                        for item in items:
-                            self.train_item_list[item].append(user)
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-                        self.n_train += len(items)
-
-                with open(valid_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        if len(items) == 0:
-                            continue
-                        self.valid_user_list[user] = items
-                        self.valid_items.update(set(items))
-                        for item in items:
-                            self.valid_item_list[item].append(user)
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-                        self.n_valid += len(items)
-
-                with open(test_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        if len(items) == 0:
-                            continue
-                        self.test_user_list[user] = items
-                        for item in items:
-                            self.test_item_list[item].append(user)
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-                        self.n_test += len(items)
+                splits = self._load_splits(args, train_file, valid_file, test_file)
+                train, valid, test = self._matrices(splits)
+                self._set_splits(train, test, valid)
+                self.valid_items.update(self.valid_item_list.keys())
                 print(self.n_train,self.n_valid,self.n_test)
-                self.n_users = self.n_users + 1
-                self.n_items = self.n_items + 1
                 self.users = list(range(self.n_users))
                 self.items = list(range(self.n_items))
 
-
-                # for i in range(self.n_users):
-                #     for item in self.train_user_list[i]:
-                #         self.train_item_list[item].append(i)
-                #     for item in self.test_user_list[i]:
-                #         self.test_item_list[item].append(i)
-                #     for item in self.valid_user_list[i]:
-                #         self.valid_item_list[item].append(i)
-                #     self.n_train += len(self.train_user_list[i])
-                #     self.n_test += len(self.test_user_list[i])
-                #     self.n_valid += len(self.valid_user_list[i])
                 self.valid_users = set(self.valid_user_list.keys())
                 self.test_users = set(self.test_user_list.keys())
         elif args.model == 'CausalE' or args.model == 'IPSmf':
-            if args.dataset == 'movielens_ml_10m' or args.dataset == 'movielens_ml_1m' or args.dataset == 'lastfm' or args.dataset == 'addressa'\
-                                                                    or args.dataset == 'kwai' or args.dataset == 'globe':
+            if registry.fixed_n_items(self.path, args.dataset, 'ori') is not None:
                 if args.skew == 1:
                     train_file = self.path + 'skew_train.txt'
                 else:
                     train_file = self.path + 'train.txt'
                 test_file = self.path + 'test.txt'
 
-                with open(train_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        self.train_user_list[user] = items
-                        self.users.add(user)
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-                        # self.n_train += len(items)
-
-                with open(test_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        self.test_user_list[user] = items
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-                        # self.n_test += len(items)
-                self.n_users = self.n_users + 1
-                if args.dataset == 'movielens_ml_10m':
-                    self.n_items = 8790
-                elif args.dataset == 'movielens_ml_1m':
-                    self.n_items = 3125
-                elif args.dataset == 'lastfm':
-                    self.n_items = 2822
-                elif args.dataset == 'addressa':
-                    self.n_items = 744
-                elif args.dataset == 'kwai':
-                    self.n_items = 80524
-                elif args.dataset == 'globe':
-                    self.n_items = 12005
+                splits = self._load_splits(args, train_file, test_file)
+                # the embedding item count is fixed per dataset (see registry.py); the matrices still cover every id seen
+                n_items = self.n_items
+                self.n_items = registry.fixed_n_items(self.path, args.dataset, 'ori')
+                train, test = self._matrices(splits, max(n_items, self.n_items))
+                self._set_splits(train, test)
                 # self.users = list(range(self.n_users))
                 self.items = list(range(self.n_items))
-                self.users = list(self.users)
-
-
-
-                countTrainItem = {}
-                countTestItem = {}
-                countTrainInters = [0,0,0]
-                countTestInters = [0,0,0]
-                for i in range(self.n_users):
-                    for item in self.train_user_list[i]:
-                        self.train_item_list[item].append(i)
-                        if item not in countTrainItem.keys():
-                            countTrainItem[item] = 0
-                        countTrainItem[item] += 1
-                    for item in self.test_user_list[i]:
-                        self.test_item_list[item].append(i)
-                        if item not in countTestItem:
-                            countTestItem[item] = 0
-                        countTestItem[item] += 1
-                    self.n_train += len(self.train_user_list[i])
-                    self.n_test += len(self.test_user_list[i])
-                topNum = [0.01, 0.05, 0.1]
-                topNum1 = [int(i * len(self.train_item_list)) for i in topNum]
-                topNum2 = [int(i * len(self.test_item_list)) for i in topNum]
-                # print(topNum1, topNum2)
-                countTrainItem = [heapq.nlargest(i, countTrainItem, key = countTrainItem.get) for i in topNum1]
-                countTestItem = [heapq.nlargest(i, countTestItem, key = countTestItem.get) for i in topNum2]
-                # print(countTrainItem, countTestItem)
-
-                for user, items in self.train_user_list.items():
-                    for item in items:
-                        for i in range(len(topNum)):
-                            if item in countTrainItem[i]:
-                                countTrainInters[i] += 1
-                for user, items in self.test_user_list.items():
-                    for item in items:
-                        for i in range(len(topNum)):
-                            if item in countTestItem[i]:
-                                countTestInters[i] += 1
-                
-                for i in range(3):
-                    print(countTrainInters[i]/self.n_train, countTestInters[i]/self.n_test, len(countTrainItem[i]), len(countTestItem[i]), len(set(countTestItem[i])&set(countTrainItem[i])))
-
-    def load_imb_data(self):
+                self.users = list(self.train_user_list.keys())
+
+
+
+                self.popularity = PopularityStats(self.train, self.test)
+                self.popularity.report()
+
+    def _split_user_list(self, args):
+        # user_list.json holds every user's items in order; the first devide_ratio of each row is train
+        user_file = self.path + 'user_list.json'
+        cache_dir, name = cache_dir_for(user_file), 'user_list.json.{}'.format(args.devide_ratio)
+        source = dict(fingerprint(user_file), devide_ratio=args.devide_ratio)
+        cached = load_arrays(cache_dir, name, source) if args.split_cache == 1 else None
+        if cached is not None:
+            arrays, meta = cached
+            return from_arrays(arrays, ['train', 'test'], meta['n_users'], meta['n_items']), source
+        with open(user_file) as f:
+            temp_list = json.loads(f.read())
+        train, test = split_rows(list(temp_list.values()), args.devide_ratio)
+        if args.split_cache == 1:
+            save_arrays(cache_dir, name, to_arrays({'train': train, 'test': test}),
+                        {'n_users': train.n_users, 'n_items': train.n_items, 'source': source})
+        return (train, test), source
+
+    def _resample(self, args, train, base_name, base_source):
+        # the cut only depends on the base split and the quota curve, so it is stored per curve
+        params = {'imb_type': args.imb_type, 'lam': args.lam, 'user_min': args.user_min,
+                  'user_max': args.user_max, 'top_ratio': args.top_ratio, 'n_items': self.n_items}
+        cache_dir = cache_dir_for(self.path + base_name)
+        name = '{}.{imb_type}_lam{lam}_min{user_min}_max{user_max}_top{top_ratio}'.format(base_name, **params)
+        source = {'base': base_source, 'params': params}
+        cached = load_arrays(cache_dir, name, source) if args.split_cache == 1 else None
+        if cached is not None:
+            return from_arrays(cached[0], ['train'], train.n_users, train.n_items)[0]
+
+        item_degree = self.popularity.train_item_degree[:self.n_items]
+        quota = quota_curve(item_degree, args.imb_type, args.lam, args.user_min, args.user_max, args.top_ratio)
+        train = long_tail(train, quota, self.n_items)
+        if args.split_cache == 1:
+            save_arrays(cache_dir, name, to_arrays({'train': train}), {'source': source})
+        return train
+
+    def load_imb_data(self, args):
+        train = None
         if args.model == 'mf':
             if args.dataset == 'movielens_ml_1m' or args.dataset == 'movielens_ml_1m_sorted' or args.dataset == 'movielens_ml_10m' or \
                                                                     args.dataset == 'movielens_ml_10m_sorted' or args.dataset == 'lastfm' or args.dataset == 'addressa' or args.dataset == 'globe':
-                user_file = self.path + 'user_list.json'
-                with open(user_file) as f:
-                    temp_list = json.loads(f.read())
-                    for user in temp_list:
-                        items = temp_list[user]
-                        #items = [int(i) for i in items]   #item_id starts from 0。
-                        self.n_items = max(self.n_items, max(items))
-                        self.user_list.append(items)
-                self.n_users = len(self.user_list)
-                self.n_items = self.n_items + 1
-                self.users = list(range(self.n_users))
-                self.items = list(range(self.n_items))
-                # print(self.n_users, self.n_items)
-
-                ratio = args.devide_ratio
-
-                
-                for i in range(len(self.user_list)):
-                    items = self.user_list[i]
-                    cutPoint = int(len(items) * ratio)
-                    self.train_user_list[i] = items[:cutPoint]
-                    self.test_user_list[i] = items[cutPoint:]
-                    # self.train_user_list[i] = rd.sample(list(self.users), cutPoint)
-                    # for item in items:
-                    #     if item in self.train_user_list[i]:
-                    #         pass
-                    #     self.test_user_list[i].append(item)
-
-
-                # print(countTrainItem)
-                # print(countTestItem)
-                # print(set(countTestItem) & set(countTrainItem))
+                (train, test), base_source = self._split_user_list(args)
+                base_name = 'user_list.json.{}'.format(args.devide_ratio)
+                self.n_users, self.n_items = train.n_users, train.n_items
 
             elif args.dataset == 'gowalla':
-                train_file = self.path + 'train.txt'
-                test_file = self.path + 'test.txt'
-
-                with open(train_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        self.train_user_list[user] = items
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-
-                with open(test_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        self.test_user_list[user] = items
-                        self.n_users = max(self.n_users, user)
-                        self.n_items = max(self.n_items, max(items))
-                self.n_users = self.n_users + 1
-                self.n_items = self.n_items + 1
-                self.users = list(range(self.n_users))
-                self.items = list(range(self.n_items))
+                base_name = 'train.txt'
+                splits = self._load_splits(args, self.path + 'train.txt', self.path + 'test.txt')
+                base_source = [fingerprint(self.path + 'train.txt'), fingerprint(self.path + 'test.txt')]
+                train, test = self._matrices(splits)
 
         elif args.model == 'CausalE' or args.model == 'IPSmf':
-            if args.dataset == 'movielens_ml_10m' or args.dataset == 'movielens_ml_1m' or args.dataset == 'lastfm' or args.dataset == 'addressa'\
-                                                                    or args.dataset == 'kwai' or args.dataset == 'globe':
+            if registry.fixed_n_items(self.path, args.dataset, 'imb') is not None:
                 if args.skew == 1:
-                    train_file = self.path + 'skew_train.txt'
+                    base_name = 'skew_train.txt'
                 else:
-                    train_file = self.path + 'train.txt'
+                    base_name = 'train.txt'
+                train_file = self.path + base_name
                 test_file = self.path + 'test.txt'
+                splits = self._load_splits(args, train_file, test_file)
+                base_source = [fingerprint(train_file), fingerprint(test_file)]
+                n_items = self.n_items
+                self.n_items = registry.fixed_n_items(self.path, args.dataset, 'imb')
+                train, test = self._matrices(splits, max(n_items, self.n_items))
 
-                with open(train_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        self.train_user_list[user] = items
-                        self.users.add(user)
-                        self.n_users = max(self.n_users, user)
-                        #self.n_items = max(self.n_items, max(items))
-
-                with open(test_file) as f:
-                    for line in f.readlines():
-                        line = line.strip('\n').split(' ')
-                        if len(line) == 0:
-                            continue
-                        line = [int(i) for i in line]
-                        user = line[0]
-                        items = line[1:]
-                        self.test_user_list[user] = items
-                        self.n_users = max(self.n_users, user)
-                        #self.n_items = max(self.n_items, max(items))
-                self.n_users = self.n_users + 1
-                if args.dataset == 'movielens_ml_10m':
-                    self.n_items = 8790
-                elif args.dataset == 'movielens_ml_1m':
-                    self.n_items = 3125
-                elif args.dataset == 'lastfm':
-                    self.n_items = 3646
-                elif args.dataset == 'addressa':
-                    self.n_items = 744
-                elif args.dataset == 'kwai':
-                    self.n_items = 80524
-                elif args.dataset == 'globe':
-                    self.n_items = 12005
-                # self.users = list(range(self.n_users))
-                self.items = list(range(self.n_items))
-                self.users = list(self.users)
-
-
-        countTrainItem = {}
-        countTestItem = {}
-        countTrainInters = [0,0,0]
-        countTestInters = [0,0,0]
-        for i in range(self.n_users):
-            for item in self.train_user_list[i]:
-                self.train_item_list[item].append(i)
-                if item not in countTrainItem.keys():
-                    countTrainItem[item] = 0
-                countTrainItem[item] += 1
-            for item in self.test_user_list[i]:
-                self.test_item_list[item].append(i)
-                if item not in countTestItem:
-                    countTestItem[item] = 0
-                countTestItem[item] += 1
-            self.n_train += len(self.train_user_list[i])
-            self.n_test += len(self.test_user_list[i])
-
-        # t = [len(x) for x in self.train_item_list.values()]
-        # t.sort(reverse=True)
-        # print(t[0])
-
-        topNum = [0.01, 0.05, 0.1]
-        topNum1 = [int(i * len(self.train_item_list)) for i in topNum]
-        topNum2 = [int(i * len(self.test_item_list)) for i in topNum]
-        # print(topNum1, topNum2)
-        countTrainItem_topk = [heapq.nlargest(i, countTrainItem, key = countTrainItem.get) for i in topNum1]
-        countTestItem_topk = [heapq.nlargest(i, countTestItem, key = countTestItem.get) for i in topNum2]
-        # print(countTrainItem, countTestItem)
-
-        for user, items in self.train_user_list.items():
-            for item in items:
-                for i in range(len(topNum)):
-                    if item in countTrainItem_topk[i]:
-                        countTrainInters[i] += 1
-        for user, items in self.test_user_list.items():
-            for item in items:
-                for i in range(len(topNum)):
-                    if item in countTestItem_topk[i]:
-                        countTestInters[i] += 1
-                
-        for i in range(3):
-            print(countTrainInters[i]/self.n_train, countTestInters[i]/self.n_test, len(countTrainItem_topk[i]), len(countTestItem_topk[i]), len(set(countTestItem_topk[i])&set(countTrainItem_topk[i])))
-        
-        idxs = list(range(self.n_items))
-        for idx in idxs:
-            if idx not in countTrainItem.keys():
-                countTrainItem[idx] = 0
-        idxs.sort(key = lambda x:-countTrainItem[x])
-        # print(countTrainItem[idxs[0]])
-        # print(idxs).
-
+        if train is None:
+            print('no imbalanced split for', args.model, args.dataset)
+            exit()
 
+        self.popularity = PopularityStats(train, test)
+        self.n_train, self.n_test = self.popularity.n_train, self.popularity.n_test
+        self.popularity.report()
 
         # self.plot_fit_pic(args, idxs, countTrainItem)
 
-
-        user_max = args.user_max
-        user_num_per_cls = []
-        cls_num = self.n_items
-        imb_factor = (1.0*args.user_min/args.user_max)# **(1.0/args.lam)
-        # print(imb_factor)
-        lam = args.lam
-        if args.imb_type == 'exp':
-            for cls_idx in self.items:
-                num = user_max * (imb_factor**(lam*cls_idx / (cls_num - 1.0)))
-                user_num_per_cls.append(max(1,int(num)))
-        elif args.imb_type == 'step':
-            topN = int(cls_num * args.top_ratio)
-            user_max = countTrainItem[idxs[topN]]
-            for cls_idx in range(topN):
-                user_num_per_cls.append(int(user_max))
-            for cls_idx in range(cls_num - topN):
-                user_num_per_cls.append(int(user_max * imb_factor))
-        
-        self.train_user_list = collections.defaultdict(list)
-        for item, user_num in zip(idxs, user_num_per_cls):
-            item_list = self.train_item_list[item]
-            # rd.shuffle(item_list)
-            # self.train_item_list[item] = item_list[:user_num]
-            item_list_num = len(item_list)
-            if item_list_num > user_num:
-                self.train_item_list[item] = item_list[item_list_num-user_num:]
-            else:
-                self.train_item_list[item] = item_list
-        
-        for item, users in self.train_item_list.items():
-            for user in users:
-                self.train_user_list[user].append(item)
-        self.users = list(set(self.train_user_list.keys()))
+        train = self._resample(args, train, base_name, base_source)
+        self._set_splits(train, test)
+        self.items = list(range(self.n_items))
+        self.users = list(self.train_user_list.keys())
         # print(len(self.users))
 
-    def plot_pics(self):
-        y = []
-        for item, users in self.train_item_list.items():
-            y.append(len(users))
-        y = np.asarray(y)
-
-        points = [10, 50, 100, 200, 500]
-        count = [0, 0, 0, 0, 0, 0]
-        area_sum = [0, 0, 0, 0, 0, 0]
-        rate = []
-        belong = []
-        sorted_id = np.argsort(y)
-        y = y[sorted_id]
-        p = 0
-        for n, score in enumerate(y):
-            while p!=5 and points[p] < score:
-                p += 1
-            count[p] += 1
-            area_sum[p] += score
-            belong.append(p)
-
-        for i in range(len(count)):
-            rate.append(1.0*count[i]/self.n_items)
-
-
-
-        y = []
-        for user, items in self.train_user_list.items():
-            y.append(len(items))
-        y = np.asarray(y)
+    def plot_pics(self, item_points=ITEM_POINTS, user_points=USER_POINTS):
+        # popularity groups of the train items / users; built on first use and kept on the dataset
+        key = (tuple(item_points), tuple(user_points))
+        if key not in self._buckets:
+            sorted_id, belong, rate = buckets(self.train.item_degree, item_points, self.n_items)
+            usersorted_id, userbelong, userrate = buckets(self.train.user_degree, user_points, self.n_users)
+            self._buckets[key] = sorted_id, belong, rate, usersorted_id, userbelong, userrate
+        return self._buckets[key]
 
-        points = [5, 7, 10, 15, 20]
-        count = [0, 0, 0, 0, 0, 0]
-        area_sum = [0, 0, 0, 0, 0, 0]
-        userrate = []
-        userbelong = []
-        usersorted_id = np.argsort(y)
-        y = y[usersorted_id]
-        p = 0
-        for n, score in enumerate(y):
-            while p!=5 and points[p] < score:
-                p += 1
-            count[p] += 1
-            area_sum[p] += score
-            userbelong.append(p)
-
-        for i in range(len(count)):
-            userrate.append(1.0*count[i]/self.n_users)
-                
-
-
-        return sorted_id, belong, rate, usersorted_id, userbelong, userrate
-    
     def plot_fit_pic(self, args, idxs, countTrainItem):
         # print(123123131312312)
         N_max = countTrainItem[idxs[0]]
@@ -513,14 +288,26 @@ class Data():
         self.item_list = []
         self.valid_users = set()
         self.valid_items = set()
-        self.train_user_list = collections.defaultdict(list)
-        self.test_user_list = collections.defaultdict(list)
-        self.train_item_list = collections.defaultdict(list)
-        self.test_item_list = collections.defaultdict(list)
-        self.valid_user_list = collections.defaultdict(list)
-        self.valid_item_list = collections.defaultdict(list)
         self.users = set()
         self.items = set()
+        self.remap = args.remap == 1
+        if self.remap and args.model in ('CausalE', 'IPSmf'):
+            # their item tables are sized by the fixed per-dataset item count, and CausalE tells the
+            # skew_train (treatment) items by their ids at or above it; compacting the ids breaks both
+            raise ValueError('--remap 1 is not supported by the CausalE / IPSmf models.')
+        self.user_map, self.item_map = None, None
+        self._buckets = {}
+        self._samplers = {}
+        self.sampler = args.sampler
+        self.neg_alpha, self.user_alpha = args.neg_alpha, args.user_alpha
+        self.n_negs = args.n_negs
+        # [n_users, neg_pool] train negatives redrawn every epoch (0: drawn per batch), optionally
+        # narrowed down to the best-scored candidates by use_hard_negatives
+        self.pool_size = args.neg_pool
+        self.neg_pools = None
+        self.hard_negatives = None
+        self.prefetcher = None
+        self.rng = np.random.RandomState()
         
         #print(os.getcwd())
         
@@ -533,79 +320,144 @@ class Data():
         self.valid_items = list(self.valid_items)
         # self.plot_pics(args)
         print('n_items:', self.n_items, 'n_users:', self.n_users)
-        sum = 0
-        for item, users in self.train_item_list.items():
-            sum += len(users)
-        print("sparsity:", 1.0*sum/self.n_items/self.n_users)
+        print("sparsity:", 1.0*self.train.nnz/self.n_items/self.n_users)
 
         
         
 
 
-    def sample(self):
-        if self.batch_size <= self.n_users:
-            users = rd.sample(self.users, self.batch_size)
-        else:
-            users = [rd.choice(self.users) for _ in range(self.batch_size)]
-
-        pos_items, neg_items = [], []
-
-        for user in users:
-            if self.train_user_list[user] == []:
-                pos_items.append(0)
+    def _sampler(self, split):
+        # (users, exclusion index) of a split's sampler or an alias table, built on first use once the user lists are final;
+        # negatives of the held-out splits must avoid train and the split itself
+        if split not in self._samplers:
+            if split == 'items':
+                self._samplers[split] = np.asarray(self.items, dtype=np.int32)
+            elif split == 'item_table':
+                # negatives in proportion to train degree ** neg_alpha (None: uniform)
+                items = self._sampler('items')
+                degree = np.zeros(len(items))
+                seen = items < self.train.n_items
+                degree[seen] = self.train.item_degree[items[seen]]
+                self._samplers[split] = popularity_table(degree, self.neg_alpha)
+            elif split == 'user_table':
+                users, _ = self._sampler('train')
+                self._samplers[split] = popularity_table(self.train.user_degree[users], self.user_alpha)
+            elif split == 'train':
+                self._samplers[split] = (np.asarray(self.users, dtype=np.int32),
+                                         PairIndex(self.train.indptr, self.train.indices, self.train.n_items))
             else:
-                pos_items.append(rd.choice(self.train_user_list[user]))
-            while True:
-                neg_item = rd.choice(self.items)
-                if neg_item not in self.train_user_list[user]:
-                    neg_items.append(neg_item)
-                    break
-
-        for i in range(len(users)):
-            if pos_items[i] >= self.n_items:
-                neg_items[i] += self.n_items
-
+                held_out = self.valid if split == 'valid' else self.test
+                users = self.valid_users if split == 'valid' else sorted(self.test_users)
+                n_items = max(self.train.n_items, held_out.n_items)
+                self._samplers[split] = (np.asarray(users, dtype=np.int32),
+                                         PairIndex.union([(self.train.indptr, self.train.indices),
+                                                          (held_out.indptr, held_out.indices)], n_items))
+        return self._samplers[split]
+
+    def _sample_split(self, split, matrix, rng=None):
+        if rng is None:
+            rng = self.rng
+        users, exclude = self._sampler(split)
+        users = draw_users(rng, users, self.batch_size, self._sampler('user_table') if split == 'train' else None)
+        pos_items = draw_positives(rng, matrix.indptr, matrix.indices, users)
+        if split == 'train' and self.pool_size:
+            if self.neg_pools is None:
+                self.negative_pool(rng)
+            return users, pos_items, self._negatives(rng, users)
+        neg_items = draw_negatives(rng, exclude, users, self._sampler('items'), self._sampler('item_table'),
+                                   self.n_negs)
         return users, pos_items, neg_items
 
-    def sample2(self):
-        if self.batch_size <= len(self.valid_users):
-            users = rd.sample(self.valid_users, self.batch_size)
-        else:
-            users = [rd.choice(self.valid_users) for _ in range(self.batch_size)]
+    def negative_pool(self, rng=None):
+        if rng is None:
+            rng = self.rng
+        _, exclude = self._sampler('train')
+        self.neg_pools = negative_pool(rng, exclude, self.n_users, self._sampler('items'), self.pool_size,
+                                       self._sampler('item_table'))
+
+    def use_hard_negatives(self, n_hard, every, embeddings):
+        # training negatives become the n_hard best-scored entries of every user's pool, re-scored with
+        # embeddings() -> (user_emb, item_emb) every `every` batches
+        if self.prefetcher is not None:
+            raise ValueError('hard negatives are scored in the training process; use --sample_workers 0.')
+        if not self.pool_size:
+            self.pool_size = 100
+        self.hard_negatives = HardNegatives(min(n_hard, self.pool_size), every, embeddings)
+
+    def _negatives(self, rng, users):
+        if self.hard_negatives is not None:
+            if self.hard_negatives.pool is not self.neg_pools:
+                self.hard_negatives.set_pool(self.neg_pools)
+            return self.hard_negatives.draw(rng, users, self.n_negs)
+        return pool_negatives(rng, self.neg_pools, users, self.n_negs)
+
+    def sample(self, rng=None):
+        users, pos_items, neg_items = self._sample_split('train', self.train, rng)
+
+        neg_items[pos_items >= self.n_items] += self.n_items
 
-        pos_items, neg_items = [], []
+        return users, pos_items, neg_items
 
-        for user in users:
-            if self.valid_user_list[user] == []:
-                pos_items.append(0)
+    def n_batches(self):
+        if self.sampler == 'epoch':
+            return n_epoch_batches(self.train.nnz, self.batch_size)
+        return self.n_train // self.batch_size + 1
+
+    def _epoch(self, rng):
+        _, exclude = self._sampler('train')
+        for users, pos_items, neg_items in epoch_batches(rng, self.train.indptr, self.train.indices, exclude,
+                                                         self._sampler('items'), self.batch_size,
+                                                         self._sampler('item_table'), self.n_negs,
+                                                         self._negatives if self.pool_size else None):
+            neg_items[pos_items >= self.n_items] += self.n_items
+            yield users, pos_items, neg_items
+
+    def train_batches(self):
+        # one epoch of (users, pos_items, neg_items); 'uniform' re-samples users for every batch as sample() does
+        if self.prefetcher is not None:
+            return islice(self.prefetcher, self.n_batches())
+        if self.pool_size:
+            self.negative_pool()
+        if self.sampler != 'epoch':
+            return (self.sample() for _ in range(self.n_batches()))
+        return self._epoch(self.rng)
+
+    def batch_stream(self, rng):
+        # endless training batches drawn with rng, for the prefetching workers
+        while True:
+            if self.pool_size:
+                self.negative_pool(rng)
+            if self.sampler == 'epoch':
+                for batch in self._epoch(rng):
+                    yield batch
             else:
-                pos_items.append(rd.choice(self.valid_user_list[user]))
-            while True:
-                neg_item = rd.choice(self.items)
-                if neg_item not in (self.valid_user_list[user]+self.train_user_list[user]):
-                    neg_items.append(neg_item)
-                    break
+                for _ in range(self.n_batches()):
+                    yield self.sample(rng)
+
+    def stream(self):
+        # endless training batches for the tf.data pipeline: the prefetching workers' when they run
+        if self.prefetcher is not None:
+            return iter(self.prefetcher)
+        # the generator runs on a TF thread next to sample2 / sample_test on the main one: it gets its own
+        # RandomState, and the samplers it reads are built here rather than lazily on either thread
+        for split in ('train', 'items', 'item_table', 'user_table'):
+            self._sampler(split)
+        return self.batch_stream(np.random.RandomState(self.rng.randint(2 ** 31 - 1)))
+
+    def start_prefetch(self, n_workers, depth=4, seed=None):
+        # the sampling index and alias tables are built before forking so the workers share their pages
+        for split in ('train', 'items', 'item_table', 'user_table'):
+            self._sampler(split)
+        shapes = [(self.batch_size,)] * 2 + [(self.batch_size, self.n_negs) if self.n_negs > 1 else (self.batch_size,)]
+        self.prefetcher = Prefetcher(self.batch_stream, shapes, n_workers, depth, seed)
+
+    def stop_prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
 
-        return users, pos_items, neg_items
+    def sample2(self):
+        return self._sample_split('valid', self.valid)
 
     def sample_test(self):
-        if self.batch_size <= len(self.test_users):
-            users = rd.sample(self.test_users, self.batch_size)
-        else:
-            users = [rd.choice(self.test_users) for _ in range(self.batch_size)]
-
-        pos_items, neg_items = [], []
-
-        for user in users:
-            if self.test_user_list[user] == []:
-                pos_items.append(0)
-            else:
-                pos_items.append(rd.choice(self.test_user_list[user]))
-            while True:
-                neg_item = rd.choice(self.items)
-                if neg_item not in (self.test_user_list[user]+self.train_user_list[user]):
-                    neg_items.append(neg_item)
-                    break
-
-        return users, pos_items, neg_items
-        
\ No newline at end of file
+        return self._sample_split('test', self.test)
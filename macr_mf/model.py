@@ -9,24 +9,79 @@ import scipy.sparse as sp
 import heapq
 import math
 import time
+from pipeline import input_placeholder
+
+
+def pair_scores(users, items):
+    # user . item per row: [B] for [B, d] items, [B, n] for [B, n, d] items (one batched matmul)
+    if items.shape.ndims == 3:
+        return tf.squeeze(tf.matmul(items, tf.expand_dims(users, -1)), -1)
+    return tf.reduce_sum(tf.multiply(users, items), axis=1)
+
+
+def branch_scores(items, w):
+    # item-branch scores: [B, 1] for [B, d] items, [B, n] for [B, n, d] items
+    if items.shape.ndims == 3:
+        return tf.squeeze(tf.tensordot(items, w, axes=1), -1)
+    return tf.matmul(items, w)
+
+
+def const_scores(const_embedding, items):
+    # constant-user scores: [1, B] for [B, d] items, [B, n] for [B, n, d] items
+    if items.shape.ndims == 3:
+        return branch_scores(items, tf.transpose(const_embedding))
+    return tf.matmul(const_embedding, items, transpose_a=False, transpose_b = True)
+
+
+def new_optimizer(name, lr):
+    # adam updates the moments of every embedding row each step; lazyadam / adagrad apply the
+    # sparse gradients of the embedding lookups to the batch rows (and their slot rows) only
+    if name == 'adam':
+        return tf.train.AdamOptimizer(learning_rate=lr)
+    elif name == 'lazyadam':
+        return tf.contrib.opt.LazyAdamOptimizer(learning_rate=lr)
+    elif name == 'adagrad':
+        return tf.train.AdagradOptimizer(learning_rate=lr)
+    raise ValueError('unknown --optimizer %s' % name)
+
+
+# two-branch losses that fuse a ranking score with a branch score; under the published 'outer' fusion a
+# [B] score times a [B, 1] sigmoid broadcasts to [B, B], 'row' keeps one fused term per row
+FUSED_LOSSES = ('rubi', 'rubibce', 'rubibceboth', 'userc')
+
+
+def model_losses(args, losses):
+    # (loss, with optimizer) pairs to build: args.train's, plus the rubi_c rating head when args.test reads it
+    if args.all_losses:
+        return [(name, True) for name in losses]
+    built = [(args.train, True)]
+    if args.test == 'rubi' and args.train not in ('rubi', 'rubibceboth'):
+        built.append(('rubi', False))
+    if args.n_negs > 1 and args.fusion != 'row' and any(name in FUSED_LOSSES for name, _ in built):
+        raise ValueError('--n_negs > 1 scores the two-branch losses row by row; pass --fusion row '
+                         '(and use it for the n_negs 1 baseline too).')
+    return built
+
 
 class BPRMF:
-    def __init__(self, args, data_config):
+    def __init__(self, args, data_config, inputs=None):
         self.n_users = data_config['n_users']
         self.n_items = data_config['n_items']
 
         self.decay = args.regs
         self.emb_dim = args.embed_size
         self.lr = args.lr
+        self.optimizer = args.optimizer
         self.batch_size = args.batch_size
         self.verbose = args.verbose
         self.c = args.c
         self.alpha = args.alpha
+        self.n_negs = args.n_negs
         self.beta = args.beta
-        #placeholders
-        self.users = tf.placeholder(tf.int32, shape = (None,))
-        self.pos_items = tf.placeholder(tf.int32, shape = (None,))
-        self.neg_items = tf.placeholder(tf.int32, shape = (None,))
+        #placeholders; with an input pipeline (inputs) they default to its next batch
+        self.users = input_placeholder(inputs, 0, (None,))
+        self.pos_items = input_placeholder(inputs, 1, (None,))
+        self.neg_items = input_placeholder(inputs, 2, (None,) if self.n_negs == 1 else (None, self.n_negs))
 
         #initiative weights
         self.weights = self.init_weights()
@@ -37,6 +92,12 @@ class BPRMF:
         neg_item_embedding = tf.nn.embedding_lookup(self.weights['item_embedding'], self.neg_items)
         user_rand_embedding = tf.nn.embedding_lookup(self.weights['user_rand_embedding'], self.users)
         item_rand_embedding = tf.nn.embedding_lookup(self.weights['item_rand_embedding'], self.pos_items)
+        # the losses see [B, 1, d] positives and [B, K, d] negatives under 'row' fusion (every negative of a row
+        # against its one user / positive lookup), the published [B, d] ones under 'outer' (n_negs == 1 only)
+        self.fusion = args.fusion
+        rows = self.fusion == 'row' or self.n_negs > 1
+        pos_item_column = tf.expand_dims(pos_item_embedding, 1) if rows else pos_item_embedding
+        neg_item_column = tf.expand_dims(neg_item_embedding, 1) if rows and self.n_negs == 1 else neg_item_embedding
         
 
         self.const_embedding = self.weights['c']
@@ -49,60 +110,77 @@ class BPRMF:
         self.item_rand_ratings = self.batch_ratings - tf.matmul(user_embedding, item_rand_embedding, transpose_a=False, transpose_b = True)
 
 
-        self.mf_loss, self.reg_loss = self.create_bpr_loss(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss = self.mf_loss + self.reg_loss
-
-        # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
-        trainable_v1 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'parameter')
-        self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss, var_list = trainable_v1)
         # two branch
         self.w = tf.Variable(self.initializer([self.emb_dim,1]), name = 'item_branch')
         self.w_user = tf.Variable(self.initializer([self.emb_dim,1]), name = 'user_branch')
         self.sigmoid_yu = tf.squeeze(tf.nn.sigmoid(tf.matmul(self.weights['user_embedding'], self.w_user)))
         self.sigmoid_yi = tf.squeeze(tf.nn.sigmoid(tf.matmul(self.weights['item_embedding'], self.w)))
-        # two branch bpr
-        self.mf_loss_two, self.reg_loss_two = self.create_bpr_loss_two_brach(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_two = self.mf_loss_two + self.reg_loss_two
-        self.opt_two = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two)
-        # two branch bce
-        self.mf_loss_two_bce, self.reg_loss_two_bce = self.create_bce_loss_two_brach(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_two_bce = self.mf_loss_two_bce + self.reg_loss_two_bce
-        self.opt_two_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce)
-        # two branch bce user&item
-        self.mf_loss_two_bce_both, self.reg_loss_two_bce_both = self.create_bce_loss_two_brach_both(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_two_bce_both = self.mf_loss_two_bce_both + self.reg_loss_two_bce_both
-        self.opt_two_bce_both = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce_both)
-        # 2-stage training
-        self.mf_loss2, self.reg_loss2 = self.create_bpr_loss2(user_embedding, self.const_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss2 = self.mf_loss2 + self.reg_loss2
-        trainable_v2 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'const_embedding')
-        self.opt2 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2, var_list = trainable_v2)
-
-
-        self.mf_loss2_bce, self.reg_loss2_bce = self.create_bce_loss2(user_embedding, self.const_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss2_bce = self.mf_loss2_bce + self.reg_loss2_bce
-        self.opt2_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2_bce, var_list = trainable_v2)
-        # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
-        
-        
-        self.opt3 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
-        self.opt3_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2_bce, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
-
-        self._statistics_params()
-
-        self.mf_loss_bce, self.reg_loss_bce = self.create_bce_loss(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_bce = self.mf_loss_bce + self.reg_loss_bce
-        self.opt_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_bce)
-
-
-        # user wise two branch mf
-        self.mf_loss_userc_bce, self.reg_loss_userc_bce = self.create_bce_loss_userc(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_userc_bce = self.mf_loss_userc_bce + self.reg_loss_userc_bce
-        self.opt_userc_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_userc_bce, var_list = [self.weights['user_c']])
-        # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
 
+        # only the selected losses are built; every optimizer holds two Adam slots per variable it trains
+        self.loss_inputs = (user_embedding, pos_item_column, neg_item_column)
+        for name, train in model_losses(args, self.losses):
+            self.build_loss(name, train)
 
+        self._statistics_params()
 
+    losses = ('normal', 'rubi', 'rubibce', 'rubibceboth', 'c', 'cbce', 'normalbce', 'userc')
+
+    def build_loss(self, name, train=True):
+        # loss tensors (and rating heads) of one --train variant; its optimizers only when train
+        user_embedding, pos_item_column, neg_item_embedding = self.loss_inputs
+        if name == 'normal':
+            self.mf_loss, self.reg_loss = self.create_bpr_loss(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss = self.mf_loss + self.reg_loss
+            if train:
+                # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
+                trainable_v1 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'parameter')
+                self.opt = new_optimizer(self.optimizer, self.lr).minimize(self.loss, var_list = trainable_v1)
+        elif name == 'rubi':
+            # two branch bpr
+            self.mf_loss_two, self.reg_loss_two = self.create_bpr_loss_two_brach(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_two = self.mf_loss_two + self.reg_loss_two
+            if train:
+                self.opt_two = new_optimizer(self.optimizer, self.lr).minimize(self.loss_two)
+        elif name == 'rubibce':
+            # two branch bce
+            self.mf_loss_two_bce, self.reg_loss_two_bce = self.create_bce_loss_two_brach(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_two_bce = self.mf_loss_two_bce + self.reg_loss_two_bce
+            if train:
+                self.opt_two_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss_two_bce)
+        elif name == 'rubibceboth':
+            # two branch bce user&item
+            self.mf_loss_two_bce_both, self.reg_loss_two_bce_both = self.create_bce_loss_two_brach_both(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_two_bce_both = self.mf_loss_two_bce_both + self.reg_loss_two_bce_both
+            if train:
+                self.opt_two_bce_both = new_optimizer(self.optimizer, self.lr).minimize(self.loss_two_bce_both)
+        elif name == 'c':
+            # 2-stage training: opt2 fits the constant, opt3 the embeddings
+            self.mf_loss2, self.reg_loss2 = self.create_bpr_loss2(user_embedding, self.const_embedding, pos_item_column, neg_item_embedding)
+            self.loss2 = self.mf_loss2 + self.reg_loss2
+            if train:
+                trainable_v2 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'const_embedding')
+                self.opt2 = new_optimizer(self.optimizer, self.lr).minimize(self.loss2, var_list = trainable_v2)
+                self.opt3 = new_optimizer(self.optimizer, self.lr).minimize(self.loss2, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
+        elif name == 'cbce':
+            self.mf_loss2_bce, self.reg_loss2_bce = self.create_bce_loss2(user_embedding, self.const_embedding, pos_item_column, neg_item_embedding)
+            self.loss2_bce = self.mf_loss2_bce + self.reg_loss2_bce
+            if train:
+                trainable_v2 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'const_embedding')
+                self.opt2_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss2_bce, var_list = trainable_v2)
+                self.opt3_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss2_bce, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
+        elif name == 'normalbce':
+            self.mf_loss_bce, self.reg_loss_bce = self.create_bce_loss(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_bce = self.mf_loss_bce + self.reg_loss_bce
+            if train:
+                self.opt_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss_bce)
+        elif name == 'userc':
+            # user wise two branch mf
+            self.mf_loss_userc_bce, self.reg_loss_userc_bce = self.create_bce_loss_userc(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_userc_bce = self.mf_loss_userc_bce + self.reg_loss_userc_bce
+            if train:
+                self.opt_userc_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss_userc_bce, var_list = [self.weights['user_c']])
+        else:
+            raise ValueError('unknown --train %s for %s' % (name, type(self).__name__))
 
     def init_weights(self):
         weights = dict()
@@ -122,8 +200,8 @@ class BPRMF:
         return weights
 
     def create_bpr_loss_two_brach(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item stop
 
 
@@ -132,8 +210,8 @@ class BPRMF:
         pos_items_stop = pos_items
         neg_items_stop = neg_items
 
-        self.pos_item_scores = tf.matmul(pos_items_stop,self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop,self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         # first branch
         pos_scores = pos_scores*tf.nn.sigmoid(self.pos_item_scores)
         neg_scores = neg_scores*tf.nn.sigmoid(self.neg_item_scores)
@@ -148,7 +226,7 @@ class BPRMF:
         # unify
         mf_loss = self.mf_loss_ori_bce + self.alpha*self.mf_loss_item_bce
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
 
         
@@ -156,15 +234,15 @@ class BPRMF:
         return mf_loss, reg_loss
 
     def create_bce_loss_two_brach(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item score
         # pos_items_stop = tf.stop_gradient(pos_items)
         # neg_items_stop = tf.stop_gradient(neg_items)
         pos_items_stop = pos_items
         neg_items_stop = neg_items
-        self.pos_item_scores = tf.matmul(pos_items_stop,self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop,self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         # self.rubi_ratings = (self.batch_ratings-self.rubi_c)*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # self.direct_minus_ratings = self.batch_ratings-self.rubi_c*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # first branch
@@ -177,22 +255,22 @@ class BPRMF:
         # unify
         mf_loss = self.mf_loss_ori + self.alpha*self.mf_loss_item
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
         reg_loss = self.decay * regularizer
         return mf_loss, reg_loss
 
     def create_bce_loss_two_brach_both(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item score
         # pos_items_stop = tf.stop_gradient(pos_items)
         # neg_items_stop = tf.stop_gradient(neg_items)
         pos_items_stop = pos_items
         neg_items_stop = neg_items
         users_stop = users
-        self.pos_item_scores = tf.matmul(pos_items_stop,self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop,self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         self.user_scores = tf.matmul(users_stop, self.w_user)
         # self.rubi_ratings_both = (self.batch_ratings-self.rubi_c)*(tf.transpose(tf.nn.sigmoid(self.pos_item_scores))+tf.nn.sigmoid(self.user_scores))
         # self.direct_minus_ratings_both = self.batch_ratings-self.rubi_c*(tf.transpose(tf.nn.sigmoid(self.pos_item_scores))+tf.nn.sigmoid(self.user_scores))
@@ -216,21 +294,21 @@ class BPRMF:
         # unify
         mf_loss = self.mf_loss_ori + self.alpha*self.mf_loss_item + self.beta*self.mf_loss_user
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
         reg_loss = self.decay * regularizer
         return mf_loss, reg_loss
     
     def create_bce_loss_userc(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # item score
         # pos_items_stop = tf.stop_gradient(pos_items)
         # neg_items_stop = tf.stop_gradient(neg_items)
         pos_items_stop = pos_items
         neg_items_stop = neg_items
-        self.pos_item_scores = tf.matmul(pos_items_stop,self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop,self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         self.rubi_ratings_userc = (self.batch_ratings-self.user_c)*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         self.direct_minus_ratings_userc = self.batch_ratings-self.user_c*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # first branch
@@ -243,7 +321,7 @@ class BPRMF:
         # unify
         mf_loss = self.mf_loss_ori #+ self.alpha*self.mf_loss_item
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
         reg_loss = self.decay * regularizer
         return mf_loss, reg_loss
@@ -262,10 +340,10 @@ class BPRMF:
         # return mf_loss, reg_loss
 
     def create_bpr_loss(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
 
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
 
         maxi = tf.log(tf.nn.sigmoid(pos_scores - neg_scores))
@@ -275,20 +353,20 @@ class BPRMF:
         return mf_loss, reg_loss
 
     def create_bce_loss(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1)
+        pos_scores = pair_scores(users, pos_items)   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items)
         # first branch
         # fusion
         mf_loss = tf.reduce_mean(tf.negative(tf.log(tf.nn.sigmoid(pos_scores)+1e-9))+tf.negative(tf.log(1-tf.nn.sigmoid(neg_scores)+1e-9)))
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
         reg_loss = self.decay * regularizer
         return mf_loss, reg_loss
 
     def create_bpr_loss2(self, users, const_embedding, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) - tf.matmul(const_embedding, pos_items, transpose_a=False, transpose_b = True)
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) - tf.matmul(const_embedding, neg_items, transpose_a=False, transpose_b = True)
+        pos_scores = pair_scores(users, pos_items) - const_scores(const_embedding, pos_items)
+        neg_scores = pair_scores(users, neg_items) - const_scores(const_embedding, neg_items)
 
         regularizer = tf.nn.l2_loss(const_embedding)
         regularizer = regularizer/self.batch_size
@@ -300,8 +378,8 @@ class BPRMF:
         return mf_loss, reg_loss
     
     def create_bce_loss2(self, users, const_embedding, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) - tf.matmul(const_embedding, pos_items, transpose_a=False, transpose_b = True)
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) - tf.matmul(const_embedding, neg_items, transpose_a=False, transpose_b = True)
+        pos_scores = pair_scores(users, pos_items) - const_scores(const_embedding, pos_items)
+        neg_scores = pair_scores(users, neg_items) - const_scores(const_embedding, neg_items)
 
         regularizer = tf.nn.l2_loss(const_embedding)
         regularizer = regularizer/self.batch_size
@@ -327,21 +405,23 @@ class BPRMF:
 
 
 class BIASMF:
-    def __init__(self, args, data_config):
+    def __init__(self, args, data_config, inputs=None):
         self.n_users = data_config['n_users']
         self.n_items = data_config['n_items']
 
         self.decay = args.regs
         self.emb_dim = args.embed_size
         self.lr = args.lr
+        self.optimizer = args.optimizer
         self.batch_size = args.batch_size
         self.verbose = args.verbose
         self.c = args.c
         self.alpha = args.alpha
-        #placeholders
-        self.users = tf.placeholder(tf.int32, shape = (None,))
-        self.pos_items = tf.placeholder(tf.int32, shape = (None,))
-        self.neg_items = tf.placeholder(tf.int32, shape = (None,))
+        self.n_negs = args.n_negs
+        #placeholders; with an input pipeline (inputs) they default to its next batch
+        self.users = input_placeholder(inputs, 0, (None,))
+        self.pos_items = input_placeholder(inputs, 1, (None,))
+        self.neg_items = input_placeholder(inputs, 2, (None,) if self.n_negs == 1 else (None, self.n_negs))
 
         #initiative weights
         self.weights = self.init_weights()
@@ -352,9 +432,19 @@ class BIASMF:
         neg_item_embedding = tf.nn.embedding_lookup(self.weights['item_embedding'], self.neg_items)
         user_rand_embedding = tf.nn.embedding_lookup(self.weights['user_rand_embedding'], self.users)
         item_rand_embedding = tf.nn.embedding_lookup(self.weights['item_rand_embedding'], self.pos_items)
+        # the losses see [B, 1, d] positives and [B, K, d] negatives under 'row' fusion (every negative of a row
+        # against its one user / positive lookup), the published [B, d] ones under 'outer' (n_negs == 1 only)
+        self.fusion = args.fusion
+        rows = self.fusion == 'row' or self.n_negs > 1
+        pos_item_column = tf.expand_dims(pos_item_embedding, 1) if rows else pos_item_embedding
+        neg_item_column = tf.expand_dims(neg_item_embedding, 1) if rows and self.n_negs == 1 else neg_item_embedding
         self.const_embedding = self.weights['c']
         self.pos_item_bias = tf.nn.embedding_lookup(self.weights['item_bias'], self.pos_items)
         self.neg_item_bias = tf.nn.embedding_lookup(self.weights['item_bias'], self.neg_items)
+        if rows:
+            self.pos_item_bias = tf.expand_dims(self.pos_item_bias, 1)
+        if rows and self.n_negs == 1:
+            self.neg_item_bias = tf.expand_dims(self.neg_item_bias, 1)
 
         self.batch_ratings = tf.matmul(user_embedding, pos_item_embedding, transpose_a=False, transpose_b = True)    #prediction, shape(user_embedding) != shape(pos_item_embedding)
         self.user_const_ratings = self.batch_ratings - tf.matmul(self.const_embedding, pos_item_embedding, transpose_a=False, transpose_b = True)   #auto tile
@@ -363,45 +453,62 @@ class BIASMF:
         self.item_rand_ratings = self.batch_ratings - tf.matmul(user_embedding, item_rand_embedding, transpose_a=False, transpose_b = True)
 
 
-        self.mf_loss, self.reg_loss = self.create_bpr_loss(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss = self.mf_loss + self.reg_loss
-
-        # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
-        trainable_v1 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'parameter')
-        self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss, var_list = trainable_v1)
         # two branch
         self.w = tf.Variable(self.initializer([self.emb_dim,1]), name = 'item_branch')
-        # two branch bpr
-        self.mf_loss_two, self.reg_loss_two = self.create_bpr_loss_two_brach(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_two = self.mf_loss_two + self.reg_loss_two
-        self.opt_two = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two)
-        # two branch bce
-        self.mf_loss_two_bce, self.reg_loss_two_bce = self.create_bce_loss_two_brach(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_two_bce = self.mf_loss_two_bce + self.reg_loss_two_bce
-        self.opt_two_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_two_bce)
-        # 2-stage training
-        self.mf_loss2, self.reg_loss2 = self.create_bpr_loss2(user_embedding, self.const_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss2 = self.mf_loss2 + self.reg_loss2
-        trainable_v2 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'const_embedding')
-        self.opt2 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2, var_list = trainable_v2)
-
-
-        self.mf_loss2_bce, self.reg_loss2_bce = self.create_bce_loss2(user_embedding, self.const_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss2_bce = self.mf_loss2_bce + self.reg_loss2_bce
-        self.opt2_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2_bce, var_list = trainable_v2)
-        # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
-        
-        
-        self.opt3 = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
-        self.opt3_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss2_bce, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
-
-        self._statistics_params()
 
-        self.mf_loss_bce, self.reg_loss_bce = self.create_bce_loss(user_embedding, pos_item_embedding, neg_item_embedding)
-        self.loss_bce = self.mf_loss_bce + self.reg_loss_bce
-        self.opt_bce = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss_bce)
+        # only the selected losses are built; every optimizer holds two Adam slots per variable it trains
+        self.loss_inputs = (user_embedding, pos_item_column, neg_item_column)
+        for name, train in model_losses(args, self.losses):
+            self.build_loss(name, train)
 
+        self._statistics_params()
 
+    losses = ('normal', 'rubi', 'rubibce', 'c', 'cbce', 'normalbce')
+
+    def build_loss(self, name, train=True):
+        # loss tensors (and rating heads) of one --train variant; its optimizers only when train
+        user_embedding, pos_item_column, neg_item_embedding = self.loss_inputs
+        if name == 'normal':
+            self.mf_loss, self.reg_loss = self.create_bpr_loss(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss = self.mf_loss + self.reg_loss
+            if train:
+                # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
+                trainable_v1 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'parameter')
+                self.opt = new_optimizer(self.optimizer, self.lr).minimize(self.loss, var_list = trainable_v1)
+        elif name == 'rubi':
+            # two branch bpr
+            self.mf_loss_two, self.reg_loss_two = self.create_bpr_loss_two_brach(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_two = self.mf_loss_two + self.reg_loss_two
+            if train:
+                self.opt_two = new_optimizer(self.optimizer, self.lr).minimize(self.loss_two)
+        elif name == 'rubibce':
+            # two branch bce
+            self.mf_loss_two_bce, self.reg_loss_two_bce = self.create_bce_loss_two_brach(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_two_bce = self.mf_loss_two_bce + self.reg_loss_two_bce
+            if train:
+                self.opt_two_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss_two_bce)
+        elif name == 'c':
+            # 2-stage training: opt2 fits the constant, opt3 the embeddings
+            self.mf_loss2, self.reg_loss2 = self.create_bpr_loss2(user_embedding, self.const_embedding, pos_item_column, neg_item_embedding)
+            self.loss2 = self.mf_loss2 + self.reg_loss2
+            if train:
+                trainable_v2 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'const_embedding')
+                self.opt2 = new_optimizer(self.optimizer, self.lr).minimize(self.loss2, var_list = trainable_v2)
+                self.opt3 = new_optimizer(self.optimizer, self.lr).minimize(self.loss2, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
+        elif name == 'cbce':
+            self.mf_loss2_bce, self.reg_loss2_bce = self.create_bce_loss2(user_embedding, self.const_embedding, pos_item_column, neg_item_embedding)
+            self.loss2_bce = self.mf_loss2_bce + self.reg_loss2_bce
+            if train:
+                trainable_v2 = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, 'const_embedding')
+                self.opt2_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss2_bce, var_list = trainable_v2)
+                self.opt3_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss2_bce, var_list = [self.weights['user_embedding'],self.weights['item_embedding']])
+        elif name == 'normalbce':
+            self.mf_loss_bce, self.reg_loss_bce = self.create_bce_loss(user_embedding, pos_item_column, neg_item_embedding)
+            self.loss_bce = self.mf_loss_bce + self.reg_loss_bce
+            if train:
+                self.opt_bce = new_optimizer(self.optimizer, self.lr).minimize(self.loss_bce)
+        else:
+            raise ValueError('unknown --train %s for %s' % (name, type(self).__name__))
 
     def init_weights(self):
         weights = dict()
@@ -419,8 +526,8 @@ class BIASMF:
         return weights
 
     def create_bpr_loss_two_brach(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) + self.neg_item_bias
+        pos_scores = pair_scores(users, pos_items) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items) + self.neg_item_bias
         # item stop
 
 
@@ -429,8 +536,8 @@ class BIASMF:
         pos_items_stop = pos_items
         neg_items_stop = neg_items
 
-        self.pos_item_scores = tf.matmul(pos_items_stop,self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop,self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         # first branch
         pos_scores = pos_scores*tf.nn.sigmoid(self.pos_item_scores)
         neg_scores = neg_scores*tf.nn.sigmoid(self.neg_item_scores)
@@ -445,7 +552,7 @@ class BIASMF:
         # unify
         mf_loss = self.mf_loss_ori_bce + self.alpha*self.mf_loss_item_bce
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
 
         
@@ -453,15 +560,15 @@ class BIASMF:
         return mf_loss, reg_loss
 
     def create_bce_loss_two_brach(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) + self.neg_item_bias
+        pos_scores = pair_scores(users, pos_items) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items) + self.neg_item_bias
         # item score
         # pos_items_stop = tf.stop_gradient(pos_items)
         # neg_items_stop = tf.stop_gradient(neg_items)
         pos_items_stop = pos_items
         neg_items_stop = neg_items
-        self.pos_item_scores = tf.matmul(pos_items_stop,self.w)
-        self.neg_item_scores = tf.matmul(neg_items_stop,self.w)
+        self.pos_item_scores = branch_scores(pos_items_stop, self.w)
+        self.neg_item_scores = branch_scores(neg_items_stop, self.w)
         # self.rubi_ratings = (self.batch_ratings-self.rubi_c)*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # self.direct_minus_ratings = self.batch_ratings-self.rubi_c*tf.squeeze(tf.nn.sigmoid(self.pos_item_scores))
         # first branch
@@ -474,16 +581,16 @@ class BIASMF:
         # unify
         mf_loss = self.mf_loss_ori + self.alpha*self.mf_loss_item
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
         reg_loss = self.decay * regularizer
         return mf_loss, reg_loss
 
     def create_bpr_loss(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) + self.neg_item_bias
+        pos_scores = pair_scores(users, pos_items) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items) + self.neg_item_bias
 
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
 
         maxi = tf.log(tf.nn.sigmoid(pos_scores - neg_scores))
@@ -493,20 +600,20 @@ class BIASMF:
         return mf_loss, reg_loss
 
     def create_bce_loss(self, users, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) + self.neg_item_bias
+        pos_scores = pair_scores(users, pos_items) + self.pos_item_bias   #users, pos_items, neg_items have the same shape
+        neg_scores = pair_scores(users, neg_items) + self.neg_item_bias
         # first branch
         # fusion
         mf_loss = tf.reduce_mean(tf.negative(tf.log(tf.nn.sigmoid(pos_scores)+1e-9))+tf.negative(tf.log(1-tf.nn.sigmoid(neg_scores)+1e-9)))
         # regular
-        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)
+        regularizer = tf.nn.l2_loss(users) + tf.nn.l2_loss(pos_items) + tf.nn.l2_loss(neg_items)/self.n_negs
         regularizer = regularizer/self.batch_size
         reg_loss = self.decay * regularizer
         return mf_loss, reg_loss
 
     def create_bpr_loss2(self, users, const_embedding, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) - tf.matmul(const_embedding, pos_items, transpose_a=False, transpose_b = True) + self.pos_item_bias
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) - tf.matmul(const_embedding, neg_items, transpose_a=False, transpose_b = True) + self.neg_item_bias
+        pos_scores = pair_scores(users, pos_items) - const_scores(const_embedding, pos_items) + self.pos_item_bias
+        neg_scores = pair_scores(users, neg_items) - const_scores(const_embedding, neg_items) + self.neg_item_bias
 
         regularizer = tf.nn.l2_loss(const_embedding)
         regularizer = regularizer/self.batch_size
@@ -518,8 +625,8 @@ class BIASMF:
         return mf_loss, reg_loss
     
     def create_bce_loss2(self, users, const_embedding, pos_items, neg_items):
-        pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1) - tf.matmul(const_embedding, pos_items, transpose_a=False, transpose_b = True) + self.pos_item_bias
-        neg_scores = tf.reduce_sum(tf.multiply(users, neg_items), axis=1) - tf.matmul(const_embedding, neg_items, transpose_a=False, transpose_b = True) + self.neg_item_bias
+        pos_scores = pair_scores(users, pos_items) - const_scores(const_embedding, pos_items) + self.pos_item_bias
+        neg_scores = pair_scores(users, neg_items) - const_scores(const_embedding, neg_items) + self.neg_item_bias
 
         regularizer = tf.nn.l2_loss(const_embedding)
         regularizer = regularizer/self.batch_size
@@ -545,22 +652,23 @@ class BIASMF:
 
 
 class IPS_BPRMF:
-    def __init__(self, args, data_config, p_matrix):
+    def __init__(self, args, data_config, p_matrix, inputs=None):
         self.n_users = data_config['n_users']
         self.n_items = data_config['n_items']
 
         self.decay = args.regs
         self.emb_dim = args.embed_size
         self.lr = args.lr
+        self.optimizer = args.optimizer
         self.batch_size = args.batch_size
         self.verbose = args.verbose
         self.c = args.c
         # self.p = p_matrix
 
-        #placeholders
-        self.users = tf.placeholder(tf.int32, shape = (None,))
-        self.pos_items = tf.placeholder(tf.int32, shape = (None,))
-        self.neg_items = tf.placeholder(tf.int32, shape = (None,))
+        #placeholders; with an input pipeline (inputs) they default to its next batch
+        self.users = input_placeholder(inputs, 0, (None,))
+        self.pos_items = input_placeholder(inputs, 1, (None,))
+        self.neg_items = input_placeholder(inputs, 2, (None,))
 
         #initiative weights
         self.weights = self.init_weights()
@@ -588,7 +696,7 @@ class IPS_BPRMF:
         self.loss = self.mf_loss + self.reg_loss
 
         # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
-        self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss)
+        self.opt = new_optimizer(self.optimizer, self.lr).minimize(self.loss)
         self._statistics_params()
 
 
@@ -645,6 +753,7 @@ class CausalE:
         self.decay = args.regs
         self.emb_dim = args.embed_size
         self.lr = args.lr
+        self.optimizer = args.optimizer
         self.batch_size = args.batch_size
         self.verbose = args.verbose
         self.cf_pen = args.cf_pen
@@ -673,7 +782,7 @@ class CausalE:
         self.loss = self.mf_loss + self.reg_loss + self.cf_loss
 
         # self.opt = tf.train.RMSPropOptimizer(learning_rate = self.lr).minimize(self.loss)
-        self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss)
+        self.opt = new_optimizer(self.optimizer, self.lr).minimize(self.loss)
         self._statistics_params()
 
 
@@ -89,4 +89,38 @@ def parse_args():
     parser.add_argument('--step', type=int, default=20,
                         help='check c step.')      
     parser.add_argument('--out', type=int, default=0)                      
+    parser.add_argument('--split_cache', type=int, default=1,
+                        help='0: always parse the text splits, 1: cache them as binary CSR arrays.')
+    parser.add_argument('--load_workers', type=int, default=0,
+                        help='Processes used to parse the text splits (0: one per core).')
+    parser.add_argument('--stream_mem', type=int, default=0,
+                        help='Memory cap in MB for out-of-core ingestion of the splits (0: load them in memory).')
+    parser.add_argument('--remap', type=int, default=0,
+                        help='1: compact user / item ids to the ones that occur in the splits.')
+    parser.add_argument('--sampler', nargs='?', default='uniform',
+                        help='Training batches: epoch (every interaction once per epoch), uniform (users re-sampled per batch).')
+    parser.add_argument('--n_negs', type=int, default=1,
+                        help='Negatives per positive; > 1 feeds [batch, n_negs] negatives to the mf / biasmf losses.')
+    parser.add_argument('--fusion', nargs='?', default='outer',
+                        help='Two-branch (rubi*) losses: outer (published [B, B] broadcast, n_negs 1 only), row (one fused term per row; needed for n_negs > 1).')
+    parser.add_argument('--neg_pool', type=int, default=0,
+                        help='Train negatives pre-drawn per user and redrawn every epoch (0: drawn per batch).')
+    parser.add_argument('--hard_neg', type=int, default=0,
+                        help='mf / biasmf: train on the hard_neg best-scored candidates of every user\'s negative pool (0: off).')
+    parser.add_argument('--hard_every', type=int, default=100,
+                        help='Batches between re-scorings of the hard negative candidates.')
+    parser.add_argument('--neg_alpha', type=float, default=0.,
+                        help='Negatives drawn in proportion to train item degree ** neg_alpha (0: uniform).')
+    parser.add_argument('--user_alpha', type=float, default=0.,
+                        help='uniform sampler: users drawn in proportion to train degree ** user_alpha (0: distinct uniform users).')
+    parser.add_argument('--optimizer', nargs='?', default='adam',
+                        help='adam | lazyadam | adagrad; lazyadam and adagrad update only the embedding rows (and slots) of the batch.')
+    parser.add_argument('--all_losses', type=int, default=0,
+                        help='mf / biasmf: 1 builds every loss variant with its optimizer, 0 only --train\'s (and the rating head --test reads).')
+    parser.add_argument('--input_pipeline', nargs='?', default='feed',
+                        help='Training batches of mf / biasmf / IPSmf: dataset (tf.data iterator, no feed_dict), feed (feed_dict per step).')
+    parser.add_argument('--sample_workers', type=int, default=0,
+                        help='Processes prefetching training batches (0: sample in the training process).')
+    parser.add_argument('--prefetch_depth', type=int, default=4,
+                        help='Batches in flight between the sampling processes and the training loop.')
     return parser.parse_args()
@@ -0,0 +1,26 @@
+'''
+tf.data input pipeline over the numpy batch samplers.
+
+The training batches are pulled from an endless numpy batch iterator by
+tf.data and buffered ahead of the training step, so a step runs without a
+feed_dict. The batch tensors are the defaults of the models' input
+placeholders: feeding the placeholders (evaluation, test losses) bypasses
+the pipeline.
+'''
+import tensorflow as tf
+
+
+def batch_iterator(batches, n_negs=1, depth=4):
+    '''(users, pos_items, neg_items) int32 tensors of the next batch of the endless iterator batches.'''
+    neg_shape = [None] if n_negs == 1 else [None, n_negs]
+    dataset = tf.data.Dataset.from_generator(lambda: batches, (tf.int32, tf.int32, tf.int32),
+                                             (tf.TensorShape([None]), tf.TensorShape([None]),
+                                              tf.TensorShape(neg_shape)))
+    return dataset.prefetch(depth).make_one_shot_iterator().get_next()
+
+
+def input_placeholder(inputs, k, shape):
+    '''An int32 placeholder of the given shape, defaulting to inputs[k] when there is an input pipeline.'''
+    if inputs is None:
+        return tf.placeholder(tf.int32, shape=shape)
+    return tf.placeholder_with_default(inputs[k], shape=shape)
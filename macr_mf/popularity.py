@@ -0,0 +1,88 @@
+'''
+Popularity statistics over InteractionMatrix splits.
+
+Degrees come from bincount, the top-1% / 5% / 10% items from argpartition
+and head membership from boolean masks over the item ids, so the head
+coverage summary costs O(n_items) instead of O(interactions x top-k).
+'''
+import numpy as np
+
+TOP_RATIOS = (0.01, 0.05, 0.1)
+# degree boundaries of the item / user groups of the --out analysis
+ITEM_POINTS = (10, 50, 100, 200, 500)
+USER_POINTS = (5, 7, 10, 15, 20)
+
+
+def degree(ids, n):
+    return np.bincount(np.asarray(ids), minlength=n).astype(np.int64)
+
+
+def item_degree(matrix, n):
+    '''The matrix's (possibly precomputed) item degrees, padded to n items.'''
+    if len(matrix.item_degree) == n:
+        return np.asarray(matrix.item_degree, dtype=np.int64)
+    return degree(matrix.indices, n)
+
+
+def top_items(item_degree, k):
+    '''ids of the k largest degrees, most popular first (ties by smaller id).'''
+    k = min(int(k), len(item_degree))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-item_degree, k - 1)[:k]
+    return top[np.lexsort((top, -item_degree[top]))]
+
+
+def head_mask(top, n):
+    mask = np.zeros(n, dtype=bool)
+    mask[top] = True
+    return mask
+
+
+def buckets(degree, points, total=None):
+    '''Group the non-empty ids of a degree array by the boundaries in points.
+
+    Returns (order, belong, rate): order holds the non-empty ids by ascending
+    degree (ties by id), belong[n] is the group of order[n] (the number of
+    boundaries below its degree) and rate is the share of total ids (default:
+    all) per group.
+    '''
+    degree = np.asarray(degree)
+    order = np.flatnonzero(degree > 0)
+    order = order[np.argsort(degree[order], kind='stable')]
+    belong = np.searchsorted(np.asarray(points), degree[order], side='left')
+    if total is None:
+        total = len(degree)
+    rate = np.bincount(belong, minlength=len(points) + 1) / (1.0 * total)
+    return order, belong.tolist(), rate.tolist()
+
+
+class PopularityStats(object):
+    '''Degree histograms and top-ratio head sets of a train / test pair.'''
+
+    def __init__(self, train, test, ratios=TOP_RATIOS):
+        self.ratios = list(ratios)
+        n_items = max(train.n_items, test.n_items)
+        self.train_item_degree = item_degree(train, n_items)
+        self.test_item_degree = item_degree(test, n_items)
+        self.train_user_degree = train.user_degree
+        self.test_user_degree = test.user_degree
+        self.n_train, self.n_test = train.nnz, test.nnz
+
+        # the head size is a ratio of the items that occur in the split
+        n_train_items = np.count_nonzero(self.train_item_degree)
+        n_test_items = np.count_nonzero(self.test_item_degree)
+        self.train_top = [top_items(self.train_item_degree, r * n_train_items) for r in self.ratios]
+        self.test_top = [top_items(self.test_item_degree, r * n_test_items) for r in self.ratios]
+        self.train_head = [head_mask(top, n_items) for top in self.train_top]
+        self.test_head = [head_mask(top, n_items) for top in self.test_top]
+
+        # share of the interactions that fall on head items
+        self.train_coverage = [self.train_item_degree[mask].sum() / max(self.n_train, 1) for mask in self.train_head]
+        self.test_coverage = [self.test_item_degree[mask].sum() / max(self.n_test, 1) for mask in self.test_head]
+        self.head_overlap = [int(np.count_nonzero(a & b)) for a, b in zip(self.train_head, self.test_head)]
+
+    def report(self):
+        for i in range(len(self.ratios)):
+            print(self.train_coverage[i], self.test_coverage[i], len(self.train_top[i]), len(self.test_top[i]),
+                  self.head_overlap[i])
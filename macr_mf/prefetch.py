@@ -0,0 +1,99 @@
+'''
+Multi-process prefetching of training batches.
+
+Worker processes run their own batch stream, each with an independently
+seeded RandomState, and write the batches into a ring of shared-memory
+slots. Only slot numbers travel through the queues, so the training loop
+reads batches straight from shared memory without pickling them.
+'''
+import multiprocessing as mp
+import queue
+import traceback
+
+import numpy as np
+
+
+def _worker(make_batches, seed, buffers, shapes, lengths, free, ready):
+    try:
+        rng = np.random.RandomState(seed)
+        slots = [np.frombuffer(buf, dtype=np.int32).reshape(shape) for buf, shape in zip(buffers, shapes)]
+        batches = make_batches(rng)
+        while True:
+            slot = free.get()
+            if slot is None:
+                break
+            batch = next(batches)
+            n = len(batch[0])
+            for field, values in zip(slots, batch):
+                field[slot, :n] = values
+            lengths[slot] = n
+            ready.put(slot)
+    except Exception:
+        # the traceback takes the place of a slot number, get() raises it in the training process
+        ready.put(traceback.format_exc())
+
+
+class Prefetcher(object):
+    '''Iterator over the batches of make_batches(rng) produced by n_workers processes.
+
+    make_batches(rng) returns an endless iterator of tuples of int32 arrays;
+    field k of a batch holds at most shapes[k][0] rows of shape shapes[k][1:].
+    depth slots are in flight at once. close() (or leaving a with block) stops
+    the workers.
+    '''
+
+    def __init__(self, make_batches, shapes, n_workers=1, depth=4, seed=None):
+        ctx = mp.get_context('fork')
+        self.shapes = [(depth,) + tuple(shape) for shape in shapes]
+        self.buffers = [ctx.RawArray('i', int(np.prod(shape))) for shape in self.shapes]
+        self.slots = [np.frombuffer(buf, dtype=np.int32).reshape(shape)
+                      for buf, shape in zip(self.buffers, self.shapes)]
+        self.lengths = ctx.RawArray('l', depth)
+        self.free, self.ready = ctx.Queue(), ctx.Queue()
+        for slot in range(depth):
+            self.free.put(slot)
+
+        # one independent stream per worker, derived from seed
+        seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, n_workers)
+        self.workers = [ctx.Process(target=_worker, args=(make_batches, int(s), self.buffers, self.shapes,
+                                                          self.lengths, self.free, self.ready))
+                        for s in seeds]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def get(self):
+        while True:
+            try:
+                slot = self.ready.get(timeout=1)
+                break
+            except queue.Empty:
+                # a worker killed without a traceback (e.g. by the OOM killer) would block forever
+                dead = [w.exitcode for w in self.workers if w.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError('prefetch worker exited with code %d' % dead[0])
+        if isinstance(slot, str):
+            raise RuntimeError('prefetch worker failed:\n' + slot)
+        n = self.lengths[slot]
+        batch = tuple(field[slot, :n].copy() for field in self.slots)
+        self.free.put(slot)
+        return batch
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+    def close(self):
+        for _ in self.workers:
+            self.free.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,106 @@
+'''
+Per-dataset metadata kept next to the data as dataset.json.
+
+The file records every split file that has been loaded (with its
+fingerprint, size and id counts) and a few statistics; the degree arrays of each
+split sit in the split cache and are memory-mapped on demand. The fixed item
+counts used by the CausalE / IPSmf runs, which used to be hard-coded in the
+loaders, are seeded from FIXED_N_ITEMS when a dataset is first registered
+and are read back from the file afterwards, so they can be edited there.
+'''
+import json
+import os
+
+import numpy as np
+
+from csr_cache import cache_dir_for, fingerprint, load_arrays, save_arrays
+
+META_FILE = 'dataset.json'
+
+# item counts of the embedding tables the CausalE / IPSmf runs were tuned with;
+# lastfm's user_list.json (imb) covers more items than its split files (ori)
+FIXED_N_ITEMS = {
+    'movielens_ml_10m': {'ori': 8790, 'imb': 8790},
+    'movielens_ml_1m': {'ori': 3125, 'imb': 3125},
+    'lastfm': {'ori': 2822, 'imb': 3646},
+    'addressa': {'ori': 744, 'imb': 744},
+    'kwai': {'ori': 80524, 'imb': 80524},
+    'globe': {'ori': 12005, 'imb': 12005},
+}
+
+
+def read(path):
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write(path, meta):
+    filename = os.path.join(path, META_FILE)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+def fixed_n_items(path, dataset, data_type):
+    meta = read(path)
+    if meta is not None and data_type in meta.get('fixed_n_items', {}):
+        return meta['fixed_n_items'][data_type]
+    return FIXED_N_ITEMS.get(dataset, {}).get(data_type)
+
+
+def lookup(path, filenames, suffix=''):
+    '''The metadata if every file is registered with its current fingerprint, else None.
+
+    suffix tells apart the entries of the same file loaded another way (e.g. '.stream', de-duplicated).
+    '''
+    meta = read(path)
+    if meta is None:
+        return None
+    for filename in filenames:
+        entry = meta['splits'].get(os.path.basename(filename) + suffix)
+        if entry is None or entry['source'] != fingerprint(filename):
+            return None
+    return meta
+
+
+def id_space(splits):
+    '''(n_users, n_items) covering every split of (indptr, indices, n_users, n_items).'''
+    return max([int(n) for _, _, n, _ in splits] + [0]), max([int(n) for _, _, _, n in splits] + [0])
+
+
+def register(path, dataset, filenames, splits, suffix=''):
+    '''Record splits ((indptr, indices, n_users, n_items) per file) and their statistics.'''
+    meta = read(path) or {'name': dataset, 'splits': {}}
+    meta.setdefault('fixed_n_items', FIXED_N_ITEMS.get(dataset, {}))
+    for filename, (indptr, indices, n_users, n_items) in zip(filenames, splits):
+        meta['splits'][os.path.basename(filename) + suffix] = {'source': fingerprint(filename), 'n_users': int(n_users),
+                                                      'n_items': int(n_items), 'nnz': int(len(indices))}
+    # the id space of the files loaded together; other registered splits (e.g. skew_train) don't widen it
+    n_users, n_items = id_space(splits)
+
+    for filename, (indptr, indices, _, _) in zip(filenames, splits):
+        name = os.path.basename(filename) + suffix
+        user_degree = np.diff(indptr).astype(np.int32)
+        item_degree = np.bincount(indices, minlength=n_items).astype(np.int32)
+        try:
+            save_arrays(cache_dir_for(filename), name + '.degree', {'user': user_degree, 'item': item_degree},
+                        {'source': meta['splits'][name]['source']})
+        except OSError as e:
+            print('could not write degree arrays for', filename, e)
+        entry = meta['splits'][name]
+        entry['sparsity'] = entry['nnz'] / max(1.0 * n_users * n_items, 1.)
+        entry['max_user_degree'] = int(user_degree.max()) if len(user_degree) else 0
+        entry['max_item_degree'] = int(item_degree.max()) if len(item_degree) else 0
+    write(path, meta)
+    return meta
+
+
+def degrees(filename, suffix=''):
+    '''(user_degree, item_degree) memory maps of a registered split, or None.'''
+    cached = load_arrays(cache_dir_for(filename), os.path.basename(filename) + suffix + '.degree', fingerprint(filename))
+    if cached is None:
+        return None
+    return cached[0]['user'], cached[0]['item']
@@ -0,0 +1,49 @@
+'''
+Compact id remapping for sparse user / item id spaces.
+
+An IdMap keeps the raw ids that actually occur as a sorted array (dense ->
+raw) and a lookup array over the raw range (raw -> dense, -1 when unseen),
+so embeddings, adjacency matrices and score rows can be sized by the number
+of real entities and results translated back at output time.
+'''
+import os
+
+import numpy as np
+
+
+class IdMap(object):
+
+    def __init__(self, raw_ids):
+        self.reverse = np.asarray(raw_ids, dtype=np.int32)
+        size = int(self.reverse[-1]) + 1 if len(self.reverse) else 0
+        self.forward = np.full(size, -1, dtype=np.int32)
+        self.forward[self.reverse] = np.arange(len(self.reverse), dtype=np.int32)
+
+    @classmethod
+    def from_ids(cls, *id_arrays):
+        '''Map over every id that occurs in any of the arrays.'''
+        size = max([int(ids.max()) + 1 for ids in id_arrays if len(ids)] + [0])
+        seen = np.zeros(size, dtype=bool)
+        for ids in id_arrays:
+            seen[ids] = True
+        return cls(np.flatnonzero(seen))
+
+    @classmethod
+    def from_mask(cls, seen):
+        return cls(np.flatnonzero(seen))
+
+    def __len__(self):
+        return len(self.reverse)
+
+    def to_dense(self, raw_ids):
+        return self.forward[np.asarray(raw_ids)]
+
+    def to_raw(self, dense_ids):
+        return self.reverse[np.asarray(dense_ids)]
+
+    def save(self, path, name):
+        np.save(os.path.join(path, name + '_id_map.npy'), self.reverse)
+
+    @classmethod
+    def load(cls, path, name):
+        return cls(np.load(os.path.join(path, name + '_id_map.npy')))
@@ -0,0 +1,77 @@
+'''
+Long-tail resampling of a training split (data_type != 'ori').
+
+Items are ranked by training degree (most popular first, ties by id) and
+every rank gets a user quota from the `exp` or `step` curve; an item keeps
+the last `quota` users of its user-sorted column. The whole split is cut
+with a single mask over the CSC arrays, and the result can be stored with
+csr_cache.save_arrays so sweeps over the curve only pay for the cut.
+'''
+import numpy as np
+
+from interactions import InteractionMatrix
+
+
+def popularity_order(item_degree):
+    return np.argsort(-np.asarray(item_degree), kind='stable')
+
+
+def quota_curve(item_degree, imb_type, lam, user_min, user_max, top_ratio):
+    '''Per-rank user quotas; entry r belongs to the r-th most popular item.'''
+    n_items = len(item_degree)
+    imb_factor = 1.0 * user_min / user_max
+    if imb_type == 'exp':
+        ranks = np.arange(n_items)
+        quota = (user_max * imb_factor ** (lam * ranks / (n_items - 1.0))).astype(np.int64)
+        return np.maximum(quota, 1)
+    elif imb_type == 'step':
+        top_n = int(n_items * top_ratio)
+        # the head is capped at the degree of the first item outside it
+        user_max = item_degree[popularity_order(item_degree)[top_n]]
+        quota = np.full(n_items, int(user_max * imb_factor), dtype=np.int64)
+        quota[:top_n] = int(user_max)
+        return quota
+    raise ValueError('unknown imb_type: {}'.format(imb_type))
+
+
+def long_tail(train, quota, n_items=None):
+    '''Cut train down to the per-rank quotas; items ranked past n_items keep all users.'''
+    if n_items is None:
+        n_items = train.n_items
+    item_degree = train.item_degree.astype(np.int64)
+    order = popularity_order(item_degree[:n_items])
+    quota_by_item = item_degree.copy()
+    quota_by_item[order] = quota[:len(order)]
+
+    items = np.repeat(np.arange(train.n_items, dtype=np.int32), train.item_degree)
+    rank = np.arange(train.nnz) - train.item_indptr[items]
+    keep = rank >= (item_degree - quota_by_item)[items]
+    return InteractionMatrix.from_pairs(train.item_indices[keep], items[keep], train.n_users, train.n_items)
+
+
+def split_rows(user_lists, ratio):
+    '''Split every user's item list at int(len * ratio) into (train, test) matrices.'''
+    lengths = np.array([len(items) for items in user_lists], dtype=np.int64)
+    n_users = len(user_lists)
+    items = np.concatenate([np.asarray(items, dtype=np.int32) for items in user_lists]) if n_users else \
+        np.zeros(0, dtype=np.int32)
+    users = np.repeat(np.arange(n_users, dtype=np.int32), lengths)
+    pos = np.arange(len(items)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    is_train = pos < (lengths * ratio).astype(np.int64)[users]
+    n_items = int(items.max()) + 1 if len(items) else 0
+    return (InteractionMatrix.from_pairs(users[is_train], items[is_train], n_users, n_items),
+            InteractionMatrix.from_pairs(users[~is_train], items[~is_train], n_users, n_items))
+
+
+def to_arrays(matrices):
+    '''{split_indptr: .., split_indices: ..} for csr_cache.save_arrays.'''
+    arrays = {}
+    for name, matrix in matrices.items():
+        arrays[name + '_indptr'] = matrix.indptr
+        arrays[name + '_indices'] = matrix.indices
+    return arrays
+
+
+def from_arrays(arrays, names, n_users, n_items):
+    return [InteractionMatrix(arrays[name + '_indptr'], arrays[name + '_indices'], n_users, n_items)
+            for name in names]
@@ -0,0 +1,165 @@
+'''
+Out-of-core ingestion of adjacency-list logs that do not fit in memory.
+
+The text (plain or .gz) is read in bounded blocks. Parsed (user, item) pairs
+collect until the memory cap, are sorted, de-duplicated and spilled to disk
+as int32 runs. The runs are then merged window by window (a window is a user
+range holding about one run's worth of pairs) straight into the .npy files of
+the split cache, so the result is opened lazily with csr_cache.load_arrays
+like any other cached split. Peak memory stays near the cap.
+
+Streamed splits are de-duplicated, unlike the ones csr_cache.load_csrs parses,
+so they are cached under their own <basename>.stream entry.
+'''
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from csr_cache import array_path, cache_dir_for, fingerprint, load_arrays, write_meta
+from reader import iter_blocks, parse_bytes
+
+MEM_CAP_MB = 1024
+# bytes of working memory per buffered pair: two int32 plus the int64 sort key and its argsort
+BYTES_PER_PAIR = 32
+
+
+def open_text(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _unique_pairs(users, items, n_items):
+    keys = np.unique(users.astype(np.int64) * n_items + items)
+    return (keys // n_items).astype(np.int32), (keys % n_items).astype(np.int32)
+
+
+class RunWriter(object):
+    '''Buffers pairs and spills them as sorted, de-duplicated runs.'''
+
+    def __init__(self, run_dir, max_pairs):
+        self.run_dir = run_dir
+        self.max_pairs = max_pairs
+        self.users, self.items, self.n_buffered = [], [], 0
+        self.runs = []
+        self.user_count = np.zeros(0, dtype=np.int64)
+        self.n_items = 0
+
+    def add(self, users, items):
+        if len(users) == 0:
+            return
+        self.users.append(users)
+        self.items.append(items)
+        self.n_buffered += len(users)
+        self.n_items = max(self.n_items, int(items.max()) + 1)
+        if self.n_buffered >= self.max_pairs:
+            self.spill()
+
+    def spill(self):
+        if self.n_buffered == 0:
+            return
+        users = np.concatenate(self.users)
+        items = np.concatenate(self.items)
+        self.users, self.items, self.n_buffered = [], [], 0
+        # runs are keyed with the largest item id seen so far; any bound works for sorting
+        users, items = _unique_pairs(users, items, self.n_items)
+        count = np.bincount(users)
+        if len(count) > len(self.user_count):
+            self.user_count = np.concatenate((self.user_count, np.zeros(len(count) - len(self.user_count), np.int64)))
+        self.user_count[:len(count)] += count
+        path = os.path.join(self.run_dir, 'run{}'.format(len(self.runs)))
+        np.save(path + '.users.npy', users)
+        np.save(path + '.items.npy', items)
+        self.runs.append(path)
+
+
+def _windows(user_count, max_pairs):
+    '''User ranges [lo, hi) holding about max_pairs (possibly duplicated) pairs each.'''
+    cum = np.cumsum(user_count)
+    if len(cum) == 0:
+        return []
+    cuts = np.searchsorted(cum, np.arange(max_pairs, cum[-1], max_pairs), side='right')
+    bounds = np.unique(np.concatenate(([0], cuts, [len(user_count)])))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _merge_window(runs, lo, hi, n_items):
+    users, items = [], []
+    for run_users, run_items in runs:
+        a, b = np.searchsorted(run_users, [lo, hi])
+        users.append(np.asarray(run_users[a:b]))
+        items.append(np.asarray(run_items[a:b]))
+    return _unique_pairs(np.concatenate(users), np.concatenate(items), n_items)
+
+
+def ingest(filename, cache_dir=None, mem_cap_mb=MEM_CAP_MB, block_size=None, use_cache=True):
+    '''Stream filename into the split cache; returns (indptr, indices, n_users, n_items) memory maps.
+
+    Without use_cache nothing is written next to the data: the runs and arrays go to a
+    scratch directory in the system temp dir (TMPDIR) that is removed once they are mapped.
+    '''
+    name, source = os.path.basename(filename) + '.stream', fingerprint(filename)
+    if not use_cache:
+        scratch = tempfile.mkdtemp(prefix='macr-stream-')
+        try:
+            return ingest(filename, scratch, mem_cap_mb, block_size)
+        finally:
+            # the memory maps stay valid after their files are unlinked
+            shutil.rmtree(scratch, ignore_errors=True)
+    if cache_dir is None:
+        cache_dir = cache_dir_for(filename)
+    cached = load_arrays(cache_dir, name, source)
+    if cached is not None:
+        arrays, meta = cached
+        return arrays['indptr'], arrays['indices'], meta['n_users'], meta['n_items']
+
+    max_pairs = max(1, int(mem_cap_mb * (1 << 20)) // BYTES_PER_PAIR)
+    if block_size is None:
+        # a block of text parses into at most one pair per two bytes
+        block_size = int(min(1 << 24, max(1 << 16, max_pairs)))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    run_dir = tempfile.mkdtemp(prefix=name + '.runs.', dir=cache_dir)
+    try:
+        writer = RunWriter(run_dir, max_pairs)
+        with open_text(filename) as f:
+            for block in iter_blocks(f, block_size):
+                _, users, items = parse_bytes(block)
+                writer.add(users, items)
+        writer.spill()
+        n_users, n_items = len(writer.user_count), writer.n_items
+        runs = [(np.load(path + '.users.npy', mmap_mode='r'), np.load(path + '.items.npy', mmap_mode='r'))
+                for path in writer.runs]
+        windows = _windows(writer.user_count, max_pairs)
+
+        # pass 1 counts the distinct items of every user, pass 2 writes them in place
+        degree = np.zeros(n_users, dtype=np.int64)
+        for lo, hi in windows:
+            users, _ = _merge_window(runs, lo, hi, n_items)
+            degree[lo:hi] = np.bincount(users - lo, minlength=hi - lo)
+        indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(degree, out=indptr[1:])
+        del degree
+
+        indices_path = array_path(cache_dir, name, 'indices')
+        indices = np.lib.format.open_memmap(indices_path + '.tmp', mode='w+', dtype=np.int32,
+                                            shape=(int(indptr[-1]),))
+        for lo, hi in windows:
+            _, items = _merge_window(runs, lo, hi, n_items)
+            indices[indptr[lo]:indptr[hi]] = items
+        indices.flush()
+        del indices, runs
+        os.replace(indices_path + '.tmp', indices_path)
+        indptr_path = array_path(cache_dir, name, 'indptr')
+        np.save(indptr_path + '.tmp.npy', indptr)
+        os.replace(indptr_path + '.tmp.npy', indptr_path)
+        write_meta(cache_dir, name, {'n_users': n_users, 'n_items': n_items, 'source': source},
+                   {'indptr': len(indptr), 'indices': int(indptr[-1])})
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    arrays, meta = load_arrays(cache_dir, name, source)
+    return arrays['indptr'], arrays['indices'], meta['n_users'], meta['n_items']
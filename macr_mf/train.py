@@ -11,6 +11,7 @@ from time import time
 import multiprocessing
 from scipy.special import softmax, expit
 from model import BPRMF, CausalE, IPS_BPRMF, BIASMF
+from pipeline import batch_iterator
 from batch_test import *
 from matplotlib import pyplot as plt
 
@@ -277,7 +278,7 @@ def test(sess, model, test_users, batch_test_flag = False, model_type = 'o', val
                 if i in user_pos_test:
                     item_acc_list[i] += 1/len(data.test_item_list[i])
         with open("mf.txt","w") as f:
-            f.write(str(item_acc_list))
+            f.write(str(dict(zip(data.raw_items(list(item_acc_list.keys())), item_acc_list.values()))))
         exit()
 
         user_batch_rating_uid = zip(rate_batch, user_batch)
@@ -333,6 +334,14 @@ def early_stop(hr, ndcg, recall, precision, cur_epoch, config, stopping_step, fl
 
     return config, stopping_step, should_stop
 
+def train_feeds(model, inputs):
+    # feed_dicts of one training epoch; empty when the model reads its batches from the input pipeline
+    if inputs is not None:
+        return ({} for _ in range(data.n_batches()))
+    return ({model.users: users, model.pos_items: pos_items, model.neg_items: neg_items}
+            for users, pos_items, neg_items in data.train_batches())
+
+
 if __name__ == '__main__':
     # random.seed(123)
     # tf.set_random_seed(123)
@@ -340,10 +349,20 @@ if __name__ == '__main__':
     config = dict()
     config['n_users'] = data.n_users
     config['n_items'] = data.n_items
+    if (args.n_negs > 1 or args.hard_neg > 0) and (args.model == 'IPSmf' or (args.model == 'CausalE' and args.skew != 2)):
+        raise ValueError('n_negs > 1 and hard negatives are only supported by the mf and biasmf models.')
+    if args.sample_workers > 0:
+        # fork the sampling processes before TensorFlow starts its threads
+        data.start_prefetch(args.sample_workers, args.prefetch_depth)
+    inputs = None
+    if args.input_pipeline == 'dataset' and args.hard_neg == 0 and (args.model != 'CausalE' or args.skew == 2):
+        # the training steps read their batches from a tf.data iterator; hard negatives are scored by the
+        # training session itself, and CausalE needs each batch in numpy, so both keep feeding them
+        inputs = batch_iterator(data.stream(), args.n_negs, args.prefetch_depth)
     model_type = ''
     if args.model == 'mf' or (args.model == 'CausalE' and args.skew == 2):
         model_type = 'mf'
-        model = BPRMF(args, config)
+        model = BPRMF(args, config, inputs)
         print('MF model.')
     elif args.model == 'CausalE':
         model_type = 'CausalE'
@@ -361,11 +380,11 @@ if __name__ == '__main__':
                 p_matrix[item] = 1/(data.n_users+1)
             p.append(p_matrix[item])
         # print(p)
-        model = IPS_BPRMF(args, config, p)
+        model = IPS_BPRMF(args, config, p, inputs)
         print('IPS_MF model.')
     elif args.model == 'biasmf':
         model_type = 'mf'
-        model = BIASMF(args, config)
+        model = BIASMF(args, config, inputs)
         print('BIASMF model.')
 
     vars_to_restore = []
@@ -377,6 +396,9 @@ if __name__ == '__main__':
     gpu_config.gpu_options.allow_growth = True
     sess = tf.Session(config = gpu_config)
     sess.run(tf.global_variables_initializer())
+    if args.hard_neg > 0:
+        data.use_hard_negatives(args.hard_neg, args.hard_every, lambda: sess.run(
+            [model.weights['user_embedding'], model.weights['item_embedding']]))
 
     #-----------training without pretrain----------
     if model_type == 'CausalE':
@@ -389,11 +411,10 @@ if __name__ == '__main__':
             for epoch in range(args.epoch):
                 t1 = time()
                 loss, mf_loss, reg_loss, cf_loss = 0., 0., 0., 0.
-                n_batch = data.n_train // args.batch_size + 1
+                n_batch = data.n_batches()
 
-                for idx in range(n_batch):
-                    users, pos_items, neg_items = data.sample()
-                    items = pos_items + neg_items
+                for users, pos_items, neg_items in data.train_batches():
+                    items = np.concatenate((pos_items, neg_items))
                     reg_ids = compute_2i_regularization_id(items, ITEM_NUM)
                     _, batch_loss, batch_mf_loss, batch_reg_loss, batch_cf_loss = sess.run([model.opt, model.loss, model.mf_loss, model.reg_loss, model.cf_loss],
                                     feed_dict = {model.users: users,
@@ -443,6 +464,7 @@ if __name__ == '__main__':
                     if os.path.exists('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID)) == False:
                         os.makedirs('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
                     saver.save(sess, '{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID, epoch))
+                    data.save_id_maps('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
 
                 if should_stop:
                     print("{} dataset best epoch{}: hr:{} ndcg:{} recall:{} precision:{}".format(args.dataset, config['best_epoch'],config['best_hr'],config['best_ndcg'], config['best_recall'], config['best_pre']))
@@ -466,36 +488,25 @@ if __name__ == '__main__':
             for epoch in range(args.epoch):
                 t1 = time()
                 loss, mf_loss, reg_loss = 0., 0., 0.
-                n_batch = data.n_train // args.batch_size + 1
+                n_batch = data.n_batches()
                 
 
-                for idx in range(n_batch):
-                    users, pos_items, neg_items = data.sample()
+                for feed_dict in train_feeds(model, inputs):
                     if args.train=="normal":
                         _, batch_loss, batch_mf_loss, batch_reg_loss = sess.run([model.opt, model.loss, model.mf_loss, model.reg_loss],
-                                        feed_dict = {model.users: users,
-                                                    model.pos_items: pos_items,
-                                                    model.neg_items: neg_items})
+                                        feed_dict = feed_dict)
                     elif args.train=="rubi":
                         _, batch_loss, batch_mf_loss, batch_reg_loss = sess.run([model.opt_two, model.loss_two, model.mf_loss_two, model.reg_loss_two],
-                                        feed_dict = {model.users: users,
-                                                    model.pos_items: pos_items,
-                                                    model.neg_items: neg_items})
+                                        feed_dict = feed_dict)
                     elif args.train=="rubibce":
                         _, batch_loss, batch_mf_loss, batch_reg_loss = sess.run([model.opt_two_bce, model.loss_two_bce, model.mf_loss_two_bce, model.reg_loss_two_bce],
-                                        feed_dict = {model.users: users,
-                                                    model.pos_items: pos_items,
-                                                    model.neg_items: neg_items})   
+                                        feed_dict = feed_dict)
                     elif args.train=="normalbce":
                         _, batch_loss, batch_mf_loss, batch_reg_loss = sess.run([model.opt_bce, model.loss_bce, model.mf_loss_bce, model.reg_loss_bce],
-                                        feed_dict = {model.users: users,
-                                                    model.pos_items: pos_items,
-                                                    model.neg_items: neg_items})
+                                        feed_dict = feed_dict)
                     elif args.train=="rubibceboth":
                         _, batch_loss, batch_mf_loss, batch_reg_loss = sess.run([model.opt_two_bce_both, model.loss_two_bce_both, model.mf_loss_two_bce_both, model.reg_loss_two_bce_both],
-                                        feed_dict = {model.users: users,
-                                                    model.pos_items: pos_items,
-                                                    model.neg_items: neg_items})    
+                                        feed_dict = feed_dict)
                         # print(batch_mf_loss, batch_reg_loss) 
                     # _, batch_loss, batch_mf_loss, batch_reg_loss = sess.run([model.opt_two_bce, model.loss_two_bce, model.mf_loss_ori, model.mf_loss_item],
                     #             feed_dict = {model.users: users,
@@ -644,6 +655,7 @@ if __name__ == '__main__':
                     if os.path.exists('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID)) == False:
                         os.makedirs('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
                     saver.save(sess, '{}_{}_checkpoint/wd_{}_lr_{}_{}/{}_ckpt.ckpt'.format(args.model, args.dataset, args.wd, args.lr, args.saveID, epoch))
+                    data.save_id_maps('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
 
                 if should_stop and args.early_stop == 1:
                     print("{} dataset best epoch{}: hr:{} ndcg:{} recall:{} precision:{}".format(args.dataset, config['best_epoch'],config['best_hr'],config['best_ndcg'], config['best_recall'], config['best_pre']))
@@ -712,6 +724,7 @@ if __name__ == '__main__':
         with open('{}_{}_checkpoint/wd_{}_lr_{}_{}/best_epoch.txt'.format(args.model, args.dataset, args.wd, args.lr, args.saveID),'w') as f:
             print(config['best_epoch'], file = f)
 
+    data.stop_prefetch()
     #!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
     exit()
     
@@ -724,6 +737,7 @@ if __name__ == '__main__':
     saver.restore(sess, model_file)
 
     if args.out == 1:
+        sorted_id, belong, rate, usersorted_id, userbelong, userrate = data.plot_pics(points)
         users_to_test = list(data.test_user_list.keys())
         ret = test(sess, model, users_to_test, valid_set="test")
 
@@ -833,13 +847,13 @@ if __name__ == '__main__':
         with open('./curve/x.txt', 'w') as f:
             f.write(str(x))
         with open('./curve/itemsorted_id.txt', 'w') as f:
-            f.write(str(list(sorted_id)))
+            f.write(str(list(data.raw_items(sorted_id))))
         with open('./curve/itembelong.txt', 'w') as f:
             f.write(str(belong))
         with open('./curve/itemrate.txt'.format(args.train), 'w') as f:
             f.write(str(rate))
         with open('./curve/usersorted_id.txt', 'w') as f:
-            f.write(str(list(usersorted_id)))
+            f.write(str(list(data.raw_users(usersorted_id))))
         with open('./curve/userbelong.txt', 'w') as f:
             f.write(str(userbelong))
         with open('./curve/userrate.txt'.format(args.train), 'w') as f:
@@ -1256,6 +1270,7 @@ if __name__ == '__main__':
                 if os.path.exists('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID)) == False:
                     os.makedirs('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
                 saver.save(sess, '{}_{}_checkpoint/wd_{}_lr_{}_{}/{}_final_ckpt.ckpt'.format(args.model, args.dataset, args.wd, args.lr, args.saveID, epoch))
+                data.save_id_maps('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
 
             if should_stop:
                 print("{} dataset best epoch{}: hr:{} ndcg:{} recall:{} precision:{}".format(args.dataset, config['best_epoch'],config['best_hr'],config['best_ndcg'], config['best_recall'], config['best_pre']))
@@ -1340,6 +1355,7 @@ if __name__ == '__main__':
                 if os.path.exists('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID)) == False:
                     os.makedirs('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
                 saver.save(sess, '{}_{}_checkpoint/wd_{}_lr_{}_{}/{}_final_ckpt.ckpt'.format(args.model, args.dataset, args.wd, args.lr, args.saveID, epoch))
+                data.save_id_maps('{}_{}_checkpoint/wd_{}_lr_{}_{}/'.format(args.model, args.dataset, args.wd, args.lr, args.saveID))
 
             if should_stop:
                 print("{} dataset best epoch{}: hr:{} ndcg:{} recall:{} precision:{}".format(args.dataset, config['best_epoch'],config['best_hr'],config['best_ndcg'], config['best_recall'], config['best_pre']))